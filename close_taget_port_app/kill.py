@@ -1,76 +1,7 @@
-import sys
-import subprocess
-from typing import List
+import os, sys
 
-def get_func_name(stack_depth = 1):
-	"""
-	获得当前函数名
-	stack_depth: 堆栈深度
-	"""
-	try:
-		return sys._getframe(stack_depth).f_code.co_name
-	except Exception as e:
-		print('UIDebug: get_func_name: err msg: %s' % (str(e)))
-		return ''
-
-def _needs_shell(cmd: List[str]) -> bool:
-	"""
-	判断命令是否需要 shell
-	
-	需要 shell 的情况：
-	1. 命令是字符串且包含管道 |
-	2. 命令包含重定向 >, <, >>
-	3. 命令包含 && 或 ||
-	4. 命令包含通配符 * ?
-	"""
-	# 字符串形式：检查是否包含 shell 特殊字符
-	shell_chars = ['|', '>', '<', '&&', '||', ';', '&']
-	for str in cmd:
-		if any(char in str for char in shell_chars):
-			return True
-	return False
-
-def _safe_decode(data: bytes) -> str:
-    """安全解码（尝试多种编码）"""
-    if not data:
-        return ""
-    
-    # 尝试顺序：gbk → utf-8 → latin1
-    encodings = ['gbk', 'utf-8', 'latin1']
-    
-    for encoding in encodings:
-        try:
-            return data.decode(encoding)
-        except (UnicodeDecodeError, AttributeError):
-            continue
-    
-    # 最后兜底：替换错误字符
-    return data.decode('gbk', errors='replace')
-
-
-def run_win_command(command : list):
-	"""执行windows命令，返回输出"""
-	try:
-		# 不弹黑窗口
-		startupinfo = subprocess.STARTUPINFO()
-		startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-		need_shell = _needs_shell(command)
-		print(f"start run_win_command: {need_shell=}")
-		result = subprocess.run(command, 
-						  	capture_output=True, 
-						  	text=False, 
-						  	check=True,
-							# encoding='utf-8',
-							startupinfo=startupinfo,
-							shell=True
-						  )
-		output = _safe_decode(result.stdout)
-		return output
-	except subprocess.CalledProcessError as e:
-		print(f"func:{get_func_name(2)} run_win_command CalledProcessError: {e}")
-	except Exception as e:
-		print(f"func:{get_func_name(2)} run_win_command error: {e}")
-	return ''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.command_runner import run_win_command
 
 def extract_pids(netstat_output: str) -> int:
 	"""从 netstat 输出中提取所有 PID"""
@@ -92,7 +23,8 @@ def extract_pids(netstat_output: str) -> int:
 
 def get_max_num_pid(port : int):
 	command = ["netstat", "-ano", "|", "findstr", f":{port}"]
-	output = run_win_command(command)
+	# 管道需要 shell 执行
+	output = run_win_command(command, shell=True)
 	max_pid = extract_pids(output)
 	print(f"get_max_num_pid max_pid: {max_pid}")
 	return max_pid
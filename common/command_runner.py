@@ -0,0 +1,300 @@
+"""
+	所有工具共用的命令执行
+	基于 asyncio.create_subprocess_exec，全局信号量限制同时运行的子进程数，每条命令可以单独设置超时，
+	支持逐行读取输出；输出编码每个程序只检测一次，之后直接解码，不用每次都尝试多种编码
+	同步代码通过 run_command/run_commands/iter_command_lines 调用，内部在一个常驻的事件循环线程中执行，
+	多个线程同时调用时也共用同一个信号量；自己启动子进程的同步代码用 command_slot 占用同一个信号量
+	开启 tracing 时每条命令记录耗时、退出码和输出字节数(见 tracing.py)
+	用法:
+		output = run_win_command(['p4', 'info'])
+		results = run_commands([['p4', 'where', a], ['p4', 'where', b]])
+		results = await asyncio.gather(run_command_async(cmd1), run_command_async(cmd2))
+"""
+import os, sys, locale, asyncio, threading, subprocess, weakref, contextlib
+from collections import namedtuple
+from . import tracing
+
+# 同时运行的子进程数上限，可用环境变量 COMMAND_RUNNER_CONCURRENCY 覆盖
+DEFAULT_CONCURRENCY = 8
+# 检测编码时依次尝试，系统编码在 Windows 中文环境下为 gbk/cp936
+UTF8_ENCODING = 'utf-8'
+STREAM_LIMIT = 1024 * 1024
+
+CommandResult = namedtuple('CommandResult', ['command', 'returncode', 'stdout', 'stderr'])
+
+class CommandError(Exception):
+	""" 命令启动失败或返回非0退出码 """
+	def __init__(self, command, returncode = None, stderr = '', message = ''):
+		self.command = command
+		self.returncode = returncode
+		self.stderr = stderr
+		super().__init__(message or f'{command} exit code {returncode} {stderr.strip()}')
+
+class CommandTimeoutError(CommandError):
+	""" 命令超时，子进程已被杀掉 """
+	def __init__(self, command, timeout):
+		self.timeout = timeout
+		super().__init__(command, message=f'{command} timeout after {timeout}s')
+
+def get_func_name(stack_depth = 1):
+	"""
+	获得当前函数名
+	stack_depth: 堆栈深度
+	"""
+	try:
+		return sys._getframe(stack_depth).f_code.co_name
+	except Exception as e:
+		print('UIDebug: get_func_name: err msg: %s' % (str(e)))
+		return ''
+
+def get_startupinfo():
+	"""不弹黑窗口，非Windows平台返回None"""
+	if not hasattr(subprocess, 'STARTUPINFO'):
+		return None
+	startupinfo = subprocess.STARTUPINFO()
+	startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+	return startupinfo
+
+def get_default_concurrency():
+	try:
+		return max(1, int(os.environ.get('COMMAND_RUNNER_CONCURRENCY', DEFAULT_CONCURRENCY)))
+	except ValueError:
+		return DEFAULT_CONCURRENCY
+
+def needs_shell(command) -> bool:
+	"""
+	字符串命令用 shell 执行，参数列表直接执行
+	参数中的 | & ; 等字符不会切换到 shell(参数可能来自用户输入)，需要管道时调用方显式传入 shell=True
+	"""
+	return isinstance(command, str)
+
+# ---------------- 编码 ----------------
+
+# {程序名: 编码}，每个程序第一次有输出时检测
+_encoding_cache = {}
+
+def _get_program_name(command):
+	if isinstance(command, str):
+		command = command.split()
+	if not command:
+		return ''
+	return os.path.splitext(os.path.basename(command[0]))[0].lower()
+
+def detect_encoding(data : bytes) -> str:
+	""" 能按 utf-8 解码时使用 utf-8，否则使用系统编码(Windows 命令行工具一般输出 gbk) """
+	try:
+		data.decode(UTF8_ENCODING)
+		return UTF8_ENCODING
+	except UnicodeDecodeError:
+		return locale.getpreferredencoding(False) or 'latin1'
+
+def get_encoding(command, data : bytes = b'', encoding = None):
+	""" 指定了编码时直接使用，否则每个程序只检测一次 """
+	if encoding:
+		return encoding
+	program_name = _get_program_name(command)
+	cached = _encoding_cache.get(program_name)
+	if cached is not None:
+		return cached
+	if not data or data.isascii():
+		# 纯 ascii 的输出区分不了编码，等下次有非 ascii 输出时再检测
+		return UTF8_ENCODING
+	detected = detect_encoding(data)
+	_encoding_cache[program_name] = detected
+	return detected
+
+def decode_output(command, data : bytes, encoding = None) -> str:
+	if not data:
+		return ''
+	return data.decode(get_encoding(command, data, encoding), errors='replace')
+
+# ---------------- async ----------------
+
+# 每个事件循环一个信号量(asyncio.Semaphore 不能跨事件循环使用)
+_semaphores = weakref.WeakKeyDictionary()
+_concurrency = get_default_concurrency()
+
+def set_concurrency(concurrency : int):
+	""" 修改同时运行的子进程数上限，只影响之后新建的信号量 """
+	global _concurrency
+	_concurrency = max(1, concurrency)
+	_semaphores.clear()
+
+def _get_semaphore() -> asyncio.Semaphore:
+	loop = asyncio.get_running_loop()
+	semaphore = _semaphores.get(loop)
+	if semaphore is None:
+		semaphore = asyncio.Semaphore(_concurrency)
+		_semaphores[loop] = semaphore
+	return semaphore
+
+async def _create_process(command, stdin, stderr, shell = None):
+	if shell is None:
+		shell = needs_shell(command)
+	kwargs = {'stdout': subprocess.PIPE, 'stdin': stdin, 'stderr': stderr, 'limit': STREAM_LIMIT}
+	startupinfo = get_startupinfo()
+	if startupinfo is not None:
+		kwargs['startupinfo'] = startupinfo
+	try:
+		if shell:
+			command_line = command if isinstance(command, str) else subprocess.list2cmdline(command)
+			return await asyncio.create_subprocess_shell(command_line, **kwargs)
+		return await asyncio.create_subprocess_exec(*command, **kwargs)
+	except OSError as e:
+		raise CommandError(command, message=f'{command} start failed: {e}') from e
+
+async def _kill(process):
+	if process.returncode is None:
+		try:
+			process.kill()
+		except ProcessLookupError:
+			pass
+		await process.wait()
+
+async def run_command_async(command, input_text : str = None, timeout = None, encoding = None, check = True, shell = None) -> CommandResult:
+	"""
+	执行命令并等待结束，返回 CommandResult(stdout/stderr 为 str)
+	input_text: 写入stdin的内容，配合 p4 -x - 使用
+	timeout: 超时时间(秒)，超时杀掉子进程并抛出 CommandTimeoutError
+	encoding: 输出编码，为None时自动检测
+	check: 为True时非0退出码抛出 CommandError
+	shell: 为None时字符串命令用 shell 执行，参数列表直接执行
+	"""
+	async with _get_semaphore():
+		with tracing.command_span(command) as span:
+			process = await _create_process(command, subprocess.PIPE if input_text is not None else subprocess.DEVNULL, subprocess.PIPE, shell)
+			input_data = None
+			if input_text is not None:
+				input_data = input_text.encode(encoding or UTF8_ENCODING)
+			try:
+				stdout, stderr = await asyncio.wait_for(process.communicate(input_data), timeout)
+			except asyncio.TimeoutError:
+				await _kill(process)
+				raise CommandTimeoutError(command, timeout) from None
+			except BaseException:
+				await _kill(process)
+				raise
+			span.set(returncode=process.returncode, output_bytes=len(stdout))
+	result = CommandResult(command, process.returncode, decode_output(command, stdout, encoding), decode_output(command, stderr, encoding))
+	if check and result.returncode != 0:
+		raise CommandError(command, result.returncode, result.stderr)
+	return result
+
+async def iter_command_lines_async(command, timeout = None, encoding = None, check = True, shell = None):
+	"""
+	执行命令并逐行返回输出(去掉换行符)，不会把整个输出读进内存
+	timeout 为整个命令的超时时间，调用方提前停止迭代时杀掉进程
+	check: 为True时读完输出后非0退出码抛出 CommandError(带 stderr)
+	"""
+	async with _get_semaphore():
+		with tracing.command_span(command) as span:
+			process = await _create_process(command, subprocess.DEVNULL, subprocess.PIPE, shell)
+			# stderr 在后台读完，避免写满管道时子进程卡住
+			stderr_task = asyncio.ensure_future(process.stderr.read())
+			loop = asyncio.get_running_loop()
+			deadline = None if timeout is None else loop.time() + timeout
+			output_bytes = 0
+			try:
+				while True:
+					remaining = None if deadline is None else max(0, deadline - loop.time())
+					try:
+						line = await asyncio.wait_for(process.stdout.readline(), remaining)
+					except asyncio.TimeoutError:
+						raise CommandTimeoutError(command, timeout) from None
+					if not line:
+						break
+					output_bytes += len(line)
+					yield decode_output(command, line, encoding).rstrip('\r\n')
+				await process.wait()
+				stderr = await stderr_task
+			finally:
+				await _kill(process)
+				stderr_task.cancel()
+				span.set(returncode=process.returncode, output_bytes=output_bytes)
+	if check and process.returncode != 0:
+		raise CommandError(command, process.returncode, decode_output(command, stderr, encoding))
+
+# ---------------- 同步接口 ----------------
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_loop():
+	""" 同步接口共用的常驻事件循环，在后台线程中运行 """
+	global _loop
+	with _loop_lock:
+		if _loop is None:
+			if sys.platform == 'win32':
+				_loop = asyncio.ProactorEventLoop()
+			else:
+				_loop = asyncio.new_event_loop()
+			threading.Thread(target=_loop.run_forever, name='command_runner', daemon=True).start()
+	return _loop
+
+def _run_sync(coroutine):
+	return asyncio.run_coroutine_threadsafe(coroutine, _get_loop()).result()
+
+def run_command(command, input_text : str = None, timeout = None, encoding = None, check = True, shell = None) -> CommandResult:
+	""" run_command_async 的同步版本 """
+	return _run_sync(run_command_async(command, input_text, timeout, encoding, check, shell))
+
+def run_commands(commands : list, input_texts : list = None, timeout = None, encoding = None, check = True, shell = None) -> list:
+	"""
+	并发执行多条命令(受全局信号量限制)，按顺序返回结果
+	失败的命令对应位置为异常对象，不会影响其他命令
+	"""
+	if input_texts is None:
+		input_texts = [None] * len(commands)
+	async def run_all():
+		return await asyncio.gather(*[run_command_async(command, input_text, timeout, encoding, check, shell) for command, input_text in zip(commands, input_texts)], return_exceptions=True)
+	return _run_sync(run_all())
+
+def iter_command_lines(command, timeout = None, encoding = None, check = True, shell = None):
+	""" iter_command_lines_async 的同步版本，调用方提前停止迭代时杀掉进程 """
+	lines = iter_command_lines_async(command, timeout, encoding, check, shell)
+	try:
+		while True:
+			try:
+				yield _run_sync(lines.__anext__())
+			except StopAsyncIteration:
+				return
+	finally:
+		_run_sync(lines.aclose())
+
+@contextlib.contextmanager
+def command_slot():
+	"""
+	同步代码自己启动子进程时(例如 p4 -G 需要读取二进制管道)占用一个并发名额，
+	与同步接口共用常驻事件循环中的信号量，不能在事件循环线程中调用
+	"""
+	async def acquire():
+		semaphore = _get_semaphore()
+		await semaphore.acquire()
+		return semaphore
+	semaphore = _run_sync(acquire())
+	try:
+		yield
+	finally:
+		_get_loop().call_soon_threadsafe(semaphore.release)
+
+def run_win_command(command, input_text : str = None, check = True, timeout = None, raise_error = False, encoding = None, shell = None):
+	"""
+	执行windows命令，返回输出，出错时打印错误并返回空字符串
+	input_text: 写入stdin的内容，配合 p4 -x - 使用
+	check: 为False时非0退出码也返回stdout（p4 where 部分文件不在view中时会返回1）
+	timeout: 超时时间(秒)，超时会杀掉子进程
+	raise_error: 为True时出错后抛出异常，而不是返回空字符串
+	encoding: 输出编码，为None时自动检测
+	shell: 参数列表中有管道等需要 shell 时传入True
+	"""
+	try:
+		return run_command(command, input_text, timeout, encoding, check, shell).stdout
+	except CommandError as e:
+		print(f"func:{get_func_name(2)} run_win_command CommandError: {e}")
+		if raise_error:
+			raise
+	except Exception as e:
+		print(f"func:{get_func_name(2)} run_win_command error: {e}")
+		if raise_error:
+			raise
+	return ''
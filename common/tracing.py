@@ -0,0 +1,197 @@
+"""
+	耗时统计
+	记录每个阶段和每条子进程命令的耗时(span)，结束时打印汇总表，也可以导出 Chrome trace(chrome://tracing 或 Perfetto 打开)
+	默认关闭，关闭时 span() 返回同一个空对象，只多一次全局变量判断
+	开启: 环境变量 OVERLAY_TRACE=1(只打印汇总) 或 OVERLAY_TRACE=trace.json(同时导出)，或调用 enable()
+	用法:
+		with tracing.span('describe', changelist=cl):
+			...
+		with tracing.command_span(command) as span:
+			...
+			span.set(returncode=0, output_bytes=len(stdout))
+"""
+import os, json, time, threading
+
+TRACE_ENV_NAME = 'OVERLAY_TRACE'
+CATEGORY_PHASE = 'phase'
+CATEGORY_COMMAND = 'command'
+# 命令名中保留的参数个数，例如 p4 -G print -> p4 print
+COMMAND_NAME_ARGS = 1
+
+class _NullSpan:
+	""" 关闭时使用的空 span """
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+	def set(self, **args):
+		pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+	__slots__ = ('tracer', 'name', 'category', 'args', 'start', 'duration', 'thread_id')
+
+	def __init__(self, tracer, name, category, args):
+		self.tracer = tracer
+		self.name = name
+		self.category = category
+		self.args = args
+		self.start = 0.0
+		self.duration = 0.0
+		self.thread_id = 0
+
+	def set(self, **args):
+		self.args.update(args)
+
+	def __enter__(self):
+		self.thread_id = threading.get_ident()
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.duration = time.perf_counter() - self.start
+		# 生成器被调用方提前关闭(GeneratorExit)不算出错
+		if exc_type is not None and exc_type is not GeneratorExit and 'error' not in self.args:
+			self.args['error'] = exc_type.__name__
+		self.tracer.add(self)
+		return False
+
+class Tracer:
+	def __init__(self, trace_path = None):
+		self.trace_path = trace_path
+		self.spans = []
+		self.origin = time.perf_counter()
+		self._lock = threading.Lock()
+
+	def add(self, span : Span):
+		with self._lock:
+			self.spans.append(span)
+
+	def summary_rows(self) -> list:
+		""" 按 (分类, 名称) 汇总，返回 [(分类, 名称, 次数, 总耗时, 最大耗时, 输出字节数, 失败次数)]，按总耗时排序 """
+		rows = {}
+		with self._lock:
+			spans = list(self.spans)
+		for span in spans:
+			key = (span.category, span.name)
+			row = rows.get(key)
+			if row is None:
+				row = rows[key] = [span.category, span.name, 0, 0.0, 0.0, 0, 0]
+			row[2] += 1
+			row[3] += span.duration
+			row[4] = max(row[4], span.duration)
+			row[5] += span.args.get('output_bytes') or 0
+			if span.args.get('error') or span.args.get('returncode') not in (None, 0):
+				row[6] += 1
+		return sorted((tuple(row) for row in rows.values()), key=lambda row: (row[0] != CATEGORY_PHASE, -row[3]))
+
+	def print_summary(self):
+		rows = self.summary_rows()
+		if not rows:
+			return
+		print()
+		print(f"{'category':<8} {'name':<32} {'count':>6} {'total(s)':>9} {'max(s)':>8} {'output':>10} {'failed':>6}")
+		for category, name, count, total, maximum, output_bytes, failed in rows:
+			print(f"{category:<8} {name[:32]:<32} {count:>6} {total:>9.3f} {maximum:>8.3f} {output_bytes:>10} {failed:>6}")
+		print(f"total wall time {time.perf_counter() - self.origin:.3f}s")
+
+	def to_chrome_trace(self) -> dict:
+		""" Chrome trace 格式，每个 span 为一个 complete 事件(ph=X)，时间单位为微秒 """
+		process_id = os.getpid()
+		events = []
+		with self._lock:
+			spans = list(self.spans)
+		for span in sorted(spans, key=lambda span: span.start):
+			events.append({
+				'name': span.name,
+				'cat': span.category,
+				'ph': 'X',
+				'ts': round((span.start - self.origin) * 1e6, 1),
+				'dur': round(span.duration * 1e6, 1),
+				'pid': process_id,
+				'tid': span.thread_id,
+				'args': {key: value if isinstance(value, (int, float, bool, type(None))) else str(value) for key, value in span.args.items()},
+			})
+		return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+	def write_chrome_trace(self, trace_path = None):
+		trace_path = trace_path or self.trace_path
+		if not trace_path:
+			return
+		with open(trace_path, 'w', encoding='utf-8') as f:
+			json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+		print(f"trace 已写入 {trace_path}")
+
+# 为None时关闭
+_tracer = None
+
+def enable(trace_path = None) -> Tracer:
+	""" 开启统计，trace_path 不为空时 finish() 导出 Chrome trace """
+	global _tracer
+	_tracer = Tracer(trace_path)
+	return _tracer
+
+def enable_from_env():
+	""" 按环境变量 OVERLAY_TRACE 开启，值为 1 时只打印汇总，其他值作为 trace 文件路径 """
+	value = os.environ.get(TRACE_ENV_NAME, '')
+	if value and value != '0':
+		return enable(None if value == '1' else value)
+	return None
+
+def disable():
+	global _tracer
+	_tracer = None
+
+def is_enabled() -> bool:
+	return _tracer is not None
+
+def get_tracer() -> Tracer:
+	return _tracer
+
+def span(name, category = CATEGORY_PHASE, **args):
+	if _tracer is None:
+		return _NULL_SPAN
+	return Span(_tracer, name, category, args)
+
+def get_command_name(command) -> str:
+	""" 程序名加第一个非选项参数，例如 ['p4', '-G', '-x', '-', 'print'] -> 'p4 print' """
+	if isinstance(command, str):
+		command = command.split()
+	if not command:
+		return ''
+	parts = [os.path.splitext(os.path.basename(command[0]))[0]]
+	skip_next = False
+	for arg in command[1:]:
+		if len(parts) > COMMAND_NAME_ARGS:
+			break
+		if skip_next:
+			skip_next = False
+			continue
+		if arg.startswith('-'):
+			# p4 的全局选项 -x/-c/-p/-u 带一个参数
+			skip_next = arg in ('-x', '-c', '-p', '-u', '-z')
+			continue
+		parts.append(arg)
+	return ' '.join(parts)
+
+def command_span(command):
+	""" 子进程命令的 span，名称见 get_command_name，完整命令记录在 args 中 """
+	if _tracer is None:
+		return _NULL_SPAN
+	return Span(_tracer, get_command_name(command), CATEGORY_COMMAND, {'command': command if isinstance(command, str) else ' '.join(command)})
+
+def finish(tracer : Tracer = None):
+	""" 打印汇总并导出 trace，没有开启时不做任何事 """
+	tracer = tracer or _tracer
+	if tracer is None:
+		return
+	tracer.print_summary()
+	try:
+		tracer.write_chrome_trace()
+	except OSError as e:
+		print(f"trace 写入失败 {e}")
@@ -1,51 +1,69 @@
 import re, os, sys
+import overlay_daemon
+
+if __name__ == "__main__":
+	# 客户端只需要 overlay_daemon，能转发给常驻进程时不导入构建相关的模块
+	_client_exit_code = overlay_daemon.run_client(sys.argv[1:])
+	if _client_exit_code is not None:
+		sys.exit(_client_exit_code)
+
 import subprocess
-import argparse
+import argparse, functools, threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from file_cache import FileCache, make_cache_key, print_cache_stats
+from changelist_cache import ChangelistCache
+from client_view import ClientViewCache
+from overlay_manifest import OverlayManifest, make_local_source, make_depot_source
+from overlay_archive import OverlayArchive, OverlayOutput, DEFAULT_COMPRESS_LEVEL
+from overlay_copy import copy_files
+from overlay_downloader import DownloadTask, DownloadError, StreamingDownloader, print_download_progress
+from p4_marshal import iter_p4_marshal, P4MarshalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.command_runner import get_func_name, run_win_command, run_commands, iter_command_lines, CommandError
+from common import tracing
 
 def normalize_path(path):
 	import os
 	return os.path.normpath(path).replace('\\', '/')
 
-def get_func_name(stack_depth = 1):
-	"""
-	获得当前函数名
-	stack_depth: 堆栈深度
-	"""
-	try:
-		return sys._getframe(stack_depth).f_code.co_name
-	except Exception as e:
-		print('UIDebug: get_func_name: err msg: %s' % (str(e)))
-		return ''
-
 def to_win_cmd_path(path):
 	"""将路径转换为Windows命令行格式"""
 	path = normalize_path(path)
 	import os
 	return os.path.normpath(path).replace('/', '//')
 
-def run_win_command(command : list):
-	"""执行windows命令，返回输出"""
+# 使用 p4 -G 结构化输出，为False时回退到解析文本输出
+USE_P4_MARSHAL = True
+# 用缓存的 client View 在本地转换 depot 路径，为False时通过 p4 where 转换
+USE_CLIENT_VIEW = True
+# 不需要下载的文件操作，purge 的版本内容已被清除，p4 print 取不到
+DELETE_ACTIONS = ('delete', 'move/delete', 'purge')
+
+def iter_p4_records(command : list, input_text : str = None, timeout = None):
+	"""执行 p4 -G 命令，逐条返回记录dict，error记录和执行失败只打印不抛出"""
 	try:
-		# 不弹黑窗口
-		startupinfo = subprocess.STARTUPINFO()
-		startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-		result = subprocess.run(command, 
-						  	capture_output=True, 
-						  	text=True, 
-						  	check=True,
-							encoding='utf-8',
-							startupinfo=startupinfo,
-						  )
-		output = result.stdout
-		return output
-	except subprocess.CalledProcessError as e:
-		print(f"func:{get_func_name(2)} run_win_command CalledProcessError: {e}")
-	except Exception as e:
-		print(f"func:{get_func_name(2)} run_win_command error: {e}")
-	return []
+		for record in iter_p4_marshal(command, input_text, timeout):
+			if record.get('code') == 'error':
+				print(f"func:{get_func_name(2)} p4 error: {record.get('data', '').strip()}")
+				continue
+			yield record
+	except (P4MarshalError, OSError) as e:
+		print(f"func:{get_func_name(2)} iter_p4_records error: {e}")
+
+def is_wanted_depot_file(depot_path:str, action:str):
+	""" 只需要没有被删除的py文件 """
+	return action.lower() not in DELETE_ACTIONS and depot_path.endswith('.py')
 
 def get_current_branch_name():
+	if USE_P4_MARSHAL:
+		for record in iter_p4_records(["p4", "info"]):
+			if record.get('clientStream'):
+				return record['clientStream']
+		print("Could not find Client stream in p4 info output")
+		return ''
+
 	# 运行 p4 info 命令
 	command = ["p4", "info"]
 	output = run_win_command(command)
@@ -83,18 +101,17 @@ def get_full_path():
 	return normalize_path(parent_directory)
 
 def py_depot_path_to_relative_path(depot_path:str, need_file_name=True):
+	""" 返回从第一个 Scripts 目录开始的路径 """
 	file_path = normalize_path(depot_path)
-	parts = file_path.split('/')
-	try:
-		index = parts.index('Scripts')
-		if need_file_name:
-			path = '/'.join(parts[index:])
-		else:
-			path = '/'.join(parts[index:-1])
-		return path
-	except ValueError:
+	# 首尾加上 / 后查找 /Scripts/，与按 / 切分后查找 Scripts 段的结果一致，不需要切分整个路径
+	index = ('/' + file_path + '/').find('/Scripts/')
+	if index < 0:
 		print(f"Could not find UnrealEngine in path: {depot_path}")
 		return ''
+	path = file_path[index:]
+	if need_file_name:
+		return path
+	return path.rpartition('/')[0]
 
 def filter_depot_file_paths(depot_files):
 	if depot_files:
@@ -103,20 +120,138 @@ def filter_depot_file_paths(depot_files):
 		for line in depot_files.split('\n'):
 			line = line.strip()
 			if line and not line.startswith('... #'):
-				action_and_file = line.split()
-				if len(action_and_file) >= 3:
-					file_path:str
-					action, file_path = action_and_file[2], action_and_file[0]
-					if action.lower() != 'delete':
-						real_file_path = file_path.split('#')[0]
-						if real_file_path.endswith('.py'):
-							files.append(real_file_path)
+				# depot路径中的#会被转义为%23，按第一个#切分，路径中有空格也不影响
+				real_file_path, _, rev_and_action = line.partition('#')
+				rev_and_action = rev_and_action.split()
+				if len(rev_and_action) >= 3 and is_wanted_depot_file(real_file_path, rev_and_action[2]):
+					files.append(real_file_path)
 		return files
 	else:
 		return []
 
-def get_single_changelist_local_changelist_files(workspace_name, changelist_num) -> list[tuple]:
-	""" 获取本地文件列表 """
+# 单次 p4 where 传入的文件数上限，避免单个请求过大
+P4_WHERE_BATCH_SIZE = 500
+
+def parse_ztag_records(output:str) -> list[dict]:
+	"""解析 p4 -ztag 输出，每条记录为一个dict"""
+	records = []
+	record = {}
+	for line in output.split('\n'):
+		line = line.rstrip('\r')
+		if not line.startswith('... '):
+			if not line and record:
+				records.append(record)
+				record = {}
+			continue
+		key, _, value = line[4:].partition(' ')
+		if key in record:
+			# 没有空行分隔的情况下，重复的key代表新的记录
+			records.append(record)
+			record = {}
+		record[key] = value
+	if record:
+		records.append(record)
+	return records
+
+def where_depot_files(workspace_name, depot_paths:list, batch_size = P4_WHERE_BATCH_SIZE) -> list[tuple]:
+	"""
+	批量把depot路径转换为本地路径，返回 (depot_path, local_path) 列表
+	通过 p4 -x - 从stdin传入文件列表，每batch_size个文件只启动一次p4
+	使用 -ztag 输出，每个字段独占一行，路径中包含空格也能正确解析
+	多个批次并发执行
+	"""
+	command = [
+		"p4",
+		"-ztag",
+		"-c",
+		workspace_name,
+		"-x",
+		"-",
+		"where"
+	]
+	chunks = [depot_paths[start:start + batch_size] for start in range(0, len(depot_paths), batch_size)]
+	results = run_commands([command] * len(chunks), ['\n'.join(chunk) + '\n' for chunk in chunks], check=False)
+	result_files = []
+	for chunk, result in zip(chunks, results):
+		if isinstance(result, Exception):
+			print(f"func:{get_func_name(1)} p4 where error: {result}")
+			continue
+		output = result.stdout
+		if not output:
+			continue
+		local_path_dict = {}
+		for record in parse_ztag_records(output):
+			# unmap 为 view 中 - 开头的排除映射
+			if 'unmap' in record or 'depotFile' not in record or 'path' not in record:
+				continue
+			local_path_dict[record['depotFile']] = record['path']
+		for depot_path in chunk:
+			if depot_path in local_path_dict:
+				result_files.append((depot_path, local_path_dict[depot_path]))
+			else:
+				print(f"p4 where 没有找到本地路径: {depot_path}")
+	return result_files
+
+def where_depot_file(workspace_name, depot_path):
+	""" 单个文件执行 p4 where，返回本地路径 """
+	command = [
+		"p4",
+		"-c",
+		workspace_name,
+		"where",
+		depot_path
+	]
+	output = run_win_command(command)
+	print(f" {output=}")
+	if not output:
+		return ''
+	return output.split()[2]
+
+def map_depot_files_to_local(workspace_name, depot_paths:list, client_view_cache : ClientViewCache = None) -> list[tuple]:
+	"""
+	用 client View 在本地把depot路径转换为本地路径，返回 (depot_path, local_path) 列表
+	opened 的文件本地一定存在，转换不了或本地文件不存在时说明缓存的 View 可能已经修改，
+	重新获取一次 View，仍然不行的文件再用 p4 where
+	"""
+	if not depot_paths:
+		return []
+	if client_view_cache is None:
+		client_view_cache = ClientViewCache()
+	mapped_files = {}
+	pending_paths = depot_paths
+	for refresh in (False, True):
+		client_view = client_view_cache.get(workspace_name, refresh)
+		if client_view is None:
+			break
+		missing_paths = []
+		for depot_path in pending_paths:
+			local_path = client_view.depot_to_local(depot_path)
+			if local_path and os.path.exists(local_path):
+				mapped_files[depot_path] = local_path
+			else:
+				missing_paths.append(depot_path)
+		pending_paths = missing_paths
+		if not pending_paths:
+			break
+	if pending_paths:
+		print(f"client View 没有找到 {len(pending_paths)} 个文件，使用 p4 where")
+		mapped_files.update(where_depot_files(workspace_name, pending_paths))
+	return [(depot_path, mapped_files[depot_path]) for depot_path in depot_paths if depot_path in mapped_files]
+
+def filter_opened_records(records) -> list:
+	""" 从 p4 -G opened 的记录中筛选需要的文件 """
+	files = []
+	for record in records:
+		depot_path = record.get('depotFile', '')
+		if depot_path and is_wanted_depot_file(depot_path, record.get('action', '')):
+			files.append(depot_path)
+	return files
+
+def get_single_changelist_local_changelist_files(workspace_name, changelist_num, batch_where = True, client_view_cache : ClientViewCache = None) -> list[tuple]:
+	""" 
+	获取本地文件列表 
+	batch_where: 为True时用 client View 在本地转换(USE_CLIENT_VIEW)或所有文件合并成一次(或按批次)p4 where，否则每个文件单独执行
+	"""
 	command = [
 		"p4",
 		"-c",
@@ -125,99 +260,269 @@ def get_single_changelist_local_changelist_files(workspace_name, changelist_num)
 		"-c",
 		str(changelist_num)
 	]
-	output = run_win_command(command)
-	filted_depot_files = filter_depot_file_paths(output)
+	if USE_P4_MARSHAL:
+		filted_depot_files = filter_opened_records(iter_p4_records(command))
+	else:
+		output = run_win_command(command)
+		filted_depot_files = filter_depot_file_paths(output)
+	if batch_where:
+		if USE_CLIENT_VIEW:
+			return map_depot_files_to_local(workspace_name, filted_depot_files, client_view_cache)
+		return where_depot_files(workspace_name, filted_depot_files)
+
 	result_files = []
 	for file_path in filted_depot_files:
-		command = [
-			"p4",
-			"-c",
-			workspace_name,
-			"where",
-			file_path
-		]
-		output = run_win_command(command)
-		print(f" {output=}")
-		if not output:
+		real_path = where_depot_file(workspace_name, file_path)
+		if not real_path:
 			continue
-		real_path = output.split()[2]
 		result_files.append((file_path, real_path))
 	return result_files
 
-def get_local_changelist_files(workspace_name, changelist_num_list) -> list[tuple]:
+def get_local_changelist_files(workspace_name, changelist_num_list, batch_where = True, client_view_cache : ClientViewCache = None) -> list[tuple]:
 	""" 获取本地文件列表 """
+	if client_view_cache is None and USE_CLIENT_VIEW:
+		# 所有changelist共用同一份 View
+		client_view_cache = ClientViewCache()
 	result_files = []
 	for changelist_num in changelist_num_list:
-		files = get_single_changelist_local_changelist_files(workspace_name, changelist_num)
+		files = get_single_changelist_local_changelist_files(workspace_name, changelist_num, batch_where, client_view_cache)
 		result_files.extend(files)
 	return list(set(result_files))
 
-def get_server_changelist_file_dict(changelist_num_list):
-	def extract_affected_files(text):
-		# 使用正则表达式匹配 "Affected files ..." 和下一个空行之间的内容
-		pattern = r"Affected files \.\.\.(.+?)(?:\n\s*\n|\Z)"
-		match = re.search(pattern, text, re.DOTALL)
-		if not match:
-			# 如果没找到提交影响文件，下降查找shelve file
-			pattern = r"Shelved files \.\.\.(.+?)(?:\n\s*\n|\Z)"
-			match = re.search(pattern, text, re.DOTALL)
-		if match:
-			affected_files = match.group(1).strip()
-			if affected_files:
-				# 分割成行并去除每行开头的空白字符
-				file_dict = {}
-				for line in affected_files.split('\n'):
-					line = line.strip()
-					if line and not line.startswith('... #'):
-						action_and_file = line.split()
-						if len(action_and_file) >= 3:
-							action, file_path = action_and_file[2], action_and_file[1]
-							if action.lower() != 'delete':
-								real_file_path = file_path.split('#')[0]
-								if real_file_path.endswith('.py'):
-									file_dict[real_file_path] = changelist_num
-				return file_dict
-			else:
-				return {}
-		else:
-			return {}
-		
+def iter_describe_files(record : dict):
+	""" p4 -G describe 的文件列表为 depotFile0/action0、depotFile1/action1... """
+	index = 0
+	while f'depotFile{index}' in record:
+		yield record[f'depotFile{index}'], record.get(f'action{index}', '')
+		index += 1
+
+def get_describe_command(changelist_num) -> list:
+	""" -s 只返回文件列表，不返回diff；-S 同时支持shelve的changelist """
+	return ["p4", "describe", "-s", "-S", str(changelist_num)]
+
+def describe_changelist_files(changelist_num) -> tuple[list, str]:
+	"""
+	p4 -G describe 获取changelist(或shelve)中的文件
+	返回 ([(depot_path, action)], status)，status 为 submitted/pending，查询失败时为空
+	"""
+	files = []
+	status = ''
+	for record in iter_p4_records(get_describe_command(changelist_num)):
+		status = record.get('status', status)
+		files.extend(iter_describe_files(record))
+	return files, status
+
+def iter_win_command_lines(command : list):
+	"""
+	执行命令并逐行返回输出，不会把整个输出读进内存
+	调用方提前停止迭代时杀掉进程，不再读取剩余输出
+	"""
+	try:
+		yield from iter_command_lines(command)
+	except CommandError as e:
+		print(f"func:{get_func_name(2)} iter_win_command_lines error: {e}")
+
+# describe 文本输出中的文件列表标题
+DESCRIBE_AFFECTED_HEADER = 'Affected files ...'
+DESCRIBE_SHELVED_HEADER = 'Shelved files ...'
+
+def parse_describe_lines(lines) -> tuple[list, str]:
+	"""
+	逐行解析 p4 describe 文本输出的状态机，返回 ([(depot_path, action)], status)
+	HEADER: 从第一行 "Change N by ..." 得到状态，跳过描述(描述行以tab开头，不会误匹配标题)
+	FILES: 读取 "... //depot/path#rev action"，遇到空行或其他内容时文件列表结束
+	Affected files 结束后直接停止读取；Shelved files 结束后继续查找 Affected files，与之前的优先级一致
+	"""
+	state_header, state_files = 0, 1
+	state = state_header
+	section = ''
+	section_files = []
+	shelved_files = []
+	status = ''
+	for line in lines:
+		if state == state_header:
+			if line.startswith('Change ') and not status:
+				status = 'pending' if line.endswith('*pending*') else 'submitted'
+			elif line in (DESCRIBE_AFFECTED_HEADER, DESCRIBE_SHELVED_HEADER):
+				state = state_files
+				section = line
+				section_files = []
+			continue
+		if line.startswith('... '):
+			# 路径中可能有空格，从右边切出action
+			file_spec, _, action = line[4:].rpartition(' ')
+			section_files.append((file_spec.partition('#')[0], action))
+			continue
+		if not line and not section_files:
+			# 标题和第一个文件之间的空行
+			continue
+		# 文件列表结束
+		if section == DESCRIBE_AFFECTED_HEADER:
+			return section_files, status
+		shelved_files = section_files
+		state = state_header
+		if line in (DESCRIBE_AFFECTED_HEADER, DESCRIBE_SHELVED_HEADER):
+			state = state_files
+			section = line
+			section_files = []
+	if state == state_files:
+		if section == DESCRIBE_AFFECTED_HEADER:
+			return section_files, status
+		shelved_files = section_files
+	return shelved_files, status
+
+def describe_changelist(changelist_num, changelist_cache : ChangelistCache = None) -> tuple[list, str]:
+	"""
+	返回 ([(depot_path, action)], status)
+	已提交的changelist内容不会再变化，优先从本地缓存读取，shelve/pending每次都重新查询
+	"""
+	if changelist_cache is not None:
+		cached_files = changelist_cache.get(changelist_num)
+		if cached_files is not None:
+			return cached_files, 'submitted'
+	if USE_P4_MARSHAL:
+		files, status = describe_changelist_files(changelist_num)
+	else:
+		lines = iter_win_command_lines(get_describe_command(changelist_num))
+		try:
+			files, status = parse_describe_lines(lines)
+		finally:
+			lines.close()
+	if changelist_cache is not None and status == 'submitted':
+		changelist_cache.put(changelist_num, files)
+	return files, status
+
+def iter_server_changelist_files(changelist_num_list, submitted_changelists : set = None, changelist_cache : ChangelistCache = None):
+	"""
+	按changelist从小到大逐个describe，每完成一个就返回 (changelist_num, {depot_path: changelist_num})
+	调用方可以在后面的changelist还在describe时就开始下载前面的文件
+	"""
 	sorted_changelists = sorted(list(set(changelist_num_list)))
 	print(f"{sorted_changelists=}")
-	result_files = {}
 	for changelist_num in sorted_changelists:
-		command = [
-			"p4",
-			"describe",
-			"-S",
-			str(changelist_num)
-		]
-		output = run_win_command(command)
-		if not output:
-			continue
-		finded_files = extract_affected_files(output)
-		if finded_files:
-			result_files.update(finded_files)
+		with tracing.span('describe', changelist=changelist_num):
+			files, status = describe_changelist(changelist_num, changelist_cache)
+		if status == 'submitted' and submitted_changelists is not None:
+			submitted_changelists.add(changelist_num)
+		yield changelist_num, {depot_path: changelist_num for depot_path, action in files if is_wanted_depot_file(depot_path, action)}
+
+def get_server_changelist_file_dict(changelist_num_list, submitted_changelists : set = None, changelist_cache : ChangelistCache = None):
+	"""
+	submitted_changelists: 传入set时填入已提交的changelist(文件内容不会再变化，可以缓存)
+	changelist_cache: 已提交changelist的文件列表缓存，见 changelist_cache.py
+	"""
+	result_files = {}
+	for _, changelist_files in iter_server_changelist_files(changelist_num_list, submitted_changelists, changelist_cache):
+		result_files.update(changelist_files)
 	return result_files
 
-def fetch_and_save_file_from_perforce(depot_path, destination_path, changelist_num):
-	# 步骤1: 确保目标文件夹存在,如果不存在则创建
-	os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-	
-	# 步骤2: 使用p4 print命令获取指定版本的文件内容
-	output = run_win_command(['p4', 'print', f'{depot_path}@={changelist_num}'])
-	
-	# 步骤3: 去掉第一行（//depot 路径信息），只保留文件内容
-	file_content = '\n'.join(output.split('\n')[1:])
-
-	# 步骤4: 将内容写入目标文件
-	with open(destination_path, 'w', encoding='utf-8') as f:
+def _match_print_error(tasks : list, message : str):
+	""" 根据 p4 错误信息找到对应的文件 """
+	for task in tasks:
+		if task.depot_path in message:
+			return task
+	return None
+
+def fetch_and_save_files_from_perforce(tasks : list, timeout = None, output : OverlayOutput = None, on_saved = None, commit_guard = None) -> dict:
+	"""
+	一次 p4 -G print 下载多个文件，返回下载失败的 {task: error}
+	按记录流逐条解析文件头和内容，内容以二进制原样写入目标路径，
+	不会把整个输出读进内存，也不会改写换行符和编码
+	output: 写入文件夹和/或 zip，默认只写入文件夹
+	on_saved(task, fileobj): 每个文件写入完成后回调
+	commit_guard(task, save_func): 决定是否写入，返回False时丢弃(文件已被后面的changelist覆盖)
+	"""
+	if output is None:
+		output = OverlayOutput('.')
+	def commit(task, writer):
+		save_func = functools.partial(writer.commit, None if on_saved is None else functools.partial(on_saved, task))
+		if commit_guard is None:
+			save_func()
+		elif not commit_guard(task, save_func):
+			writer.abort()
+		finished_tasks.add(task)
+
+	task_dict = {task.depot_path: task for task in tasks}
+	finished_tasks = set()
+	errors = {}
+	current_task = None
+	current_file = None
+	input_text = ''.join(f'{task.depot_path}@={task.changelist_num}\n' for task in tasks)
+	try:
+		for record in iter_p4_marshal(['p4', '-x', '-', 'print'], input_text, timeout):
+			code = record.get('code')
+			if code == 'stat':
+				# 新文件头，上一个文件已经完整写完
+				if current_file is not None:
+					commit(current_task, current_file)
+					current_file = None
+				current_task = task_dict.get(record.get('depotFile'))
+				if current_task is None:
+					print(f"p4 print 返回了未请求的文件: {record.get('depotFile')}")
+					continue
+				current_file = output.open_file(current_task.destination_path)
+			elif code == 'error':
+				message = record.get('data', '').strip()
+				task = _match_print_error(tasks, message)
+				if task is not None:
+					errors[task] = RuntimeError(message)
+				else:
+					print(f"p4 print error: {message}")
+			elif current_file is not None and record.get('data'):
+				current_file.write(record['data'])
+		if current_file is not None:
+			commit(current_task, current_file)
+			current_file = None
+	except Exception as e:
+		# 超时或进程异常，正在写的文件不完整，丢弃
+		if current_file is not None:
+			current_file.abort()
+		for task in tasks:
+			if task not in finished_tasks:
+				errors.setdefault(task, e)
+		return errors
+	for task in tasks:
+		if task not in finished_tasks:
+			errors.setdefault(task, RuntimeError(f'p4 print 没有返回文件: {task.depot_path}@={task.changelist_num}'))
+	return errors
+
+def fetch_and_save_files_with_cache(tasks : list, timeout = None, file_cache : FileCache = None, submitted_changelists = (), output : OverlayOutput = None, commit_guard = None, use_hardlink = False) -> dict:
+	"""
+	已提交changelist的文件优先从本地缓存获取，没有命中的再 p4 print，下载成功后加入缓存
+	use_hardlink: 命中的文件用硬链接代替复制
+	返回下载失败的 {task: error}
+	"""
+	if file_cache is None:
+		return fetch_and_save_files_from_perforce(tasks, timeout, output, commit_guard=commit_guard)
+	if output is None:
+		output = OverlayOutput('.')
+	missed_tasks = []
+	for task in tasks:
+		blob_path = None
+		if task.changelist_num in submitted_changelists:
+			blob_path = file_cache.get_blob_path(make_cache_key(task.depot_path, task.changelist_num))
+		if blob_path is None:
+			missed_tasks.append(task)
+			continue
 		try:
-			f.write(file_content)
-		finally:
-			f.close()
-	
-	print(f"文件已成功保存到: {destination_path}")
+			save_func = functools.partial(output.add_file, task.destination_path, blob_path, use_hardlink)
+			if commit_guard is None:
+				save_func()
+			else:
+				commit_guard(task, save_func)
+		except OSError as e:
+			print(f'FileCache: 读取缓存失败 {task.depot_path} {e}')
+			missed_tasks.append(task)
+	if not missed_tasks:
+		return {}
+	def save_to_cache(task, fileobj):
+		if task.changelist_num not in submitted_changelists:
+			return
+		try:
+			file_cache.put_stream(make_cache_key(task.depot_path, task.changelist_num), fileobj)
+		except OSError as e:
+			print(f'FileCache: 写入缓存失败 {task.depot_path} {e}')
+	return fetch_and_save_files_from_perforce(missed_tasks, timeout, output, save_to_cache, commit_guard)
 
 def open_win_folder(folder_path):
 	import os
@@ -262,99 +567,326 @@ def win_remove_file_or_folder(path:str):
 	print()
 
 
-def zip_folder_to_owning_folder(folder_path):
-	"""压缩文件夹到同级目录"""
-	import os
-	folder_path = normalize_path(folder_path)
-	parent_path = os.path.dirname(folder_path)
-	path_name = os.path.basename(folder_path)
-	command = f'cd /d {parent_path} && tar -cavf {path_name}.zip {path_name}'
-	exit_code = os.system(command)
-	if exit_code == 0:
-		print(f"成功压缩文件夹: {path_name}")
-	else:
-		print(f"压缩文件夹失败，错误代码: {exit_code}")
-
-def move_local_file_to_target_file_path(local_path, target_path):
-	os.makedirs(target_path, exist_ok=True)
-	command = f'copy {local_path} {target_path}'
-	run_output = os.system(command)
-	if run_output == 0:
-		print(f"移动文件 {local_path} 成功")
-	else:
-		print(f"移动文件 {local_path} to {target_path} 失败")
+def copy_local_files_to_overlay(file_pairs : list, use_hardlink = False) -> list:
+	"""
+	批量复制本地文件 [(local_path, target_file_path)]，返回复制成功的 [(local_path, target_file_path)]
+	目标是硬链接(--cache-hardlink 的缓存文件、--hardlink 的工作区文件)时 copy_file_fast 先删除再复制，不会修改缓存和工作区
+	"""
+	errors = copy_files(file_pairs, use_hardlink=use_hardlink)
+	for (local_path, target_file_path), error in errors.items():
+		print(f"移动文件 {local_path} to {target_file_path} 失败 {error}")
+	print(f"复制本地文件 {len(file_pairs) - len(errors)}/{len(file_pairs)} 成功")
+	return [file_pair for file_pair in file_pairs if file_pair not in errors]
 
-def _create_scripts_folder_from_changelist(workspace_name, changelist_num_list):
-	"""尝试创建Windows文件夹"""
-	file_dict = get_server_changelist_file_dict(changelist_num_list)
-	if workspace_name:
-		local_files = get_local_changelist_files(workspace_name, changelist_num_list)
-	else:
-		local_files = []
+class OverlayCaches:
+	"""
+	构建使用的缓存，常驻进程(overlay_daemon.py)中在多次构建之间保持打开
+	use_cache: 为False时不使用文件列表和文件内容缓存，client View 缓存总是使用
+	"""
+	def __init__(self, use_cache = True):
+		self.changelist_cache = ChangelistCache() if use_cache else None
+		self.file_cache = FileCache() if use_cache else None
+		self.client_view_cache = ClientViewCache() if USE_CLIENT_VIEW else None
 
+	def close(self):
+		if self.changelist_cache is not None:
+			self.changelist_cache.close()
+		if self.file_cache is not None:
+			self.file_cache.close()
+
+def get_local_overlay_items(local_files : list, toolbox_parent_path) -> list:
+	""" [(depot_path, local_path)] -> [(relative_path, depot_path, local_path)] """
+	local_items = []
+	for depot_file_path, local_file_path in local_files:
+		new_path = py_depot_path_to_relative_path(depot_file_path, False)
+		relative_path = f"{toolbox_parent_path}/{new_path}/{os.path.basename(local_file_path)}"
+		local_items.append((relative_path, depot_file_path, local_file_path))
+	return local_items
+
+def _create_scripts_folder_from_changelist(workspace_name, changelist_num_list, worker_count = None, use_cache = True, compress_level = DEFAULT_COMPRESS_LEVEL, zip_only = False, use_hardlink = False, caches = None, cache_hardlink = False):
+	"""
+	尝试创建Windows文件夹，有文件下载失败时返回False
+	流水线执行：本地文件查询在后台进行，每describe完一个changelist就开始下载它的文件，
+	后面的changelist覆盖前面的同名文件时，先完成的旧版本会被丢弃，结果与全部describe完再下载一致
+	worker_count: 并发下载数，默认见 overlay_downloader.get_default_worker_count
+	use_cache: 已提交changelist的文件列表和文件内容使用本地缓存(见 changelist_cache.py 和 file_cache.py)
+	compress_level: zip 压缩等级，0 为只存储不压缩
+	zip_only: 只生成 zip，不写 Windows 文件夹
+	use_hardlink: 本地文件用硬链接代替复制(修改 OverlayFolder 中的文件会同时修改工作区文件)
+	caches: 常驻进程传入的 OverlayCaches，缓存在多次构建之间保持打开，为None时本次构建自己打开和关闭
+	cache_hardlink: 命中文件缓存的文件用硬链接代替复制(不要修改 OverlayFolder 中的这些文件，否则缓存内容也会被修改)
+	"""
 	unreal_parent_path = get_full_path() + "/OverlayFolder"
 	toolbox_parent_path = "Windows/Marvel/Content/Marvel"
-	# 删除OverlayFolder文件夹
-	win_remove_file_or_folder(f"{unreal_parent_path}")
+
+	manifest = None
+	if not zip_only:
+		# 有上次构建的清单时只更新有变化的文件，否则删除OverlayFolder文件夹完整重建
+		with tracing.span('load_manifest'):
+			manifest = OverlayManifest.load(unreal_parent_path)
+			if manifest is None:
+				win_remove_file_or_folder(f"{unreal_parent_path}")
+				manifest = OverlayManifest(unreal_parent_path)
+
+	# 文件内容在复制/下载时直接写入 zip，最后没有文件时丢弃
+	archive = OverlayArchive(f"{unreal_parent_path}/Windows.zip", compress_level)
+	output = OverlayOutput(unreal_parent_path, archive, write_folder=not zip_only)
+
+	submitted_changelists = set()
+	own_caches = caches is None
+	if own_caches:
+		caches = OverlayCaches(use_cache)
+	changelist_cache = caches.changelist_cache
+	file_cache = caches.file_cache
+
+	# 每个depot文件当前应该写入的来源：DownloadTask，UNCHANGED 表示文件夹中已有的文件，LOCAL 表示使用本地文件
+	# 写入文件夹/zip 都在 pipeline_lock 内进行，被后面changelist或本地文件覆盖的旧任务不会再写入
+	UNCHANGED = object()
+	LOCAL = object()
+	latest_sources = {}
+	pipeline_lock = threading.Lock()
+	def commit_guard(task, save_func):
+		with pipeline_lock:
+			if latest_sources.get(task.depot_path) is not task:
+				return False
+			save_func()
+			return True
+
+	# {depot_path: changelist_num}，相对路径由 get_depot_relative_path 计算，不再为每个文件保存一份
+	depot_items = {}
+	def get_depot_relative_path(depot_path):
+		return f"{toolbox_parent_path}/{py_depot_path_to_relative_path(depot_path)}"
+	def apply_local_files(local_files):
+		""" 本地文件优先，同一文件已经提交或写入的下载结果作废 """
+		items = get_local_overlay_items(local_files, toolbox_parent_path)
+		with pipeline_lock:
+			for relative_path, depot_path, _ in items:
+				previous_source = latest_sources.get(depot_path)
+				latest_sources[depot_path] = LOCAL
+				if depot_items.pop(depot_path, None) is None:
+					continue
+				print(f'file exist local {depot_path=}, prefer use local file')
+				depot_relative_path = get_depot_relative_path(depot_path)
+				if previous_source is not None and depot_relative_path != relative_path:
+					# 相对路径相同时会被本地文件覆盖，不同时需要去掉已经写入的下载结果
+					archive.discard(depot_relative_path)
+					if not zip_only:
+						try:
+							os.remove(f"{unreal_parent_path}/{depot_relative_path}")
+						except OSError:
+							pass
+		return items
+
+	def batch_fetch_func(tasks, timeout = None):
+		with tracing.span('download_batch', files=len(tasks)):
+			return fetch_and_save_files_with_cache(tasks, timeout, file_cache, submitted_changelists, output, commit_guard, cache_hardlink)
+	downloader = StreamingDownloader(batch_fetch_func, worker_count, progress_func=print_download_progress)
+
+	def lookup_local_files():
+		with tracing.span('local_files'):
+			return get_local_changelist_files(workspace_name, changelist_num_list, True, caches.client_view_cache)
+	# 本地文件查询(opened + where)在后台进行，不阻塞describe和下载
+	local_executor = ThreadPoolExecutor(max_workers=1)
+	local_future = local_executor.submit(lookup_local_files) if workspace_name else None
+
+	local_items = None
+	unchanged_count = 0
+	download_tasks = []
+	failed_tasks = set()
+	success = False
+	try:
+		print("开始处理下载文件：")
+		changelist_files_iter = iter_server_changelist_files(changelist_num_list, submitted_changelists, changelist_cache)
+		for changelist_num, changelist_files in changelist_files_iter:
+			if local_items is None and (local_future is None or local_future.done()):
+				local_items = apply_local_files(local_future.result() if local_future else [])
+			tasks = []
+			for depot_path in changelist_files:
+				if not depot_path.endswith('.py'):
+					continue
+				relative_path = get_depot_relative_path(depot_path)
+				target_file_path = f"{unreal_parent_path}/{relative_path}"
+				immutable = changelist_num in submitted_changelists
+				with pipeline_lock:
+					if latest_sources.get(depot_path) is LOCAL:
+						print(f'file exist local {depot_path=}, prefer use local file')
+						continue
+					depot_items[depot_path] = changelist_num
+					if manifest is not None and manifest.is_up_to_date(relative_path, make_depot_source(depot_path, changelist_num), immutable):
+						latest_sources[depot_path] = UNCHANGED
+						output.add_existing(target_file_path)
+						unchanged_count += 1
+						continue
+					task = DownloadTask(depot_path, target_file_path, changelist_num)
+					latest_sources[depot_path] = task
+				tasks.append(task)
+			download_tasks.extend(tasks)
+			downloader.submit(tasks)
+		if local_items is None:
+			local_items = apply_local_files(local_future.result() if local_future else [])
+
+		if manifest is not None:
+			# 所有changelist都describe完才知道哪些文件不再需要
+			keep_paths = {item[0] for item in local_items} | {get_depot_relative_path(depot_path) for depot_path in depot_items}
+			with pipeline_lock, tracing.span('remove_stale'):
+				for relative_path in manifest.remove_stale(keep_paths):
+					print(f"删除不再需要的文件: {relative_path}")
+
+		# 下载在后台进行时复制本地文件
+		if local_items:
+			print("开始处理本地文件：")
+			copy_pairs = []
+			with tracing.span('copy_local', files=len(local_items)):
+				for relative_path, _, local_file_path in local_items:
+					target_file_path = f"{unreal_parent_path}/{relative_path}"
+					if manifest is None:
+						try:
+							archive.write_file(relative_path, local_file_path)
+						except OSError as e:
+							print(f"移动文件 {local_file_path} 失败 {e}")
+						continue
+					if manifest.is_up_to_date(relative_path, make_local_source(local_file_path), source_path=local_file_path):
+						output.add_existing(target_file_path)
+						unchanged_count += 1
+						continue
+					manifest.forget(relative_path)
+					copy_pairs.append((local_file_path, target_file_path))
+				for local_file_path, target_file_path in copy_local_files_to_overlay(copy_pairs, use_hardlink):
+					relative_path = output.arcname(target_file_path)
+					archive.write_file(relative_path, local_file_path)
+					manifest.record(relative_path, make_local_source(local_file_path), source_path=local_file_path)
+
+		try:
+			with tracing.span('wait_downloads', files=len(download_tasks)):
+				downloader.finish()
+		except DownloadError as e:
+			failed_tasks = {task for task, _ in e.failures}
+			print()
+			print(f'CreateScriptsFolder: task failed {changelist_num_list=}')
+			print(e)
+			return False
+		success = True
+	finally:
+		downloader.close()
+		local_executor.shutdown(wait=True, cancel_futures=True)
+		if not success:
+			archive.abort()
+		# 只记录下载成功且没有被覆盖的文件，失败的文件下次重新下载
+		if manifest is not None:
+			with tracing.span('save_manifest'):
+				for task in download_tasks:
+					if latest_sources.get(task.depot_path) is not task:
+						continue
+					relative_path = output.arcname(task.destination_path)
+					if task in failed_tasks or not os.path.exists(task.destination_path):
+						manifest.forget(relative_path)
+					else:
+						immutable = task.changelist_num in submitted_changelists
+						manifest.record(relative_path, make_depot_source(task.depot_path, task.changelist_num), immutable)
+				manifest.save()
+		if file_cache is not None:
+			# 本次构建的命中记录一次写入
+			file_cache.flush()
+			if download_tasks:
+				with tracing.span('prune_cache'):
+					file_cache.prune()
+				print()
+				print_cache_stats(file_cache.stats())
+		if own_caches:
+			caches.close()
+	if unchanged_count:
+		print(f"{unchanged_count} 个文件没有变化，跳过")
+
 	files_str = ''
-	if local_files:
+	if local_items:
 		files_str += '以下文件被复制:\n'
-		print("开始处理本地文件：")
-		for file in local_files:
-			depot_file_path, local_file_path = file
-			if depot_file_path in file_dict:
-				print(f'file exist local {depot_file_path=}, prefer use local file')
-				file_dict.pop(depot_file_path)
-			new_path = py_depot_path_to_relative_path(depot_file_path, False)
-			target_path = f"{unreal_parent_path}/{toolbox_parent_path}/{new_path}"
-			target_path = to_win_cmd_path(target_path)
-			move_local_file_to_target_file_path(local_file_path, target_path)
+		for _, _, local_file_path in local_items:
 			files_str += f'{local_file_path} \n'
-	
-	print()
-	print("开始处理下载文件：")
-	if file_dict:
+	if depot_items:
 		files_str += '以下文件被下载:\n'
-		for depot_path, changelist_num in file_dict.items():
-			if not depot_path.endswith('.py'):
-				continue
+		for depot_path, changelist_num in depot_items.items():
 			files_str += f'{depot_path} {changelist_num} \n'
-			new_path = py_depot_path_to_relative_path(depot_path)
-			
-			target_path = f"{unreal_parent_path}/{toolbox_parent_path}/{new_path}"
-			fetch_and_save_file_from_perforce(depot_path, target_path, changelist_num)
 
 	print()
 	if files_str:
-		# 压缩文件夹(有文件被复制才压缩)
-		zip_folder_to_owning_folder(f"{unreal_parent_path}/Windows")
+		with tracing.span('close_zip', files=archive.file_count):
+			archive.close()
+		print(f"成功压缩文件夹: {archive.zip_path} {archive.file_count} 个文件")
 
 		# 成功之后，打开文件夹
 		open_win_folder(unreal_parent_path)
 	else:
+		archive.abort()
 		print(f'目标changelist{changelist_num_list=}没有py文件')
 	print()
 	print(f'CreateScriptsFolder: task complete {changelist_num_list=} \n {files_str}')
+	return True
 
-if __name__ == "__main__":
+def build_arg_parser():
 	parser = argparse.ArgumentParser()
 	# parser.add_argument("workspace", type=str, help="Workspace Name")
 	parser.add_argument("all_args", type=str, nargs='*', help="ALL Arguments")
-	args = parser.parse_args()
+	parser.add_argument("--workers", type=int, default=None, help="并发下载数")
+	parser.add_argument("--no-cache", action='store_true', help="不使用本地文件缓存")
+	parser.add_argument("--zip-level", type=int, default=DEFAULT_COMPRESS_LEVEL, help="zip 压缩等级 0-9，0 为只存储不压缩")
+	parser.add_argument("--zip-only", action='store_true', help="只生成 zip，不写 Windows 文件夹")
+	parser.add_argument("--hardlink", action='store_true', help="本地文件用硬链接代替复制")
+	parser.add_argument("--cache-hardlink", action='store_true', help="命中文件缓存的文件用硬链接代替复制")
+	parser.add_argument("--trace", action='store_true', help="统计各阶段和每条命令的耗时，结束时打印汇总")
+	parser.add_argument("--trace-file", type=str, default='', help="同时导出 Chrome trace json(chrome://tracing 打开)")
+	parser.add_argument("--no-daemon", action='store_true', help="不转发给常驻进程，在当前进程中构建")
+	parser.add_argument("--serve", action='store_true', help="启动常驻进程，见 overlay_daemon.py")
+	parser.add_argument("--stop-daemon", action='store_true', help="停止常驻进程")
+	return parser
+
+def check_workspace(workspace_name) -> bool:
+	check_output = run_win_command(['p4', 'clients', '-e', workspace_name])
+	print(f"{check_output=}")
+	return bool(check_output)
+
+def run_main(argv = None, runtime = None) -> int:
+	"""
+	执行一次构建，返回退出码
+	runtime: 常驻进程的 OverlayRuntime(见 overlay_daemon.py)，复用打开的缓存和 workspace 检查结果
+	"""
+	args = build_arg_parser().parse_args(argv)
+	# 也可以用环境变量 OVERLAY_TRACE 开启，见 common/tracing.py
+	if args.trace or args.trace_file:
+		tracer = tracing.enable(args.trace_file or None)
+	else:
+		tracer = tracing.enable_from_env()
+	try:
+		with tracing.span('build'):
+			return _run_main(args, runtime)
+	finally:
+		if tracer is not None:
+			tracing.finish(tracer)
+			tracing.disable()
+
+def _run_main(args, runtime = None) -> int:
 	all_args = args.all_args
+	success = False
+	caches = runtime.get_caches(not args.no_cache) if runtime is not None else None
 	print(f'CreateScriptsFolder: task start {all_args=}')
 	if len(all_args) > 0:
 		workspace_name = all_args[0]
-		check_output = run_win_command(['p4', 'clients', '-e', workspace_name])
-		print(f"{check_output=}")
-		if check_output:
+		if runtime is not None:
+			is_workspace = runtime.check_workspace(workspace_name, check_workspace)
+		else:
+			is_workspace = check_workspace(workspace_name)
+		if is_workspace:
 			changelist_num_list = all_args[1:]
 			print(f'CreateScriptsFolder: task start {workspace_name=} {changelist_num_list=}')
 			print()
 
-			_create_scripts_folder_from_changelist(workspace_name, changelist_num_list)
+			success = _create_scripts_folder_from_changelist(workspace_name, changelist_num_list, args.workers, not args.no_cache, args.zip_level, args.zip_only, args.hardlink, caches, args.cache_hardlink)
 		else:
 			changelist_num_list = all_args
-			_create_scripts_folder_from_changelist('', changelist_num_list)
+			success = _create_scripts_folder_from_changelist('', changelist_num_list, args.workers, not args.no_cache, args.zip_level, args.zip_only, args.hardlink, caches, args.cache_hardlink)
 	else:
-		print("Usage: python CreateScriptsFolder.py <workspace> <changelist_num1> <changelist_num2> or python CreateScriptsFolder.py <changelist_num1> <changelist_num2> ...")
\ No newline at end of file
+		print("Usage: python CreateScriptsFolder.py [--workers N] <workspace> <changelist_num1> <changelist_num2> or python CreateScriptsFolder.py <changelist_num1> <changelist_num2> ...")
+	return 0 if success else 1
+
+if __name__ == "__main__":
+	# 常驻进程相关的参数和转发已在文件开头处理，这里在当前进程中构建
+	sys.exit(run_main())
@@ -0,0 +1,250 @@
+"""
+	overlay 构建的端到端 benchmark
+	fake p4 放在 PATH 中，按参数生成 changelist(已提交/shelve)、文件数、文件大小、网络延迟，
+	把工具复制到临时目录后完整执行构建(缓存、OverlayFolder 都在临时目录中，不影响正在使用的工具)，
+	第一次为冷启动，之后的为缓存已经建立的重复构建
+	输出稳定的 json(key 排序，数值固定精度)，可以保存后对比
+	用法: python bench_overlay_build.py [--changelists 5] [--files-per-cl 40] [--latency 0.05] [--output result.json]
+	比较: python bench_overlay_build.py --compare base.json new.json [--max-regression 0.2]
+"""
+import os, sys, json, time, shutil, argparse, subprocess, statistics
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+TOOL_FOLDER = os.path.dirname(BENCHMARK_FOLDER)
+REPO_FOLDER = os.path.dirname(TOOL_FOLDER)
+sys.path.insert(0, BENCHMARK_FOLDER)
+from fake_p4_env import FakeP4Env
+
+RESULT_VERSION = 1
+WORKSPACE_NAME = 'bench_ws'
+DEPOT_ROOT = '//depot_marvel/dev'
+SCRIPTS_ROOT = f'{DEPOT_ROOT}/UnrealEngine/Marvel/Content/Marvel/Scripts'
+FIRST_CHANGELIST = 1001
+# 对比时只检查这些指标，越小越好
+GATED_METRICS = ('wall_time', 'p4_calls', 'peak_rss_kb')
+
+def make_config(args, client_root) -> dict:
+	"""
+	生成 fake p4 配置，结果只由参数决定
+	每 shelved_every 个changelist中有一个是 shelve，overlap 比例的文件在多个changelist中重复出现
+	"""
+	config = {
+		'workspace': WORKSPACE_NAME,
+		'client_root': client_root,
+		'depot_root': DEPOT_ROOT,
+		'file_size': args.file_size,
+		'latency': args.latency,
+		'submitted': {},
+		'shelved': {},
+		'opened': {},
+	}
+	shared_count = int(args.files_per_cl * args.overlap)
+	for index in range(args.changelists):
+		changelist_num = str(FIRST_CHANGELIST + index)
+		files = [f'{SCRIPTS_ROOT}/shared/s{file_index}.py' for file_index in range(shared_count)]
+		files += [f'{SCRIPTS_ROOT}/cl{changelist_num}/f{file_index}.py' for file_index in range(args.files_per_cl - shared_count)]
+		is_shelved = args.shelved_every > 0 and index % args.shelved_every == args.shelved_every - 1
+		config['shelved' if is_shelved else 'submitted'][changelist_num] = files
+	if args.local_files:
+		changelist_num = str(FIRST_CHANGELIST)
+		config['opened'][changelist_num] = [f'{SCRIPTS_ROOT}/local/l{file_index}.py' for file_index in range(args.local_files)]
+	return config
+
+def create_local_files(config):
+	for depot_paths in config['opened'].values():
+		for depot_path in depot_paths:
+			local_path = config['client_root'] + depot_path[len(DEPOT_ROOT):]
+			os.makedirs(os.path.dirname(local_path), exist_ok=True)
+			with open(local_path, 'wb') as f:
+				f.write(b'# local\n' * max(1, config['file_size'] // 8))
+
+def copy_tool(target_root):
+	""" 复制工具和 common 模块，缓存、OverlayFolder 都写在临时目录中 """
+	tool_folder = os.path.join(target_root, 'create_scripts')
+	os.makedirs(tool_folder)
+	for file_name in os.listdir(TOOL_FOLDER):
+		if file_name.endswith('.py'):
+			shutil.copy2(os.path.join(TOOL_FOLDER, file_name), tool_folder)
+	shutil.copytree(os.path.join(REPO_FOLDER, 'common'), os.path.join(target_root, 'common'), ignore=shutil.ignore_patterns('__pycache__'))
+	return tool_folder
+
+def get_folder_size(folder):
+	total_size = 0
+	for dir_path, _, file_names in os.walk(folder):
+		for file_name in file_names:
+			try:
+				total_size += os.path.getsize(os.path.join(dir_path, file_name))
+			except OSError:
+				pass
+	return total_size
+
+def get_peak_rss_kb():
+	""" 当前进程的内存峰值(KB)，不支持的平台返回None """
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# macOS 上单位为字节
+	return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+def get_io_write_bytes():
+	""" 本进程写入存储的字节数，只有 Linux 支持 """
+	try:
+		with open('/proc/self/io', 'r', encoding='utf-8') as f:
+			for line in f:
+				if line.startswith('write_bytes:'):
+					return int(line.split()[1])
+	except OSError:
+		pass
+	return None
+
+def run_build_child(tool_folder, build_argv):
+	""" 子进程中执行一次完整构建，结果以 json 输出到最后一行 """
+	sys.path.insert(0, tool_folder)
+	import CreateOverlayScriptsFolder as overlay
+	# benchmark 不需要打开资源管理器
+	overlay.open_win_folder = lambda folder_path: None
+	start_time = time.perf_counter()
+	exit_code = overlay.run_main(build_argv)
+	build_time = time.perf_counter() - start_time
+	sys.stdout.flush()
+	result = {'exit_code': exit_code, 'build_time': build_time, 'peak_rss_kb': get_peak_rss_kb(), 'io_write_bytes': get_io_write_bytes()}
+	sys.__stdout__.write('\nBENCH_RESULT ' + json.dumps(result) + '\n')
+
+def run_once(env : FakeP4Env, tool_folder, build_argv, verbose):
+	env.reset_invocations()
+	command = [sys.executable, os.path.abspath(__file__), '--run-build', tool_folder, '--'] + build_argv
+	start_time = time.perf_counter()
+	completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='replace')
+	wall_time = time.perf_counter() - start_time
+	if verbose:
+		sys.stderr.write(completed.stdout)
+	result_lines = [line for line in completed.stdout.splitlines() if line.startswith('BENCH_RESULT ')]
+	if completed.returncode != 0 or not result_lines:
+		sys.stderr.write(completed.stdout[-2000:] + completed.stderr[-2000:])
+		raise RuntimeError(f'构建失败 exit code {completed.returncode}')
+	child_result = json.loads(result_lines[-1][len('BENCH_RESULT '):])
+	overlay_folder = os.path.join(tool_folder, 'OverlayFolder')
+	return {
+		'wall_time': wall_time,
+		'build_time': child_result['build_time'],
+		'exit_code': child_result['exit_code'],
+		'p4_calls': len(env.invocations()),
+		'peak_rss_kb': child_result['peak_rss_kb'],
+		'io_write_bytes': child_result['io_write_bytes'],
+		'output_bytes': get_folder_size(overlay_folder),
+		'zip_bytes': os.path.getsize(os.path.join(overlay_folder, 'Windows.zip')) if os.path.exists(os.path.join(overlay_folder, 'Windows.zip')) else 0,
+		'cache_bytes': get_folder_size(os.path.join(tool_folder, 'FileCache')),
+	}
+
+def round_values(value):
+	if isinstance(value, float):
+		return round(value, 4)
+	if isinstance(value, dict):
+		return {key: round_values(item) for key, item in value.items()}
+	if isinstance(value, list):
+		return [round_values(item) for item in value]
+	return value
+
+def summarize(runs : list) -> dict:
+	warm_runs = runs[1:]
+	summary = {'cold': runs[0]}
+	if warm_runs:
+		summary['warm_median'] = {key: statistics.median(run[key] for run in warm_runs) if all(run[key] is not None for run in warm_runs) else None for key in runs[0]}
+	return summary
+
+def run_benchmark(args) -> dict:
+	build_argv = []
+	if args.workers is not None:
+		build_argv += ['--workers', str(args.workers)]
+	if args.zip_only:
+		build_argv.append('--zip-only')
+	with FakeP4Env({}) as env:
+		config = make_config(args, os.path.join(env.root, WORKSPACE_NAME))
+		env.config = config
+		env.write_config()
+		create_local_files(config)
+		tool_folder = copy_tool(os.path.join(env.root, 'tool'))
+		changelists = sorted(list(config['submitted']) + list(config['shelved']))
+		build_argv += [WORKSPACE_NAME] + changelists
+		runs = [run_once(env, tool_folder, build_argv, args.verbose) for _ in range(args.runs)]
+	return round_values({
+		'version': RESULT_VERSION,
+		'params': {
+			'changelists': args.changelists,
+			'files_per_cl': args.files_per_cl,
+			'file_size': args.file_size,
+			'latency': args.latency,
+			'shelved_every': args.shelved_every,
+			'overlap': args.overlap,
+			'local_files': args.local_files,
+			'workers': args.workers,
+			'zip_only': args.zip_only,
+			'runs': args.runs,
+		},
+		'python': sys.version.split()[0],
+		'platform': sys.platform,
+		'runs': runs,
+		'summary': summarize(runs),
+	})
+
+def compare_results(base_path, new_path, max_regression) -> int:
+	""" 对比两次结果的 GATED_METRICS，超过 max_regression 比例时返回1 """
+	with open(base_path, 'r', encoding='utf-8') as f:
+		base = json.load(f)
+	with open(new_path, 'r', encoding='utf-8') as f:
+		new = json.load(f)
+	if base.get('params') != new.get('params'):
+		print('两次结果的参数不同，无法对比')
+		return 2
+	exit_code = 0
+	for phase in ('cold', 'warm_median'):
+		if phase not in base['summary'] or phase not in new['summary']:
+			continue
+		for metric in GATED_METRICS:
+			base_value = base['summary'][phase].get(metric)
+			new_value = new['summary'][phase].get(metric)
+			if not base_value or new_value is None:
+				continue
+			change = (new_value - base_value) / base_value
+			regressed = change > max_regression
+			exit_code = 1 if regressed else exit_code
+			print(f"{'REGRESSION' if regressed else 'ok':<10} {phase:<12} {metric:<12} {base_value} -> {new_value} ({change:+.1%})")
+	return exit_code
+
+def build_arg_parser():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--changelists', type=int, default=5, help='changelist 数')
+	parser.add_argument('--files-per-cl', type=int, default=40, help='每个changelist的文件数')
+	parser.add_argument('--file-size', type=int, default=4096, help='文件大小(字节)')
+	parser.add_argument('--latency', type=float, default=0.05, help='每次 p4 调用的模拟延迟(秒)')
+	parser.add_argument('--shelved-every', type=int, default=3, help='每N个changelist中有一个是 shelve，0 为全部已提交')
+	parser.add_argument('--overlap', type=float, default=0.1, help='在多个changelist中重复出现的文件比例')
+	parser.add_argument('--local-files', type=int, default=5, help='第一个changelist中本地 opened 的文件数')
+	parser.add_argument('--workers', type=int, default=None, help='并发下载数')
+	parser.add_argument('--zip-only', action='store_true', help='只生成 zip')
+	parser.add_argument('--runs', type=int, default=3, help='构建次数，第一次为冷启动')
+	parser.add_argument('--output', type=str, default='', help='结果 json 文件，默认输出到 stdout')
+	parser.add_argument('--verbose', action='store_true', help='把构建日志输出到 stderr')
+	parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='对比两次结果')
+	parser.add_argument('--max-regression', type=float, default=0.2, help='对比时允许的退化比例')
+	return parser
+
+def main():
+	if len(sys.argv) > 2 and sys.argv[1] == '--run-build':
+		run_build_child(sys.argv[2], sys.argv[4:])
+		return 0
+	args = build_arg_parser().parse_args()
+	if args.compare:
+		return compare_results(args.compare[0], args.compare[1], args.max_regression)
+	result = run_benchmark(args)
+	text = json.dumps(result, indent=1, sort_keys=True)
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			f.write(text + '\n')
+	print(text)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+	对比逐个 p4 where、批量 p4 where 和 client View 本地转换的耗时与 p4 进程启动次数
+	用法: python bench_p4_where.py [文件数]
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_p4_env import FakeP4Env
+import CreateOverlayScriptsFolder as overlay
+from client_view import ClientViewCache
+
+def make_config(file_count):
+	depot_root = '//depot_marvel/dev'
+	opened = []
+	for index in range(file_count):
+		# 部分路径带空格，验证解析
+		folder = 'ui panel' if index % 5 == 0 else 'ui'
+		opened.append(f'{depot_root}/UnrealEngine/Marvel/Content/Marvel/Scripts/{folder}/file_{index}.py')
+	return {
+		'workspace': 'bench_ws',
+		'client_root': '/tmp/bench_ws',
+		'depot_root': depot_root,
+		'opened': {'100': opened},
+	}
+
+def create_local_files(local_paths):
+	""" opened 的文件本地一定存在，client View 转换后会检查 """
+	for local_path in local_paths:
+		os.makedirs(os.path.dirname(local_path), exist_ok=True)
+		with open(local_path, 'w', encoding='utf-8') as f:
+			f.write('')
+
+def run_once(env : FakeP4Env, batch_where, use_client_view = False, client_view_cache = None):
+	overlay.USE_CLIENT_VIEW = use_client_view
+	env.reset_invocations()
+	start = time.perf_counter()
+	files = overlay.get_single_changelist_local_changelist_files('bench_ws', 100, batch_where, client_view_cache)
+	cost = time.perf_counter() - start
+	return files, cost, len(env.invocations())
+
+def main(file_count):
+	config = make_config(file_count)
+	with FakeP4Env(config) as env:
+		config['client_root'] = os.path.join(env.root, 'bench_ws')
+		env.config = config
+		env.write_config()
+		expected_files = [(path, os.path.normpath(config['client_root'] + path[len(config['depot_root']):])) for path in config['opened']['100']]
+		create_local_files([local_path for _, local_path in expected_files])
+		single_files, single_cost, single_calls = run_once(env, False)
+		batch_files, batch_cost, batch_calls = run_once(env, True)
+		client_view_cache = ClientViewCache(os.path.join(env.root, 'ClientViewCache.json'))
+		view_files, view_cost, view_calls = run_once(env, True, True, client_view_cache)
+		# 新的 ClientViewCache 对象从缓存文件读取 View，不需要再执行 p4 client -o
+		cached_files, cached_cost, cached_calls = run_once(env, True, True, ClientViewCache(client_view_cache.cache_path))
+
+	# 逐个 where 按空白切分输出，带空格的路径会解析错误，只校验批量结果
+	assert [(path, os.path.normpath(local_path)) for path, local_path in batch_files] == expected_files, '批量 where 结果与预期不一致'
+	assert view_files == expected_files, 'client View 结果与预期不一致'
+	assert cached_files == expected_files, '缓存的 client View 结果与预期不一致'
+	print()
+	print(f'文件数: {file_count}')
+	print(f'逐个 where: {single_cost:.3f}s p4调用次数: {single_calls}')
+	print(f'批量 where: {batch_cost:.3f}s p4调用次数: {batch_calls}')
+	print(f'client View: {view_cost:.3f}s p4调用次数: {view_calls}')
+	print(f'缓存的 client View: {cached_cost:.3f}s p4调用次数: {cached_calls}')
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,75 @@
+"""
+	对比构建中 depot_items 的两种保存方式的内存和耗时
+	{depot_path: (relative_path, changelist_num)}: 每个文件额外保存一个相对路径字符串和一个 tuple
+	{depot_path: changelist_num}: 相对路径用到时再计算
+	模拟多个changelist按顺序合并(后面的覆盖前面的)，与 _create_scripts_folder_from_changelist 一致
+	用法: python bench_path_table.py [--files 50000] [--changelists 5]
+"""
+import os, sys, time, random, argparse, tracemalloc
+
+SCRIPTS_ROOT = '//depot_marvel/dev/UnrealEngine/Marvel/Content/Marvel/Scripts'
+TOOLBOX_PARENT_PATH = 'Windows/Marvel/Content/Marvel'
+
+def make_changelists(file_count, changelist_count, seed = 1):
+	""" 每个changelist的文件编号 [(changelist_num, [(目录编号, 文件编号)])] """
+	rng = random.Random(seed)
+	folder_count = max(1, file_count // 20)
+	all_files = [(rng.randrange(folder_count), index) for index in range(file_count)]
+	return [(str(2706009 + index), rng.sample(all_files, file_count // changelist_count)) for index in range(changelist_count)]
+
+def iter_changelist_files(changelists):
+	"""
+	与 describe 解析结果一样，每个changelist的路径都是新建的字符串，路径长度参考 python_test.py 中的例子
+	逐个changelist产出，上一个changelist的列表在合并后释放
+	"""
+	for changelist_num, files in changelists:
+		yield [(f'{SCRIPTS_ROOT}/subclassing/ui/panel/Module{folder // 50}/SubPanel{folder % 50}/PyWidget_Panel_{index}.py', changelist_num) for folder, index in files]
+
+def get_relative_path(depot_path):
+	return f"{TOOLBOX_PARENT_PATH}/{depot_path[depot_path.index('Scripts/'):]}"
+
+def build_tuple(changelists):
+	depot_items = {}
+	for files in iter_changelist_files(changelists):
+		for depot_path, changelist_num in files:
+			depot_items[depot_path] = (get_relative_path(depot_path), changelist_num)
+	return depot_items
+
+def build_plain(changelists):
+	depot_items = {}
+	for files in iter_changelist_files(changelists):
+		for depot_path, changelist_num in files:
+			# 与构建中一样，写入时仍要计算一次相对路径，只是不保存
+			get_relative_path(depot_path)
+			depot_items[depot_path] = changelist_num
+	return depot_items
+
+def measure(name, build_func, changelists, lookup_paths):
+	# 内存和耗时分开测量，tracemalloc 会拖慢分配内存的代码
+	tracemalloc.start()
+	result = build_func(changelists)
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del result
+	start_time = time.perf_counter()
+	result = build_func(changelists)
+	build_time = time.perf_counter() - start_time
+	start_time = time.perf_counter()
+	found_count = sum(1 for depot_path in lookup_paths if depot_path in result)
+	lookup_time = time.perf_counter() - start_time
+	print(f"{name:<16} 文件数: {len(result)} 内存: {memory / 1024 / 1024:.2f}MB 合并: {build_time:.3f}s 查找: {lookup_time:.3f}s({found_count})")
+	return result
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--files', type=int, default=50000)
+	parser.add_argument('--changelists', type=int, default=5)
+	args = parser.parse_args()
+	changelists = make_changelists(args.files, args.changelists)
+	lookup_paths = [depot_path for files in iter_changelist_files(changelists) for depot_path, _ in files]
+	tuple_result = measure('relative_path', build_tuple, changelists, lookup_paths)
+	plain_result = measure('changelist_only', build_plain, changelists, lookup_paths)
+	assert {depot_path: item[1] for depot_path, item in tuple_result.items()} == plain_result
+
+if __name__ == "__main__":
+	main()
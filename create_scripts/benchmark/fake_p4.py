@@ -0,0 +1,292 @@
+"""
+	模拟 p4 命令行，用于在没有 Perforce 服务器的环境下跑 benchmark
+	数据来自环境变量 FAKE_P4_CONFIG 指向的 json 文件：
+	{
+		"workspace": "ws_name",
+		"client_root": "/tmp/ws_root",
+		"depot_root": "//depot_marvel/dev",
+		"stream": "//depot_marvel/dev",
+		"opened": {"100": ["//depot_marvel/dev/.../a.py", ...]},
+		"submitted": {"101": ["//depot_marvel/dev/.../b.py", ...]},
+		"shelved": {"102": ["//depot_marvel/dev/.../c.py", ...]},
+		"deleted": ["//depot_marvel/dev/.../d.py"],
+		"file_size": 1024,
+		"diff_lines": 20,
+		"latency": 0.05,
+		"fail_print": ["//depot_marvel/dev/.../c.py"],
+		"recordings": {"-G describe -S 101": "/path/to/describe_101.marshal"}
+	}
+	latency 为每次调用的模拟网络延迟(秒)，fail_print 中的文件 p4 print 会失败
+	deleted 中的文件在 describe/opened 中的 action 为 delete
+	recordings 为录制好的 p4 原始输出(见 record_p4_stream.py)，参数完全一致时原样回放
+	每次调用会向 FAKE_P4_LOG 指向的文件追加一行，用于统计进程启动次数
+"""
+import json, marshal, os, sys, time
+
+def load_config():
+	config_path = os.environ.get('FAKE_P4_CONFIG', '')
+	if not config_path:
+		return {}
+	with open(config_path, 'r', encoding='utf-8') as f:
+		return json.load(f)
+
+def log_invocation(argv):
+	log_path = os.environ.get('FAKE_P4_LOG', '')
+	if not log_path:
+		return
+	with open(log_path, 'a', encoding='utf-8') as f:
+		f.write(json.dumps(argv, ensure_ascii=False) + '\n')
+
+def parse_global_options(argv):
+	"""解析 p4 全局参数，返回 (options, command, command_args)"""
+	options = {'ztag': False, 'marshal': False, 'client': '', 'arg_file': ''}
+	index = 0
+	while index < len(argv):
+		arg = argv[index]
+		if arg == '-ztag':
+			options['ztag'] = True
+		elif arg == '-G':
+			options['marshal'] = True
+		elif arg == '-c':
+			index += 1
+			options['client'] = argv[index]
+		elif arg == '-x':
+			index += 1
+			options['arg_file'] = argv[index]
+		else:
+			break
+		index += 1
+	if index >= len(argv):
+		return options, '', []
+	return options, argv[index], argv[index + 1:]
+
+def read_arg_file(arg_file):
+	if arg_file == '-':
+		lines = sys.stdin.read().split('\n')
+	else:
+		with open(arg_file, 'r', encoding='utf-8') as f:
+			lines = f.read().split('\n')
+	return [line.rstrip('\r') for line in lines if line.strip()]
+
+def write_marshal(record : dict):
+	""" 与 p4 -G 一致，key/value 都是 bytes，marshal 版本 0 """
+	encoded = {}
+	for key, value in record.items():
+		if isinstance(value, str):
+			value = value.encode('utf-8')
+		encoded[key.encode('utf-8')] = value
+	marshal.dump(encoded, sys.stdout.buffer, 0)
+
+def write_marshal_error(message):
+	write_marshal({'code': 'error', 'data': message + '\n', 'severity': 3, 'generic': 17})
+
+def depot_to_local(config, depot_path):
+	depot_root = config.get('depot_root', '//depot_marvel/dev')
+	if not depot_path.startswith(depot_root + '/'):
+		return ''
+	relative_path = depot_path[len(depot_root) + 1:]
+	return config.get('client_root', '') + '/' + relative_path
+
+def depot_to_client(config, depot_path):
+	depot_root = config.get('depot_root', '//depot_marvel/dev')
+	relative_path = depot_path[len(depot_root) + 1:]
+	return f"//{config.get('workspace', '')}/{relative_path}"
+
+def get_action(config, depot_path):
+	return 'delete' if depot_path in config.get('deleted', []) else 'edit'
+
+def cmd_info(config, options, args):
+	stream = config.get('stream', config.get('depot_root', '//depot_marvel/dev'))
+	workspace = options['client'] or config.get('workspace', '')
+	if options['marshal']:
+		write_marshal({'code': 'stat', 'userName': 'fake_user', 'clientName': workspace, 'clientStream': stream, 'clientRoot': config.get('client_root', '')})
+		return 0
+	sys.stdout.write(f"User name: fake_user\nClient name: {workspace}\nClient root: {config.get('client_root', '')}\nClient stream: {stream}\n")
+	return 0
+
+def cmd_clients(config, options, args):
+	workspace = args[args.index('-e') + 1] if '-e' in args else ''
+	if workspace and workspace == config.get('workspace'):
+		sys.stdout.write(f"Client {workspace} 2024/01/01 root {config.get('client_root', '')} 'fake client '\n")
+	return 0
+
+def cmd_client(config, options, args):
+	""" 只支持 client -o，View 为 depot_root/... 映射到 workspace 根目录 """
+	workspace = config.get('workspace', '')
+	view = [f"{config.get('depot_root', '//depot_marvel/dev')}/... //{workspace}/..."]
+	root = config.get('client_root', '')
+	stream = config.get('stream', config.get('depot_root', '//depot_marvel/dev'))
+	if options['marshal']:
+		record = {'code': 'stat', 'Client': workspace, 'Update': '2024/01/01 10:00:00', 'Owner': 'fake_user', 'Root': root, 'Stream': stream}
+		for index, line in enumerate(view):
+			record[f'View{index}'] = line
+		write_marshal(record)
+		return 0
+	sys.stdout.write(f"Client:\t{workspace}\n\nUpdate:\t2024/01/01 10:00:00\n\nOwner:\tfake_user\n\nRoot:\t{root}\n\nStream:\t{stream}\n\nView:\n")
+	for line in view:
+		sys.stdout.write(f"\t{line}\n")
+	return 0
+
+def cmd_opened(config, options, args):
+	changelist_num = args[args.index('-c') + 1] if '-c' in args else ''
+	for depot_path in config.get('opened', {}).get(changelist_num, []):
+		action = get_action(config, depot_path)
+		if options['marshal']:
+			write_marshal({'code': 'stat', 'depotFile': depot_path, 'clientFile': depot_to_client(config, depot_path), 'rev': '1', 'haveRev': '1', 'action': action, 'change': changelist_num, 'type': 'text'})
+		else:
+			sys.stdout.write(f"{depot_path}#1 - {action} change {changelist_num} (text) \n")
+	return 0
+
+def cmd_describe(config, options, args):
+	short = '-s' in args
+	shelved = '-S' in args
+	changelist_list = [arg for arg in args if not arg.startswith('-')]
+	exit_code = 0
+	for changelist_num in changelist_list:
+		if shelved and changelist_num in config.get('shelved', {}):
+			files, status = config['shelved'][changelist_num], 'pending'
+		elif changelist_num in config.get('submitted', {}):
+			files, status = config['submitted'][changelist_num], 'submitted'
+		else:
+			message = f"{changelist_num} - no such changelist."
+			if options['marshal']:
+				write_marshal_error(message)
+			else:
+				sys.stderr.write(message + '\n')
+			exit_code = 1
+			continue
+		if options['marshal']:
+			record = {'code': 'stat', 'change': changelist_num, 'user': 'fake_user', 'client': config.get('workspace', ''), 'time': '1700000000', 'desc': f'fake change {changelist_num}\n', 'status': status, 'changeType': 'public'}
+			if status == 'pending':
+				record['shelved'] = ''
+			for index, depot_path in enumerate(files):
+				record[f'depotFile{index}'] = depot_path
+				record[f'action{index}'] = get_action(config, depot_path)
+				record[f'type{index}'] = 'text'
+				record[f'rev{index}'] = '1'
+			write_marshal(record)
+			continue
+		write_describe_text(config, changelist_num, files, status, short)
+	return exit_code
+
+def write_describe_text(config, changelist_num, files, status, short):
+	""" 与 p4 describe 文本输出格式一致，没有 -s 时附带每个文件的 diff """
+	out = sys.stdout
+	pending = ' *pending*' if status == 'pending' else ''
+	out.write(f"Change {changelist_num} by fake_user@{config.get('workspace', '')} on 2024/01/01 10:00:00{pending}\n\n")
+	out.write(f"\tfake change {changelist_num}\n\n")
+	out.write('Shelved files ...\n\n' if status == 'pending' else 'Affected files ...\n\n')
+	for depot_path in files:
+		out.write(f"... {depot_path}#1 {get_action(config, depot_path)}\n")
+	out.write('\n')
+	if short:
+		return
+	out.write('Differences ...\n\n')
+	diff_lines = config.get('diff_lines', 20)
+	for depot_path in files:
+		out.write(f"==== {depot_path}#1 (text) ====\n\n")
+		out.write(f"1a1,{diff_lines}\n")
+		for index in range(diff_lines):
+			out.write(f"> print('fake diff line {index}')\n")
+		out.write('\n')
+
+
+def cmd_where(config, options, args):
+	exit_code = 0
+	for depot_path in args:
+		local_path = depot_to_local(config, depot_path)
+		if not local_path:
+			sys.stderr.write(f"{depot_path} - file(s) not in client view.\n")
+			exit_code = 1
+			continue
+		client_path = depot_to_client(config, depot_path)
+		if options['ztag']:
+			sys.stdout.write(f"... depotFile {depot_path}\n")
+			sys.stdout.write(f"... clientFile {client_path}\n")
+			sys.stdout.write(f"... path {local_path}\n\n")
+		else:
+			sys.stdout.write(f"{depot_path} {client_path} {local_path}\n")
+	return exit_code
+
+def make_file_content(config, depot_path, changelist_num) -> bytes:
+	""" 根据路径和changelist生成确定的文件内容 """
+	header = f"# {depot_path}@{changelist_num}\n"
+	line = "print('fake p4 content')\n"
+	file_size = config.get('file_size', 256)
+	repeat = max(0, (file_size - len(header)) // len(line))
+	return (header + line * repeat).encode('utf-8')
+
+def find_file_changelist(config, depot_path, changelist_num):
+	""" 文件在指定changelist中存在时返回True """
+	for section in ('submitted', 'shelved'):
+		if depot_path in config.get(section, {}).get(changelist_num, []):
+			return True
+	return False
+
+# p4 -G print 每个 data 记录的最大字节数
+PRINT_CHUNK_SIZE = 4096
+
+def cmd_print(config, options, args):
+	exit_code = 0
+	args = [arg for arg in args if not arg.startswith('-')]
+	for file_spec in args:
+		depot_path, _, changelist_num = file_spec.partition('@=')
+		if depot_path in config.get('fail_print', []) or not find_file_changelist(config, depot_path, changelist_num):
+			if options['marshal']:
+				write_marshal_error(f"{file_spec} - no such file(s).")
+			else:
+				sys.stderr.write(f"{file_spec} - no such file(s).\n")
+			exit_code = 1
+			continue
+		if options['marshal']:
+			content = make_file_content(config, depot_path, changelist_num)
+			write_marshal({'code': 'stat', 'depotFile': depot_path, 'rev': '1', 'change': changelist_num, 'action': 'edit', 'type': 'text', 'fileSize': str(len(content))})
+			for start in range(0, len(content), PRINT_CHUNK_SIZE):
+				write_marshal({'code': 'text', 'data': content[start:start + PRINT_CHUNK_SIZE]})
+			write_marshal({'code': 'text', 'data': b''})
+			continue
+		sys.stdout.write(f"{depot_path}#1 - edit change {changelist_num} (text)\n")
+		sys.stdout.flush()
+		sys.stdout.buffer.write(make_file_content(config, depot_path, changelist_num))
+		sys.stdout.buffer.flush()
+	return exit_code
+
+def replay_recording(config, argv):
+	""" 有录制的输出时原样回放，返回是否回放成功 """
+	recording_path = config.get('recordings', {}).get(' '.join(argv))
+	if not recording_path:
+		return False
+	with open(recording_path, 'rb') as f:
+		while chunk := f.read(65536):
+			sys.stdout.buffer.write(chunk)
+	sys.stdout.buffer.flush()
+	return True
+
+COMMANDS = {
+	'info': cmd_info,
+	'clients': cmd_clients,
+	'client': cmd_client,
+	'describe': cmd_describe,
+	'print': cmd_print,
+	'opened': cmd_opened,
+	'where': cmd_where,
+}
+
+def main(argv):
+	log_invocation(argv)
+	config = load_config()
+	if config.get('latency'):
+		time.sleep(config['latency'])
+	if replay_recording(config, argv):
+		return 0
+	options, command, args = parse_global_options(argv)
+	if options['arg_file']:
+		args = args + read_arg_file(options['arg_file'])
+	func = COMMANDS.get(command)
+	if func is None:
+		sys.stderr.write(f"Unknown command: {command}\n")
+		return 1
+	return func(config, options, args)
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
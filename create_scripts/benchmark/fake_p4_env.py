@@ -0,0 +1,58 @@
+"""
+	把 fake_p4.py 包装成 PATH 中的 p4 可执行文件，供各个 benchmark 复用
+	只支持 Linux/macOS（Windows 下 subprocess 不会通过 PATHEXT 找到 p4.bat）
+"""
+import json, os, sys, stat, tempfile
+
+FAKE_P4_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_p4.py')
+
+class FakeP4Env:
+	""" 临时目录中的 fake p4 环境，with 语句内修改 PATH 等环境变量 """
+	def __init__(self, config : dict):
+		self.temp_dir = tempfile.TemporaryDirectory(prefix='fake_p4_')
+		self.root = self.temp_dir.name
+		self.bin_dir = os.path.join(self.root, 'bin')
+		self.config_path = os.path.join(self.root, 'fake_p4_config.json')
+		self.log_path = os.path.join(self.root, 'fake_p4_log.txt')
+		self.config = config
+		self._old_environ = {}
+
+	def __enter__(self):
+		os.makedirs(self.bin_dir, exist_ok=True)
+		wrapper_path = os.path.join(self.bin_dir, 'p4')
+		with open(wrapper_path, 'w', encoding='utf-8') as f:
+			f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_P4_SCRIPT}" "$@"\n')
+		os.chmod(wrapper_path, os.stat(wrapper_path).st_mode | stat.S_IEXEC)
+		self.write_config()
+		new_environ = {
+			'PATH': self.bin_dir + os.pathsep + os.environ.get('PATH', ''),
+			'FAKE_P4_CONFIG': self.config_path,
+			'FAKE_P4_LOG': self.log_path,
+		}
+		for key, value in new_environ.items():
+			self._old_environ[key] = os.environ.get(key)
+			os.environ[key] = value
+		return self
+
+	def __exit__(self, *exc_info):
+		for key, value in self._old_environ.items():
+			if value is None:
+				os.environ.pop(key, None)
+			else:
+				os.environ[key] = value
+		self.temp_dir.cleanup()
+
+	def write_config(self):
+		with open(self.config_path, 'w', encoding='utf-8') as f:
+			json.dump(self.config, f, ensure_ascii=False)
+
+	def invocations(self) -> list[list]:
+		""" 返回所有 p4 调用的参数列表 """
+		if not os.path.exists(self.log_path):
+			return []
+		with open(self.log_path, 'r', encoding='utf-8') as f:
+			return [json.loads(line) for line in f if line.strip()]
+
+	def reset_invocations(self):
+		if os.path.exists(self.log_path):
+			os.remove(self.log_path)
@@ -0,0 +1,26 @@
+"""
+	录制真实 p4 -G 命令的原始输出，供 fake_p4.py 通过 config 中的 recordings 回放
+	用法: python record_p4_stream.py <输出文件> <p4参数...>
+	例如: python record_p4_stream.py describe_2706009.marshal describe -s -S 2706009
+	回放时 recordings 的 key 为 "-G " + p4参数，例如 "-G describe -s -S 2706009"
+"""
+import os, sys, subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from p4_marshal import iter_marshal_records
+
+def main(output_path, p4_args):
+	command = ['p4', '-G'] + p4_args
+	result = subprocess.run(command, capture_output=True)
+	with open(output_path, 'wb') as f:
+		f.write(result.stdout)
+	with open(output_path, 'rb') as f:
+		record_count = sum(1 for _ in iter_marshal_records(f))
+	print(f'录制完成: {output_path} {record_count} 条记录 exit code {result.returncode}')
+	print(f'recordings key: "{" ".join(command[1:])}"')
+
+if __name__ == "__main__":
+	if len(sys.argv) < 3:
+		print("Usage: python record_p4_stream.py <output_file> <p4 args...>")
+		sys.exit(1)
+	main(sys.argv[1], sys.argv[2:])
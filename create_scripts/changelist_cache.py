@@ -0,0 +1,62 @@
+"""
+	已提交changelist的文件列表缓存
+	已提交的changelist中的文件列表不会再变化，p4 describe 的解析结果存到 sqlite 中，
+	再次构建时不需要重新查询服务器；shelve/pending 的changelist不会缓存
+"""
+import os, sys, time, sqlite3, threading
+
+CACHE_FILE_NAME = 'ChangelistCache.sqlite'
+
+def get_default_cache_path():
+	if getattr(sys, 'frozen', False):
+		application_path = sys.executable
+	else:
+		application_path = os.path.abspath(__file__)
+	return os.path.join(os.path.dirname(application_path), CACHE_FILE_NAME)
+
+class ChangelistCache:
+	""" 以changelist号为key，保存所有文件的 (depot_path, action)，没有过滤 """
+	def __init__(self, db_path = None):
+		self.db_path = db_path or get_default_cache_path()
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+		self._db.executescript('''
+			CREATE TABLE IF NOT EXISTS changelists (
+				change TEXT PRIMARY KEY,
+				created REAL NOT NULL
+			);
+			CREATE TABLE IF NOT EXISTS changelist_files (
+				change TEXT NOT NULL,
+				depot_path TEXT NOT NULL,
+				action TEXT NOT NULL
+			);
+			CREATE INDEX IF NOT EXISTS changelist_files_change ON changelist_files(change);
+		''')
+		self._db.commit()
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+	def get(self, changelist_num) -> list:
+		""" 返回 [(depot_path, action)]，没有缓存时返回None """
+		change = str(changelist_num)
+		with self._lock:
+			row = self._db.execute('SELECT 1 FROM changelists WHERE change = ?', (change,)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			files = self._db.execute('SELECT depot_path, action FROM changelist_files WHERE change = ? ORDER BY rowid', (change,)).fetchall()
+		self.hits += 1
+		return files
+
+	def put(self, changelist_num, files : list):
+		""" 只应该传入已提交的changelist """
+		change = str(changelist_num)
+		with self._lock:
+			self._db.execute('DELETE FROM changelist_files WHERE change = ?', (change,))
+			self._db.executemany('INSERT INTO changelist_files(change, depot_path, action) VALUES(?, ?, ?)', [(change, depot_path, action) for depot_path, action in files])
+			self._db.execute('INSERT OR REPLACE INTO changelists(change, created) VALUES(?, ?)', (change, time.time()))
+			self._db.commit()
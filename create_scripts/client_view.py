@@ -0,0 +1,284 @@
+"""
+	workspace 的 View 映射，在本地把 depot 路径转换为本地路径，不需要 p4 where
+	通过 p4 -G client -o 获取 Root 和 View，编译成按路径段索引的前缀树，
+	支持 ...、*、%%1-%%9 通配符，+ 叠加映射和 - 排除映射，后面的映射行优先
+	编译前的 View 缓存在 ClientViewCache.json 中，下次运行直接使用，转换结果不对时调用方可以 refresh
+"""
+import os, re, sys, json, time
+from p4_marshal import iter_p4_marshal, P4MarshalError
+
+CACHE_FILE_NAME = 'ClientViewCache.json'
+# 缓存的 View 超过这个时间(秒)重新获取，可用环境变量 OVERLAY_CLIENT_VIEW_TTL 覆盖
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+WILDCARD_PATTERN = re.compile(r'\.\.\.|\*|%%[1-9]')
+
+def get_default_cache_path():
+	if getattr(sys, 'frozen', False):
+		application_path = sys.executable
+	else:
+		application_path = os.path.abspath(__file__)
+	return os.path.join(os.path.dirname(application_path), CACHE_FILE_NAME)
+
+def get_default_cache_ttl():
+	try:
+		return float(os.environ.get('OVERLAY_CLIENT_VIEW_TTL', DEFAULT_CACHE_TTL))
+	except ValueError:
+		return DEFAULT_CACHE_TTL
+
+def split_view_line(line : str) -> tuple[str, str, str]:
+	"""
+	解析一行 View，返回 (flag, depot_path, client_path)，flag 为 ''、'+'、'-' 或 '&'
+	路径中有空格时用双引号括起来，flag 可以在引号内或引号外
+	"""
+	tokens = []
+	index = 0
+	while index < len(line):
+		if line[index].isspace():
+			index += 1
+			continue
+		flag = ''
+		if line[index] in '+-&':
+			flag = line[index]
+			index += 1
+		if index < len(line) and line[index] == '"':
+			end = line.index('"', index + 1)
+			token = line[index + 1:end]
+			index = end + 1
+		else:
+			end = index
+			while end < len(line) and not line[end].isspace():
+				end += 1
+			token = line[index:end]
+			index = end
+		if not flag and token[:1] in ('+', '-', '&'):
+			flag, token = token[0], token[1:]
+		tokens.append((flag, token))
+	if len(tokens) != 2:
+		raise ValueError(f'invalid view line: {line}')
+	return tokens[0][0], tokens[0][1], tokens[1][1]
+
+def _compile_pattern(path : str):
+	"""
+	把带通配符的路径编译为正则，返回 (regex, 通配符列表, 第一个通配符前的字面前缀)
+	第 k 个 ... 与另一侧第 k 个 ... 对应，* 同理，%%n 按编号对应
+	"""
+	parts = []
+	wildcards = []
+	position = 0
+	counts = {'...': 0, '*': 0}
+	for match in WILDCARD_PATTERN.finditer(path):
+		parts.append(re.escape(path[position:match.start()]))
+		token = match.group()
+		if token in counts:
+			name = f'{"d" if token == "..." else "s"}{counts[token]}'
+			counts[token] += 1
+		else:
+			name = f'p{token[2]}'
+		if name in wildcards:
+			# 同一个 %%n 出现多次时必须匹配相同内容
+			parts.append(f'(?P={name})')
+		else:
+			parts.append(f'(?P<{name}>.*)' if token == '...' else f'(?P<{name}>[^/]*)')
+			wildcards.append(name)
+		position = match.end()
+	parts.append(re.escape(path[position:]))
+	first_wildcard = WILDCARD_PATTERN.search(path)
+	literal_prefix = path if first_wildcard is None else path[:first_wildcard.start()]
+	return re.compile(''.join(parts) + r'\Z', re.DOTALL), wildcards, literal_prefix
+
+def _compile_template(path : str):
+	""" 右侧路径编译为 [(字面内容, 通配符名)]，用于替换 """
+	template = []
+	position = 0
+	counts = {'...': 0, '*': 0}
+	for match in WILDCARD_PATTERN.finditer(path):
+		token = match.group()
+		if token in counts:
+			name = f'{"d" if token == "..." else "s"}{counts[token]}'
+			counts[token] += 1
+		else:
+			name = f'p{token[2]}'
+		template.append((path[position:match.start()], name))
+		position = match.end()
+	template.append((path[position:], None))
+	return template
+
+class ViewMapping:
+	"""
+	一行映射，不区分大小写时用小写路径匹配，替换时从原始路径按位置取通配符内容，保留原始大小写
+	"""
+	__slots__ = ('flag', 'depot_path', 'client_path', 'depot_regex', 'client_regex', 'client_template', 'depot_prefix')
+
+	def __init__(self, flag, depot_path, client_path, case_sensitive = False):
+		self.flag = flag
+		self.depot_path = depot_path
+		self.client_path = client_path
+		self.depot_regex, _, self.depot_prefix = _compile_pattern(depot_path if case_sensitive else depot_path.lower())
+		self.client_regex = _compile_pattern(client_path if case_sensitive else client_path.lower())[0]
+		self.client_template = _compile_template(client_path)
+
+	def translate(self, match, depot_path) -> str:
+		result = []
+		for literal, name in self.client_template:
+			result.append(literal)
+			if name is not None and match.start(name) >= 0:
+				result.append(depot_path[match.start(name):match.end(name)])
+		return ''.join(result)
+
+class _PrefixNode:
+	""" 前缀树节点，按路径段索引，lines 为在这一层结束的 (剩余的字面前缀, 映射行号) """
+	__slots__ = ('children', 'lines')
+
+	def __init__(self):
+		self.children = {}
+		self.lines = []
+
+class ClientView:
+	"""
+	root: workspace 根目录
+	view_lines: p4 client -o 中的 View 行
+	case_sensitive: 服务器是否区分大小写(Windows 服务器不区分)
+	"""
+	def __init__(self, client_name, root, view_lines : list, case_sensitive = False):
+		self.client_name = client_name
+		self.root = root
+		self.view_lines = list(view_lines)
+		self.case_sensitive = case_sensitive
+		self.mappings = []
+		self._tree = _PrefixNode()
+		for line in self.view_lines:
+			self._add_mapping(ViewMapping(*split_view_line(line), case_sensitive))
+		self._client_prefix = f'//{client_name}/'
+
+	def _add_mapping(self, mapping : ViewMapping):
+		index = len(self.mappings)
+		self.mappings.append(mapping)
+		segments = mapping.depot_prefix.split('/')
+		node = self._tree
+		for segment in segments[:-1]:
+			node = node.children.setdefault(segment, _PrefixNode())
+		node.lines.append((segments[-1], index))
+
+	def _iter_candidates(self, depot_path : str):
+		""" 字面前缀与路径匹配的映射行号 """
+		segments = depot_path.split('/')
+		node = self._tree
+		for segment in segments:
+			for partial, index in node.lines:
+				if segment.startswith(partial):
+					yield index
+			node = node.children.get(segment)
+			if node is None:
+				return
+
+	def depot_to_client(self, depot_path : str):
+		""" 返回 //client/... 形式的路径，不在 View 中时返回None """
+		key = depot_path if self.case_sensitive else depot_path.lower()
+		match = None
+		line_index = -1
+		for index in sorted(self._iter_candidates(key), reverse=True):
+			match = self.mappings[index].depot_regex.match(key)
+			if match is not None:
+				line_index = index
+				break
+		if match is None:
+			return None
+		mapping = self.mappings[line_index]
+		if mapping.flag == '-':
+			return None
+		client_path = mapping.translate(match, depot_path)
+		# 后面的非叠加映射(包括排除)占用了同一个本地路径时，这一行的映射被覆盖
+		client_key = client_path if self.case_sensitive else client_path.lower()
+		for later in self.mappings[line_index + 1:]:
+			if later.flag not in ('+', '&') and later.client_regex.match(client_key):
+				return None
+		return client_path
+
+	def depot_to_local(self, depot_path : str):
+		""" 返回本地路径，不在 View 中时返回None """
+		client_path = self.depot_to_client(depot_path)
+		if client_path is None:
+			return None
+		if client_path.lower().startswith(self._client_prefix.lower()):
+			relative_path = client_path[len(self._client_prefix):]
+		else:
+			relative_path = client_path.lstrip('/')
+		return os.path.normpath(os.path.join(self.root, relative_path))
+
+	def to_dict(self) -> dict:
+		return {'client': self.client_name, 'root': self.root, 'view': self.view_lines, 'case_sensitive': self.case_sensitive}
+
+	@classmethod
+	def from_dict(cls, data : dict):
+		return cls(data['client'], data['root'], data['view'], data.get('case_sensitive', False))
+
+def fetch_client_view(client_name) -> ClientView:
+	""" p4 -G client -o 获取 Root 和 View，获取失败时返回None """
+	try:
+		for record in iter_p4_marshal(['p4', 'client', '-o', client_name]):
+			if record.get('code') == 'error':
+				print(f"p4 client -o error: {record.get('data', '').strip()}")
+				return None
+			view_lines = []
+			index = 0
+			while f'View{index}' in record:
+				view_lines.append(record[f'View{index}'])
+				index += 1
+			root = record.get('Root', '')
+			if not root or not view_lines:
+				return None
+			return ClientView(record.get('Client', client_name), root, view_lines)
+	except (P4MarshalError, OSError, ValueError) as e:
+		print(f"fetch_client_view error: {e}")
+	return None
+
+class ClientViewCache:
+	""" 以 workspace 名为key缓存 View，json 文件 """
+	def __init__(self, cache_path = None, ttl = None):
+		self.cache_path = cache_path or get_default_cache_path()
+		self.ttl = get_default_cache_ttl() if ttl is None else ttl
+		# {workspace: (ClientView, 获取时间)}，常驻进程中也按 ttl 过期
+		self._views = {}
+
+	def _load(self) -> dict:
+		try:
+			with open(self.cache_path, 'r', encoding='utf-8') as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		return data if isinstance(data, dict) else {}
+
+	def _save(self, data : dict):
+		temp_path = self.cache_path + '.tmp'
+		try:
+			with open(temp_path, 'w', encoding='utf-8') as f:
+				json.dump(data, f, ensure_ascii=False, indent=1)
+			os.replace(temp_path, self.cache_path)
+		except OSError as e:
+			print(f"ClientViewCache: 保存失败 {e}")
+
+	def get(self, client_name, refresh = False) -> ClientView:
+		""" 优先使用本次运行已经编译的 View，其次是缓存文件，都没有或过期时从服务器获取 """
+		if not refresh and client_name in self._views:
+			client_view, fetched = self._views[client_name]
+			if time.time() - fetched < self.ttl:
+				return client_view
+		data = self._load()
+		entry = data.get(client_name)
+		client_view = None
+		fetched = entry.get('fetched', 0) if entry else 0
+		if not refresh and entry and time.time() - fetched < self.ttl:
+			try:
+				client_view = ClientView.from_dict(entry)
+			except (KeyError, ValueError):
+				client_view = None
+		if client_view is None:
+			client_view = fetch_client_view(client_name)
+			if client_view is None:
+				return None
+			fetched = time.time()
+			data[client_name] = dict(client_view.to_dict(), fetched=fetched)
+			self._save(data)
+		self._views[client_name] = (client_view, fetched)
+		return client_view
@@ -0,0 +1,218 @@
+"""
+	depot 文件版本的本地缓存
+	已提交changelist中的文件内容不会再变化，以 depot_path@=changelist 为key缓存，
+	文件内容按sha256存储(相同内容只存一份)，超过容量上限时按最近使用时间淘汰
+	命令行: python file_cache.py stats|prune|clear [--root 缓存目录] [--max-size MB]
+"""
+import os, sys, time, shutil, sqlite3, hashlib, argparse, threading, tempfile
+
+# 默认缓存容量上限(MB)，可用环境变量 OVERLAY_FILE_CACHE_MAX_MB 覆盖
+DEFAULT_MAX_SIZE_MB = 2048
+CACHE_FOLDER_NAME = 'FileCache'
+
+def get_default_cache_root():
+	if getattr(sys, 'frozen', False):
+		application_path = sys.executable
+	else:
+		application_path = os.path.abspath(__file__)
+	return os.path.join(os.path.dirname(application_path), CACHE_FOLDER_NAME)
+
+def get_default_max_size():
+	try:
+		return int(os.environ.get('OVERLAY_FILE_CACHE_MAX_MB', DEFAULT_MAX_SIZE_MB)) * 1024 * 1024
+	except ValueError:
+		return DEFAULT_MAX_SIZE_MB * 1024 * 1024
+
+def make_cache_key(depot_path, changelist_num):
+	return f'{depot_path}@={changelist_num}'
+
+class FileCache:
+	"""
+	线程安全，下载线程可以直接调用
+	命中时只在内存中记录使用时间和命中数，flush 时一次写入数据库(每次构建结束时调用)，
+	不需要每个文件都 UPDATE + commit 一次
+	"""
+	def __init__(self, root = None, max_size = None):
+		self.root = root or get_default_cache_root()
+		self.blob_root = os.path.join(self.root, 'blobs')
+		self.max_size = get_default_max_size() if max_size is None else max_size
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		# 还没有写入数据库的 {key: 最近使用时间} 和 {计数名: 增量}
+		self._pending_touches = {}
+		self._pending_counters = {}
+		os.makedirs(self.blob_root, exist_ok=True)
+		self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), check_same_thread=False)
+		self._db.executescript('''
+			CREATE TABLE IF NOT EXISTS entries (
+				key TEXT PRIMARY KEY,
+				digest TEXT NOT NULL,
+				size INTEGER NOT NULL,
+				last_used REAL NOT NULL
+			);
+			CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+			CREATE INDEX IF NOT EXISTS entries_digest ON entries(digest);
+			CREATE TABLE IF NOT EXISTS counters (
+				name TEXT PRIMARY KEY,
+				value INTEGER NOT NULL
+			);
+		''')
+		self._db.commit()
+
+	def close(self):
+		self.flush()
+		with self._lock:
+			self._db.close()
+
+	def flush(self):
+		""" 把命中记录(LRU 使用时间、命中数)写入数据库，只 commit 一次 """
+		with self._lock:
+			if not self._pending_touches and not self._pending_counters:
+				return
+			self._db.executemany('UPDATE entries SET last_used = ? WHERE key = ?', [(last_used, key) for key, last_used in self._pending_touches.items()])
+			for name, value in self._pending_counters.items():
+				self._add_counter(name, value)
+			self._db.commit()
+			self._pending_touches.clear()
+			self._pending_counters.clear()
+
+	def _blob_path(self, digest):
+		return os.path.join(self.blob_root, digest[:2], digest)
+
+	def _add_counter(self, name, value = 1):
+		self._db.execute('INSERT INTO counters(name, value) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, value, value))
+
+	def _forget(self, key):
+		with self._lock:
+			self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+			self._db.commit()
+
+	def get_blob_path(self, key):
+		""" 命中时返回缓存文件路径(只读)，没有命中返回None """
+		with self._lock:
+			row = self._db.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+		if row is not None and not os.path.exists(self._blob_path(row[0])):
+			# blob 被手动删除，当作没有命中
+			self._forget(key)
+			row = None
+		with self._lock:
+			if row is not None:
+				self._pending_touches[key] = time.time()
+			counter_name = 'hits' if row is not None else 'misses'
+			self._pending_counters[counter_name] = self._pending_counters.get(counter_name, 0) + 1
+		if row is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		return self._blob_path(row[0])
+
+	def put_stream(self, key, fileobj):
+		""" 从文件对象读取内容加入缓存，边写临时文件边计算hash """
+		sha256 = hashlib.sha256()
+		# 先写临时文件再改名，避免并发或中断时留下不完整的blob
+		fd, temp_path = tempfile.mkstemp(dir=self.blob_root)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				while chunk := fileobj.read(1024 * 1024):
+					sha256.update(chunk)
+					f.write(chunk)
+			digest = sha256.hexdigest()
+			blob_path = self._blob_path(digest)
+			os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+			if os.path.exists(blob_path):
+				os.remove(temp_path)
+			else:
+				os.replace(temp_path, blob_path)
+		except BaseException:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+			raise
+		size = os.path.getsize(blob_path)
+		with self._lock:
+			self._db.execute('INSERT OR REPLACE INTO entries(key, digest, size, last_used) VALUES(?, ?, ?, ?)', (key, digest, size, time.time()))
+			self._db.commit()
+
+	def total_size(self):
+		""" 所有blob的大小(相同内容只算一次) """
+		with self._lock:
+			row = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)').fetchone()
+		return row[0]
+
+	def stats(self) -> dict:
+		self.flush()
+		with self._lock:
+			entry_count, = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()
+			blob_count, = self._db.execute('SELECT COUNT(DISTINCT digest) FROM entries').fetchone()
+			counters = dict(self._db.execute('SELECT name, value FROM counters').fetchall())
+		return {
+			'root': self.root,
+			'entries': entry_count,
+			'blobs': blob_count,
+			'size': self.total_size(),
+			'max_size': self.max_size,
+			'session_hits': self.hits,
+			'session_misses': self.misses,
+			'total_hits': counters.get('hits', 0),
+			'total_misses': counters.get('misses', 0),
+		}
+
+	def prune(self, max_size = None) -> int:
+		""" 按最近使用时间淘汰，直到总大小不超过max_size，返回删除的blob数 """
+		max_size = self.max_size if max_size is None else max_size
+		# 先写入本次构建的使用时间，刚用过的文件不会被淘汰
+		self.flush()
+		removed_count = 0
+		total_size = self.total_size()
+		if total_size <= max_size:
+			return 0
+		with self._lock:
+			rows = self._db.execute('SELECT key, digest, size FROM entries ORDER BY last_used').fetchall()
+			for key, digest, size in rows:
+				if total_size <= max_size:
+					break
+				self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+				still_used = self._db.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+				if still_used:
+					continue
+				try:
+					os.remove(self._blob_path(digest))
+				except OSError:
+					pass
+				total_size -= size
+				removed_count += 1
+			self._db.commit()
+		return removed_count
+
+	def clear(self):
+		with self._lock:
+			self._pending_touches.clear()
+			self._pending_counters.clear()
+			self._db.execute('DELETE FROM entries')
+			self._db.execute('DELETE FROM counters')
+			self._db.commit()
+		shutil.rmtree(self.blob_root, ignore_errors=True)
+		os.makedirs(self.blob_root, exist_ok=True)
+
+def print_cache_stats(stats : dict):
+	print(f"缓存目录: {stats['root']}")
+	print(f"缓存文件: {stats['entries']} 条 {stats['blobs']} 个blob")
+	print(f"缓存大小: {stats['size'] / 1024 / 1024:.1f}MB / {stats['max_size'] / 1024 / 1024:.0f}MB")
+	print(f"本次命中: {stats['session_hits']} 未命中: {stats['session_misses']}")
+	print(f"累计命中: {stats['total_hits']} 未命中: {stats['total_misses']}")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("action", choices=['stats', 'prune', 'clear'])
+	parser.add_argument("--root", type=str, default=None, help="缓存目录")
+	parser.add_argument("--max-size", type=int, default=None, help="容量上限(MB)")
+	args = parser.parse_args()
+	max_size = None if args.max_size is None else args.max_size * 1024 * 1024
+	file_cache = FileCache(args.root, max_size)
+	if args.action == 'prune':
+		print(f'淘汰了 {file_cache.prune()} 个blob')
+	elif args.action == 'clear':
+		file_cache.clear()
+		print('缓存已清空')
+	print_cache_stats(file_cache.stats())
+	file_cache.close()
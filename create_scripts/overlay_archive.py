@@ -0,0 +1,178 @@
+"""
+	overlay 输出：写入 OverlayFolder 文件夹、直接写入 zip，或两者同时写
+	下载/复制阶段得到的文件内容直接写进 zip，不需要等文件夹写完后再调用 tar 读一遍
+	zip 内的目录结构与之前 tar 压缩 Windows 文件夹的结构一致: Windows/Marvel/Content/Marvel/...
+"""
+import os, shutil, zipfile, tempfile, threading, warnings
+from overlay_copy import copy_file_fast, unlink_shared_file
+
+# 单个文件在内存中缓存的上限，超过后写入临时文件
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+# 默认压缩等级，0 为只存储不压缩
+DEFAULT_COMPRESS_LEVEL = 6
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class OverlayArchive:
+	""" 线程安全的 zip 写入，先写临时文件，close 时替换目标 zip """
+	def __init__(self, zip_path, compress_level = DEFAULT_COMPRESS_LEVEL):
+		self.zip_path = zip_path
+		self.file_count = 0
+		os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+		self._temp_path = zip_path + '.tmp'
+		if compress_level:
+			self._zip_file = zipfile.ZipFile(self._temp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compress_level)
+		else:
+			self._zip_file = zipfile.ZipFile(self._temp_path, 'w', zipfile.ZIP_STORED)
+		self._folders = set()
+		self._names = set()
+		# 被覆盖或丢弃的项，close 时重写 zip 去掉
+		self._need_rewrite = False
+		self._discarded_names = set()
+		self._compress_level = compress_level
+		self._lock = threading.Lock()
+
+	def _add_folders(self, arcname):
+		""" 与 tar 一致，为每一级目录写入目录项 """
+		parts = arcname.split('/')[:-1]
+		for index in range(1, len(parts) + 1):
+			folder = '/'.join(parts[:index]) + '/'
+			if folder not in self._folders:
+				self._folders.add(folder)
+				self._zip_file.writestr(zipfile.ZipInfo(folder), b'')
+
+	def write_stream(self, arcname, fileobj):
+		""" 从文件对象流式写入一个 zip 项 """
+		arcname = arcname.replace('\\', '/')
+		with self._lock:
+			self._add_folders(arcname)
+			if arcname in self._names:
+				# 同名的项在 close 时去重，只在打开重复项时忽略 zipfile 的重复名警告，不影响进程中的其他 zip
+				with warnings.catch_warnings():
+					warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+					entry = self._zip_file.open(arcname, 'w', force_zip64=True)
+			else:
+				entry = self._zip_file.open(arcname, 'w', force_zip64=True)
+			with entry:
+				shutil.copyfileobj(fileobj, entry, COPY_BUFFER_SIZE)
+			self._discarded_names.discard(arcname)
+			if arcname in self._names:
+				# 同一个文件被后面的changelist覆盖，close 时只保留最后写入的内容
+				self._need_rewrite = True
+			else:
+				self._names.add(arcname)
+				self.file_count += 1
+
+	def write_file(self, arcname, path):
+		with open(path, 'rb') as f:
+			self.write_stream(arcname, f)
+
+	def discard(self, arcname):
+		""" 丢弃已经写入的项(例如被本地文件代替)，close 时从 zip 中去掉 """
+		arcname = arcname.replace('\\', '/')
+		with self._lock:
+			if arcname not in self._names:
+				return
+			self._names.remove(arcname)
+			self._discarded_names.add(arcname)
+			self._need_rewrite = True
+			self.file_count -= 1
+
+	def _rewrite(self):
+		""" 重写 zip，同名的项只保留最后一个，去掉丢弃的项 """
+		rewrite_path = self._temp_path + '.rewrite'
+		with zipfile.ZipFile(self._temp_path, 'r') as source_zip:
+			last_infos = {}
+			for info in source_zip.infolist():
+				if info.filename not in self._discarded_names:
+					last_infos[info.filename] = info
+			compression = zipfile.ZIP_DEFLATED if self._compress_level else zipfile.ZIP_STORED
+			with zipfile.ZipFile(rewrite_path, 'w', compression, compresslevel=self._compress_level or None) as target_zip:
+				for info in last_infos.values():
+					if info.is_dir():
+						target_zip.writestr(info, b'')
+						continue
+					with source_zip.open(info) as source_entry, target_zip.open(info.filename, 'w', force_zip64=True) as target_entry:
+						shutil.copyfileobj(source_entry, target_entry, COPY_BUFFER_SIZE)
+		os.replace(rewrite_path, self._temp_path)
+
+	def close(self):
+		with self._lock:
+			self._zip_file.close()
+			if self._need_rewrite:
+				self._rewrite()
+			os.replace(self._temp_path, self.zip_path)
+
+	def abort(self):
+		with self._lock:
+			self._zip_file.close()
+			os.remove(self._temp_path)
+
+class OverlayEntryWriter:
+	"""
+	写入单个 overlay 文件，内容先缓存在 SpooledTemporaryFile 中
+	commit 时一次性写入文件夹和 zip，abort 时丢弃，不会留下不完整的文件
+	"""
+	def __init__(self, output : 'OverlayOutput', destination_path):
+		self.output = output
+		self.destination_path = destination_path
+		self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+	def write(self, data):
+		self._spool.write(data)
+
+	def commit(self, on_saved = None):
+		"""
+		on_saved(fileobj): 写入完成后回调，可以再读取一次内容(例如加入文件缓存)
+		"""
+		try:
+			if self.output.write_folder:
+				os.makedirs(os.path.dirname(self.destination_path), exist_ok=True)
+				self._spool.seek(0)
+				unlink_shared_file(self.destination_path)
+				with open(self.destination_path, 'wb') as f:
+					shutil.copyfileobj(self._spool, f, COPY_BUFFER_SIZE)
+			if self.output.archive is not None:
+				self._spool.seek(0)
+				self.output.archive.write_stream(self.output.arcname(self.destination_path), self._spool)
+			if on_saved is not None:
+				self._spool.seek(0)
+				on_saved(self._spool)
+		finally:
+			self._spool.close()
+
+	def abort(self):
+		self._spool.close()
+
+class OverlayOutput:
+	"""
+	root: OverlayFolder 路径，zip 内的路径为相对 root 的路径
+	archive: 为None时不生成 zip
+	write_folder: 为False时只写 zip(zip only 模式)
+	"""
+	def __init__(self, root, archive : OverlayArchive = None, write_folder = True):
+		self.root = os.path.normpath(root)
+		self.archive = archive
+		self.write_folder = write_folder
+
+	def arcname(self, destination_path):
+		return os.path.relpath(os.path.normpath(destination_path), self.root).replace('\\', '/')
+
+	def open_file(self, destination_path) -> OverlayEntryWriter:
+		return OverlayEntryWriter(self, destination_path)
+
+	def add_file(self, destination_path, source_path, use_hardlink = False):
+		"""
+		复制已有文件(本地文件、缓存)
+		use_hardlink: 文件夹中用硬链接代替复制，失败时退回复制
+		"""
+		if self.write_folder:
+			os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+			# 目标是硬链接时 copy_file_fast 先删除再写入
+			copy_file_fast(source_path, destination_path, use_hardlink)
+		if self.archive is not None:
+			self.archive.write_file(self.arcname(destination_path), source_path)
+
+	def add_existing(self, destination_path):
+		""" 文件夹中已有且没有变化的文件，只需要写入 zip """
+		if self.archive is not None:
+			self.archive.write_file(self.arcname(destination_path), destination_path)
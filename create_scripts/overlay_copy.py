@@ -0,0 +1,78 @@
+"""
+	批量复制本地文件
+	代替每个文件启动一次 shell 执行 copy：目标目录只创建一次，
+	Linux 上优先用 copy_file_range，其他情况用 shutil.copyfile(内部会使用 sendfile/fcopyfile)，
+	可选硬链接模式，多个文件在小线程池中并发复制
+"""
+import os, shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认并发复制数，本地磁盘不需要太多
+DEFAULT_COPY_WORKER_COUNT = 4
+
+def _copy_file_range(source_path, destination_path):
+	""" 内核内复制，不经过用户态缓冲区 """
+	with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+		remaining = os.fstat(source_file.fileno()).st_size
+		while remaining > 0:
+			copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+			if copied == 0:
+				break
+			remaining -= copied
+
+def unlink_shared_file(path):
+	""" 目标是硬链接(与缓存或工作区共用)时先删除，写入新内容不会修改另一边的文件 """
+	try:
+		if os.stat(path).st_nlink > 1:
+			os.remove(path)
+	except FileNotFoundError:
+		pass
+
+def copy_file_fast(source_path, destination_path, use_hardlink = False):
+	"""
+	复制单个文件，目标目录需要已经存在
+	目标是上次 --hardlink 构建留下的硬链接时先删除，复制不会截断工作区中的文件
+	"""
+	if use_hardlink:
+		if os.path.lexists(destination_path):
+			os.remove(destination_path)
+		try:
+			os.link(source_path, destination_path)
+			return
+		except OSError:
+			# 跨盘符或文件系统不支持时退回复制
+			pass
+	else:
+		unlink_shared_file(destination_path)
+	if hasattr(os, 'copy_file_range'):
+		try:
+			_copy_file_range(source_path, destination_path)
+			return
+		except OSError:
+			pass
+	shutil.copyfile(source_path, destination_path)
+
+def copy_files(file_pairs : list, worker_count = DEFAULT_COPY_WORKER_COUNT, use_hardlink = False) -> dict:
+	"""
+	复制所有文件 file_pairs: [(source_path, destination_path)]
+	返回复制失败的 {(source_path, destination_path): error}
+	"""
+	if not file_pairs:
+		return {}
+	# 每个目标目录只创建一次
+	for folder in sorted({os.path.dirname(destination_path) for _, destination_path in file_pairs}):
+		os.makedirs(folder, exist_ok=True)
+
+	def copy_one(file_pair):
+		try:
+			copy_file_fast(file_pair[0], file_pair[1], use_hardlink)
+		except OSError as e:
+			return e
+		return None
+
+	errors = {}
+	with ThreadPoolExecutor(max_workers=max(1, min(worker_count, len(file_pairs)))) as executor:
+		for file_pair, error in zip(file_pairs, executor.map(copy_one, file_pairs)):
+			if error is not None:
+				errors[file_pair] = error
+	return errors
@@ -0,0 +1,329 @@
+"""
+	常驻的 overlay 构建进程
+	p4v 每次调用 CreateOverlayScriptsFolder.py 都要重新启动 python/exe、检查 workspace、打开缓存，
+	常驻进程在本机端口上监听，保持 changelist/文件/client View 缓存和 workspace 检查结果，
+	CreateOverlayScriptsFolder.py 作为客户端只转发参数并实时输出构建日志
+	启动: python CreateOverlayScriptsFolder.py --serve
+	停止: python CreateOverlayScriptsFolder.py --stop-daemon
+	没有常驻进程或版本不一致时，客户端在自己的进程中构建
+	协议: 每行一个 json，请求 {version, token, command, argv, cwd, env}，返回 {type: output, text, stream} ... {type: exit, code}
+	stream 为 stderr 时客户端写到自己的 stderr
+	构建在客户端的工作目录和 P4 环境变量(P4CLIENT/P4PORT/P4USER/P4CONFIG 等)下执行
+"""
+import os, sys, json, time, socket, secrets, threading, socketserver
+
+PROTOCOL_VERSION = 2
+STATE_FILE_NAME = 'OverlayDaemon.json'
+# 空闲超过这个时间(秒)自动退出，可用环境变量 OVERLAY_DAEMON_IDLE 覆盖
+DEFAULT_IDLE_TIMEOUT = 2 * 60 * 60
+# workspace 检查结果的有效时间(秒)
+WORKSPACE_CHECK_TTL = 10 * 60
+CONNECT_TIMEOUT = 1.0
+
+def get_p4_environ() -> dict:
+	""" 当前进程中影响 p4 命令的环境变量 """
+	return {name: value for name, value in os.environ.items() if name.upper().startswith('P4')}
+
+def get_tool_folder():
+	if getattr(sys, 'frozen', False):
+		application_path = sys.executable
+	else:
+		application_path = os.path.abspath(__file__)
+	return os.path.dirname(application_path)
+
+def get_state_path():
+	return os.path.join(get_tool_folder(), STATE_FILE_NAME)
+
+def get_code_version():
+	""" 工具文件(包括 common/)的修改时间，常驻进程使用的代码和客户端不一致时不转发 """
+	if getattr(sys, 'frozen', False):
+		paths = [sys.executable]
+	else:
+		tool_folder = get_tool_folder()
+		paths = []
+		for folder in (tool_folder, os.path.join(os.path.dirname(tool_folder), 'common')):
+			try:
+				paths += [os.path.join(folder, file_name) for file_name in os.listdir(folder) if file_name.endswith('.py')]
+			except OSError:
+				pass
+	return max((os.stat(path).st_mtime_ns for path in paths), default=0)
+
+def get_default_idle_timeout():
+	try:
+		return float(os.environ.get('OVERLAY_DAEMON_IDLE', DEFAULT_IDLE_TIMEOUT))
+	except ValueError:
+		return DEFAULT_IDLE_TIMEOUT
+
+def read_state() -> dict:
+	try:
+		with open(get_state_path(), 'r', encoding='utf-8') as f:
+			state = json.load(f)
+	except (OSError, ValueError):
+		return None
+	return state if isinstance(state, dict) else None
+
+def _send(connection_file, message : dict):
+	connection_file.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+	connection_file.flush()
+
+class OverlayRuntime:
+	""" 常驻进程中多次构建共用的状态 """
+	def __init__(self):
+		# 导入放在这里，客户端只导入本模块时不需要加载构建相关的模块
+		from CreateOverlayScriptsFolder import OverlayCaches
+		self.caches = OverlayCaches(True)
+		self._overlay_caches_type = OverlayCaches
+		self._workspace_checks = {}
+
+	def get_caches(self, use_cache = True):
+		if use_cache:
+			return self.caches
+		caches = self._overlay_caches_type(False)
+		caches.client_view_cache = self.caches.client_view_cache
+		return caches
+
+	def check_workspace(self, workspace_name, check_func) -> bool:
+		""" 检查通过的 workspace 在 WORKSPACE_CHECK_TTL 内不再查询，不同客户端的 P4PORT 分开记录 """
+		check_key = (os.environ.get('P4PORT'), workspace_name)
+		checked_time = self._workspace_checks.get(check_key)
+		if checked_time is not None and time.time() - checked_time < WORKSPACE_CHECK_TTL:
+			print(f"workspace {workspace_name} 已检查，跳过 p4 clients")
+			return True
+		if not check_func(workspace_name):
+			return False
+		self._workspace_checks[check_key] = time.time()
+		return True
+
+	def close(self):
+		self.caches.close()
+
+class _OutputRouter:
+	"""
+	构建期间的输出(stdout 和 stderr 各一个)同时写到常驻进程的控制台和客户端
+	下载线程等其他线程的输出也需要转发，构建是串行的，所以只有一个全局的转发目标
+	"""
+	def __init__(self, stream):
+		self.stream = stream
+		self.sink = None
+		self._lock = threading.Lock()
+
+	def write(self, text):
+		with self._lock:
+			try:
+				self.stream.write(text)
+			except (OSError, ValueError):
+				pass
+			if self.sink is not None:
+				try:
+					self.sink(text)
+				except OSError:
+					# 客户端断开时构建继续执行
+					self.sink = None
+		return len(text)
+
+	def flush(self):
+		try:
+			self.stream.flush()
+		except (OSError, ValueError):
+			pass
+
+	def __getattr__(self, name):
+		return getattr(self.stream, name)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		server = self.server
+		try:
+			request = json.loads(self.rfile.readline().decode('utf-8'))
+		except ValueError:
+			return
+		if request.get('token') != server.token:
+			_send(self.wfile, {'type': 'exit', 'code': 2, 'error': 'invalid token'})
+			return
+		if request.get('version') != PROTOCOL_VERSION or request.get('code_version') != server.code_version:
+			_send(self.wfile, {'type': 'exit', 'code': 2, 'error': 'version mismatch'})
+			return
+		command = request.get('command')
+		if command == 'stop':
+			_send(self.wfile, {'type': 'exit', 'code': 0})
+			threading.Thread(target=server.shutdown, daemon=True).start()
+			return
+		if command == 'ping':
+			_send(self.wfile, {'type': 'exit', 'code': 0})
+			return
+		if command == 'build':
+			self.handle_build(request.get('argv', []), request.get('cwd'), request.get('env', {}))
+
+	def handle_build(self, argv, cwd = None, env = None):
+		"""
+		cwd, env: 客户端的工作目录和 P4 环境变量，构建期间替换常驻进程自己的，构建结束后恢复
+		构建是串行的，所以可以直接修改进程的工作目录和环境变量(p4 子进程会继承)
+		"""
+		server = self.server
+		if not server.build_lock.acquire(blocking=False):
+			_send(self.wfile, {'type': 'output', 'text': '等待上一个任务完成...\n'})
+			server.build_lock.acquire()
+		try:
+			from CreateOverlayScriptsFolder import run_main
+			# stdout 和 stderr 的转发可能在不同线程中同时写入连接
+			send_lock = threading.Lock()
+			def make_sink(stream_name):
+				def sink(text):
+					with send_lock:
+						_send(self.wfile, {'type': 'output', 'text': text, 'stream': stream_name})
+				return sink
+			server.output.sink = make_sink('stdout')
+			server.error_output.sink = make_sink('stderr')
+			start_time = time.perf_counter()
+			saved_cwd = os.getcwd()
+			saved_env = get_p4_environ()
+			try:
+				for name in saved_env:
+					del os.environ[name]
+				os.environ.update(env or {})
+				if cwd:
+					os.chdir(cwd)
+				exit_code = run_main(argv, server.runtime)
+			except SystemExit as e:
+				# argparse 参数错误
+				exit_code = e.code if isinstance(e.code, int) else 1
+			except Exception as e:
+				print(f"overlay daemon: 构建出错 {e!r}")
+				exit_code = 1
+			finally:
+				os.chdir(saved_cwd)
+				for name in get_p4_environ():
+					del os.environ[name]
+				os.environ.update(saved_env)
+			print(f"overlay daemon: 构建耗时 {time.perf_counter() - start_time:.2f}s")
+			for router in (server.output, server.error_output):
+				router.flush()
+				router.sink = None
+			try:
+				_send(self.wfile, {'type': 'exit', 'code': exit_code})
+			except OSError:
+				pass
+		finally:
+			server.last_active = time.time()
+			server.build_lock.release()
+
+class OverlayDaemonServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = False
+
+	def __init__(self, port = 0):
+		super().__init__(('127.0.0.1', port), _RequestHandler)
+		self.token = secrets.token_hex(16)
+		self.code_version = get_code_version()
+		self.build_lock = threading.Lock()
+		self.last_active = time.time()
+		self.runtime = OverlayRuntime()
+		self.output = _OutputRouter(sys.stdout)
+		# argparse 的参数错误等写到 stderr，也要转发给客户端
+		self.error_output = _OutputRouter(sys.stderr)
+
+	def write_state(self):
+		state = {'port': self.server_address[1], 'token': self.token, 'pid': os.getpid(), 'version': PROTOCOL_VERSION, 'code_version': self.code_version}
+		temp_path = get_state_path() + '.tmp'
+		with open(temp_path, 'w', encoding='utf-8') as f:
+			json.dump(state, f)
+		os.replace(temp_path, get_state_path())
+
+	def remove_state(self):
+		state = read_state()
+		if state and state.get('token') == self.token:
+			try:
+				os.remove(get_state_path())
+			except OSError:
+				pass
+
+def serve(port = 0, idle_timeout = None) -> int:
+	""" 启动常驻进程，空闲超时或收到 stop 后退出 """
+	idle_timeout = get_default_idle_timeout() if idle_timeout is None else idle_timeout
+	server = OverlayDaemonServer(port)
+	server.write_state()
+	sys.stdout = server.output
+	sys.stderr = server.error_output
+	print(f"overlay daemon: 监听 127.0.0.1:{server.server_address[1]} pid {os.getpid()}")
+
+	def check_idle():
+		while True:
+			time.sleep(min(60, max(1, idle_timeout / 10)))
+			if not server.build_lock.locked() and time.time() - server.last_active > idle_timeout:
+				print("overlay daemon: 空闲超时，退出")
+				server.shutdown()
+				return
+	threading.Thread(target=check_idle, daemon=True).start()
+	try:
+		server.serve_forever(poll_interval=0.2)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.remove_state()
+		server.server_close()
+		server.runtime.close()
+		sys.stdout = server.output.stream
+		sys.stderr = server.error_output.stream
+	return 0
+
+def send_request(command, argv = None, output = None):
+	"""
+	发送请求给常驻进程，返回退出码，同时发送当前的工作目录和 P4 环境变量
+	常驻进程没有启动、无法连接或版本不一致时返回None，调用方在自己的进程中执行
+	"""
+	state = read_state()
+	if not state or state.get('version') != PROTOCOL_VERSION:
+		return None
+	if state.get('code_version') != get_code_version():
+		print("overlay daemon: 代码已更新，请重启常驻进程(--stop-daemon 后 --serve)，本次在当前进程中构建")
+		return None
+	output = output or sys.stdout
+	error_output = sys.stderr if output is sys.stdout else output
+	try:
+		connection = socket.create_connection(('127.0.0.1', state['port']), timeout=CONNECT_TIMEOUT)
+	except OSError:
+		return None
+	with connection:
+		# 构建时间不确定，连接成功后不再超时
+		connection.settimeout(None)
+		connection_file = connection.makefile('rwb')
+		try:
+			_send(connection_file, {'version': PROTOCOL_VERSION, 'code_version': state.get('code_version'), 'token': state['token'], 'command': command, 'argv': argv or [], 'cwd': os.getcwd(), 'env': get_p4_environ()})
+			for line in connection_file:
+				message = json.loads(line.decode('utf-8'))
+				if message.get('type') == 'output':
+					stream = error_output if message.get('stream') == 'stderr' else output
+					stream.write(message['text'])
+					stream.flush()
+				elif message.get('type') == 'exit':
+					if message.get('error'):
+						print(f"overlay daemon: {message['error']}")
+						return None
+					return message.get('code', 1)
+		except (OSError, ValueError) as e:
+			print(f"overlay daemon: 连接中断 {e}")
+			return 1
+	return 1
+
+def forward_build(argv) -> int:
+	""" 把命令行参数转发给常驻进程构建 """
+	return send_request('build', argv)
+
+def stop_daemon() -> bool:
+	return send_request('stop') is not None
+
+def run_client(argv) -> int:
+	"""
+	CreateOverlayScriptsFolder.py 作为脚本运行时在导入构建相关的模块之前调用，只用到本模块
+	处理 --serve/--stop-daemon，有常驻进程时转发参数，返回退出码
+	需要在当前进程中构建(--no-daemon、--help、没有常驻进程)时返回None
+	"""
+	if '--serve' in argv:
+		return serve()
+	if '--stop-daemon' in argv:
+		print("常驻进程已停止" if stop_daemon() else "常驻进程没有运行")
+		return 0
+	if '--no-daemon' in argv or '-h' in argv or '--help' in argv:
+		return None
+	# 有常驻进程时转发参数，构建日志实时输出；参数错误由常驻进程中的 argparse 报告
+	return forward_build(argv)
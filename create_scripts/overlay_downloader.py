@@ -0,0 +1,132 @@
+"""
+	并发下载 overlay 文件
+	用有上限的线程池并发执行批量 p4 print，失败的文件重新组批重试，每批单独超时，
+	任意文件最终失败都会汇总成错误列表抛出，而不是留下空文件
+"""
+import os, time, threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认并发数，按服务器能承受的同时连接数设置，可用环境变量 OVERLAY_P4_WORKERS 覆盖
+DEFAULT_WORKER_COUNT = 8
+# 单个文件失败后的重试次数
+DEFAULT_RETRY_COUNT = 2
+# 单次 p4 print 超时时间(秒)
+DEFAULT_TIMEOUT = 120
+# 重试前等待的时间(秒)，按重试次数递增
+RETRY_BACKOFF = 0.5
+# 批量模式下单次 p4 print 的文件数
+DEFAULT_BATCH_SIZE = 50
+
+DownloadTask = namedtuple('DownloadTask', ['depot_path', 'destination_path', 'changelist_num'])
+
+class DownloadError(Exception):
+	""" 有文件下载失败，failures 为 (task, error) 列表 """
+	def __init__(self, failures : list):
+		self.failures = failures
+		lines = [f'{len(failures)} 个文件下载失败:']
+		for task, error in failures:
+			lines.append(f'  {task.depot_path}@={task.changelist_num}: {error}')
+		super().__init__('\n'.join(lines))
+
+def get_default_worker_count():
+	try:
+		return max(1, int(os.environ.get('OVERLAY_P4_WORKERS', DEFAULT_WORKER_COUNT)))
+	except ValueError:
+		return DEFAULT_WORKER_COUNT
+
+def _download_batch(batch_fetch_func, batch : list, timeout) -> dict:
+	""" 下载一批文件，返回失败的 {task: error}，整批异常时全部算失败 """
+	try:
+		return batch_fetch_func(batch, timeout=timeout)
+	except Exception as e:
+		return {task: e for task in batch}
+
+class StreamingDownloader:
+	"""
+	流式批量下载：文件可以分多次 submit(例如每describe完一个changelist提交一次)，
+	提交后立即在线程池中下载，finish 时等待全部完成
+	每batch_size个文件合并成一次p4 print，失败的文件在同一个worker中重新组批重试
+	batch_fetch_func(tasks, timeout=...) 返回失败的 {task: error}
+	"""
+	def __init__(self, batch_fetch_func, worker_count = None, batch_size = DEFAULT_BATCH_SIZE, retry_count = DEFAULT_RETRY_COUNT, timeout = DEFAULT_TIMEOUT, progress_func = print):
+		self.batch_fetch_func = batch_fetch_func
+		self.worker_count = get_default_worker_count() if worker_count is None else worker_count
+		self.batch_size = batch_size
+		self.retry_count = retry_count
+		self.timeout = timeout
+		self.progress_func = progress_func
+		self.submitted_count = 0
+		self.done_count = 0
+		self._tasks = []
+		self._futures = []
+		self._running_count = 0
+		self._lock = threading.Lock()
+		self._executor = ThreadPoolExecutor(max_workers=max(1, self.worker_count))
+
+	def submit(self, tasks : list):
+		if not tasks:
+			return
+		self._tasks.extend(tasks)
+		self.submitted_count += len(tasks)
+		# 文件数不够时缩小批次，让空闲的worker都能用上；worker都在忙时不再拆小，减少p4进程数
+		with self._lock:
+			idle_count = max(1, self.worker_count - self._running_count)
+		batch_size = max(1, min(self.batch_size, -(-len(tasks) // idle_count)))
+		for start in range(0, len(tasks), batch_size):
+			with self._lock:
+				self._running_count += 1
+			self._futures.append(self._executor.submit(self._run_batch, tasks[start:start + batch_size]))
+
+	def _report(self, task, error):
+		with self._lock:
+			self.done_count += 1
+			if self.progress_func:
+				self.progress_func(self.done_count, self.submitted_count, task, error)
+
+	def _run_batch(self, batch : list) -> dict:
+		try:
+			return self._run_batch_with_retry(batch)
+		finally:
+			with self._lock:
+				self._running_count -= 1
+
+	def _run_batch_with_retry(self, batch : list) -> dict:
+		pending = batch
+		errors = {}
+		for attempt in range(self.retry_count + 1):
+			if attempt:
+				time.sleep(RETRY_BACKOFF * attempt)
+				print(f'重试下载({attempt}/{self.retry_count}): {len(pending)} 个文件')
+			errors = _download_batch(self.batch_fetch_func, pending, self.timeout)
+			is_last_attempt = attempt == self.retry_count
+			for task in pending:
+				error = errors.get(task)
+				if error is None or is_last_attempt:
+					self._report(task, error)
+			pending = [task for task in pending if task in errors]
+			if not pending:
+				return {}
+		return errors
+
+	def close(self):
+		""" 中途出错时取消还没开始的批次 """
+		self._executor.shutdown(wait=True, cancel_futures=True)
+
+	def finish(self):
+		""" 等待所有文件下载完成，有失败时抛出 DownloadError """
+		errors = {}
+		try:
+			for future in self._futures:
+				errors.update(future.result())
+		finally:
+			self._executor.shutdown(wait=True)
+		if errors:
+			# 按提交顺序输出，便于查看
+			raise DownloadError([(task, errors[task]) for task in self._tasks if task in errors])
+
+def print_download_progress(done_count, total_count, task : DownloadTask, error):
+	if error is None:
+		print(f'[{done_count}/{total_count}] 文件已成功保存到: {task.destination_path}')
+	else:
+		print(f'[{done_count}/{total_count}] 文件下载失败: {task.depot_path}@={task.changelist_num} {error}')
@@ -0,0 +1,113 @@
+"""
+	OverlayFolder 的文件清单
+	记录每个文件的来源(本地文件或depot@=changelist)和写入后的大小/修改时间，
+	下次构建时只重新写入有变化的文件，并删除不再需要的文件，不用每次清空整个文件夹
+"""
+import os, json
+
+MANIFEST_FILE_NAME = '.overlay_manifest.json'
+MANIFEST_VERSION = 1
+
+def make_local_source(local_path):
+	return f'local:{local_path}'
+
+def make_depot_source(depot_path, changelist_num):
+	return f'depot:{depot_path}@={changelist_num}'
+
+def _stat_key(path):
+	""" 返回 (size, mtime_ns)，文件不存在时返回None """
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return [stat.st_size, stat.st_mtime_ns]
+
+class OverlayManifest:
+	"""
+	entries: {相对root的路径: {source, immutable, target_stat, source_stat}}
+	immutable: 来源内容不会再变化(已提交的changelist)
+	source_stat: 本地文件来源的 (size, mtime_ns)，用于判断本地文件是否被修改
+	"""
+	def __init__(self, root, entries : dict = None):
+		self.root = root
+		self.entries = entries or {}
+
+	@classmethod
+	def load(cls, root):
+		""" 读取清单，不存在或格式不对时返回None(需要完整重建) """
+		manifest_path = os.path.join(root, MANIFEST_FILE_NAME)
+		try:
+			with open(manifest_path, 'r', encoding='utf-8') as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+			return None
+		return cls(root, data.get('entries', {}))
+
+	def save(self):
+		os.makedirs(self.root, exist_ok=True)
+		manifest_path = os.path.join(self.root, MANIFEST_FILE_NAME)
+		temp_path = manifest_path + '.tmp'
+		with open(temp_path, 'w', encoding='utf-8') as f:
+			json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, ensure_ascii=False, indent=1)
+		os.replace(temp_path, manifest_path)
+
+	def full_path(self, relative_path):
+		return os.path.join(self.root, relative_path)
+
+	def is_up_to_date(self, relative_path, source, immutable = True, source_path = None) -> bool:
+		"""
+		目标文件是否不需要重新写入
+		来源相同、来源内容没有变化、且目标文件在上次写入后没有被修改
+		"""
+		entry = self.entries.get(relative_path)
+		if entry is None or entry['source'] != source:
+			return False
+		if not immutable or not entry.get('immutable'):
+			return False
+		if source_path is not None and _stat_key(source_path) != entry.get('source_stat'):
+			return False
+		return _stat_key(self.full_path(relative_path)) == entry['target_stat']
+
+	def record(self, relative_path, source, immutable = True, source_path = None):
+		""" 目标文件写入完成后记录，只记录 stat，不读取文件内容 """
+		full_path = self.full_path(relative_path)
+		self.entries[relative_path] = {
+			'source': source,
+			'immutable': immutable,
+			'target_stat': _stat_key(full_path),
+			'source_stat': _stat_key(source_path) if source_path is not None else None,
+		}
+
+	def forget(self, relative_path):
+		self.entries.pop(relative_path, None)
+
+	def remove_stale(self, keep_paths : set) -> list:
+		""" 删除清单中有、本次不需要的文件，返回删除的相对路径 """
+		removed = []
+		for relative_path in list(self.entries):
+			if relative_path in keep_paths:
+				continue
+			full_path = self.full_path(relative_path)
+			try:
+				os.remove(full_path)
+			except FileNotFoundError:
+				pass
+			except OSError as e:
+				print(f"删除文件失败: {full_path} {e}")
+				continue
+			self.entries.pop(relative_path)
+			self._remove_empty_parents(os.path.dirname(full_path))
+			removed.append(relative_path)
+		return removed
+
+	def _remove_empty_parents(self, folder):
+		root = os.path.normpath(self.root)
+		folder = os.path.normpath(folder)
+		while folder != root and folder.startswith(root):
+			try:
+				os.rmdir(folder)
+			except OSError:
+				return
+			folder = os.path.dirname(folder)
@@ -0,0 +1,148 @@
+"""
+	p4 -G 输出解析
+	p4 -G 会把每条结果输出为一个 python marshal 后的 dict，
+	直接在管道上逐条 marshal.load，不需要把全部输出读进内存
+"""
+import os, sys, marshal, subprocess, tempfile, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.command_runner import get_startupinfo, command_slot
+from common import tracing
+
+class P4MarshalError(Exception):
+	""" p4 -G 命令执行失败(超时、进程异常退出且没有任何输出、输出被截断等) """
+
+def _decode_value(value):
+	if isinstance(value, bytes):
+		return value.decode('utf-8', errors='replace')
+	return value
+
+def decode_record(record : dict) -> dict:
+	"""
+	把 marshal 读出的 bytes key/value 转为 str
+	p4 print 的文件内容(data字段)保持 bytes 不变，error/info 的 data 是文本消息
+	"""
+	keep_raw_data = record.get(b'code') not in (b'error', b'info')
+	result = {}
+	for key, value in record.items():
+		key = _decode_value(key)
+		if key == 'data' and keep_raw_data:
+			result[key] = value
+		else:
+			result[key] = _decode_value(value)
+	return result
+
+def iter_marshal_records(stream):
+	"""
+	从二进制流中逐条读取 marshal 记录，直到流结束
+	stream 需要支持 peek，在记录边界上没有数据才是正常结束，
+	记录读到一半遇到结尾(输出被截断)或数据损坏时抛出 P4MarshalError
+	"""
+	while True:
+		if not stream.peek(1):
+			return
+		try:
+			record = marshal.load(stream)
+		except (EOFError, ValueError) as e:
+			raise P4MarshalError(f'p4 -G 输出不完整或格式错误: {e}') from e
+		yield decode_record(record)
+
+def make_marshal_command(command : list) -> list:
+	""" 在 p4 后插入 -G 全局参数 """
+	if not command or command[0] != 'p4' or '-G' in command:
+		return list(command)
+	return [command[0], '-G'] + list(command[1:])
+
+class _CountingReader:
+	""" 统计读取的字节数，只在开启 tracing 时使用 """
+	def __init__(self, stream):
+		self.stream = stream
+		self.byte_count = 0
+
+	def read(self, size = -1):
+		data = self.stream.read(size)
+		self.byte_count += len(data)
+		return data
+
+	def readinto(self, buffer):
+		count = self.stream.readinto(buffer)
+		self.byte_count += count or 0
+		return count
+
+	def peek(self, size = 0):
+		return self.stream.peek(size)
+
+def _write_stdin(process : subprocess.Popen, input_text : str):
+	try:
+		process.stdin.write(input_text.encode('utf-8'))
+	except OSError:
+		pass
+	finally:
+		try:
+			process.stdin.close()
+		except OSError:
+			pass
+
+def iter_p4_marshal(command : list, input_text : str = None, timeout = None):
+	"""
+	执行 p4 -G 命令，逐条产出记录dict
+	input_text: 写入stdin的内容，配合 p4 -x - 使用
+	timeout: 整个命令的超时时间(秒)，超时杀掉进程并抛出 P4MarshalError
+	"""
+	command = make_marshal_command(command)
+	# 与 command_runner 中的命令共用并发上限，名额在进程结束后释放
+	with command_slot(), tracing.command_span(command) as span:
+		with tempfile.TemporaryFile() as stderr_file:
+			process = subprocess.Popen(command,
+								 stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+								 stdout=subprocess.PIPE,
+								 stderr=stderr_file,
+								 startupinfo=get_startupinfo(),
+								)
+			timed_out = threading.Event()
+			def kill_on_timeout():
+				timed_out.set()
+				process.kill()
+			timer = threading.Timer(timeout, kill_on_timeout) if timeout else None
+			if timer:
+				timer.start()
+			writer = None
+			if input_text is not None:
+				# 单独线程写stdin，避免输出填满管道时互相等待
+				writer = threading.Thread(target=_write_stdin, args=(process, input_text), daemon=True)
+				writer.start()
+			record_count = 0
+			stdout = process.stdout if not tracing.is_enabled() else _CountingReader(process.stdout)
+			# 调用方提前停止迭代(关闭生成器)时为True，读到输出结尾时进程可能还没有退出，不能用 poll 判断
+			stopped_early = False
+			finished = False
+			try:
+				for record in iter_marshal_records(stdout):
+					record_count += 1
+					yield record
+				finished = True
+			except GeneratorExit:
+				stopped_early = True
+				raise
+			except P4MarshalError:
+				if timed_out.is_set():
+					# 超时被杀掉时输出在记录中间截断，报告超时
+					raise P4MarshalError(f'p4 命令超时({timeout}s): {command}') from None
+				raise
+			finally:
+				if timer:
+					timer.cancel()
+				# 提前停止或出错时不再读取剩余输出；正常读完时等待进程退出，得到真实的退出码
+				if not finished:
+					process.kill()
+				process.stdout.close()
+				return_code = process.wait()
+				if writer:
+					writer.join()
+				span.set(returncode=None if stopped_early else return_code, output_bytes=getattr(stdout, 'byte_count', 0), records=record_count)
+			if timed_out.is_set():
+				raise P4MarshalError(f'p4 命令超时({timeout}s): {command}')
+			if return_code != 0 and record_count == 0:
+				stderr_file.seek(0)
+				stderr = stderr_file.read().decode('utf-8', errors='replace').strip()
+				raise P4MarshalError(f'p4 命令失败 exit code {return_code}: {command} {stderr}')
@@ -0,0 +1,49 @@
+import os, sys
+import pytest
+
+TOOL_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与 CreateOverlayScriptsFolder.py 一样直接导入工具目录下的模块，构建用 benchmark 中的 fake p4
+sys.path.insert(0, TOOL_FOLDER)
+sys.path.insert(0, os.path.join(TOOL_FOLDER, 'benchmark'))
+from bench_overlay_build import FakeP4Env, WORKSPACE_NAME, DEPOT_ROOT, SCRIPTS_ROOT, copy_tool, run_once
+
+class OverlayBuildEnv:
+	""" 临时目录中的工具副本和 fake p4，每次 build 在子进程中完整执行一次构建 """
+	def __init__(self, fake_p4_env : FakeP4Env):
+		self.fake_p4_env = fake_p4_env
+		self.client_root = os.path.join(fake_p4_env.root, WORKSPACE_NAME)
+		self.tool_folder = copy_tool(os.path.join(fake_p4_env.root, 'tool'))
+		self.config = fake_p4_env.config = {
+			'workspace': WORKSPACE_NAME,
+			'client_root': self.client_root,
+			'depot_root': DEPOT_ROOT,
+			'file_size': 256,
+			'submitted': {},
+			'shelved': {},
+			'opened': {},
+		}
+
+	def build(self, changelists : list, *options) -> dict:
+		self.fake_p4_env.write_config()
+		return run_once(self.fake_p4_env, self.tool_folder, ['--no-daemon', *options, WORKSPACE_NAME, *changelists], False)
+
+	def local_path(self, depot_path) -> str:
+		return self.client_root + depot_path[len(DEPOT_ROOT):]
+
+	def overlay_path(self, depot_path) -> str:
+		return os.path.join(self.tool_folder, 'OverlayFolder', 'Windows/Marvel/Content/Marvel', depot_path[depot_path.index('Scripts/'):])
+
+	def write_local_file(self, depot_path, content : bytes):
+		local_path = self.local_path(depot_path)
+		os.makedirs(os.path.dirname(local_path), exist_ok=True)
+		with open(local_path, 'wb') as f:
+			f.write(content)
+
+@pytest.fixture
+def overlay_env():
+	with FakeP4Env({}) as fake_p4_env:
+		yield OverlayBuildEnv(fake_p4_env)
+
+def read_file(path) -> bytes:
+	with open(path, 'rb') as f:
+		return f.read()
@@ -0,0 +1,35 @@
+import os
+from conftest import SCRIPTS_ROOT, read_file
+
+DEPOT_PATH = f'{SCRIPTS_ROOT}/cached/cached_file.py'
+
+def find_blob(tool_folder, path) -> str:
+	for dir_path, _, file_names in os.walk(os.path.join(tool_folder, 'FileCache', 'blobs')):
+		for file_name in file_names:
+			blob_path = os.path.join(dir_path, file_name)
+			if os.path.samefile(blob_path, path):
+				return blob_path
+	return ''
+
+def test_local_override_after_cache_hardlink_build_keeps_cache(overlay_env):
+	overlay_env.config['submitted']['1001'] = [DEPOT_PATH]
+	overlay_path = overlay_env.overlay_path(DEPOT_PATH)
+	# 第一次构建从 p4 下载并加入缓存，删除输出后再构建才会命中缓存
+	assert overlay_env.build(['1001'])['exit_code'] == 0
+	depot_content = read_file(overlay_path)
+	os.remove(overlay_path)
+	assert overlay_env.build(['1001'], '--cache-hardlink')['exit_code'] == 0
+	blob_path = find_blob(overlay_env.tool_folder, overlay_path)
+	assert blob_path
+
+	# 本地 opened 的同一文件覆盖缓存的硬链接，不能写进缓存
+	overlay_env.config['opened']['1001'] = [DEPOT_PATH]
+	overlay_env.write_local_file(DEPOT_PATH, b'# local override\n')
+	assert overlay_env.build(['1001'])['exit_code'] == 0
+	assert read_file(overlay_path) == b'# local override\n'
+	assert read_file(blob_path) == depot_content
+
+	# 去掉本地文件后再构建，缓存中仍是 depot 的内容
+	overlay_env.config['opened'] = {}
+	assert overlay_env.build(['1001'])['exit_code'] == 0
+	assert read_file(overlay_path) == depot_content
@@ -0,0 +1,23 @@
+import io, zipfile, warnings
+from overlay_archive import OverlayArchive
+
+def test_duplicate_entries_do_not_change_process_warning_filters(tmp_path):
+	zip_path = str(tmp_path / 'Windows.zip')
+	filters = list(warnings.filters)
+	with warnings.catch_warnings(record=True) as caught:
+		warnings.simplefilter('always')
+		archive = OverlayArchive(zip_path)
+		archive.write_stream('Windows/Scripts/a.py', io.BytesIO(b'old'))
+		# 后面的changelist覆盖同一个文件
+		archive.write_stream('Windows/Scripts/a.py', io.BytesIO(b'new'))
+		archive.close()
+		assert not caught
+		# 其他代码写重复项时仍然有 zipfile 的警告
+		with zipfile.ZipFile(str(tmp_path / 'other.zip'), 'w') as other_zip:
+			other_zip.writestr('a.txt', b'1')
+			other_zip.writestr('a.txt', b'2')
+		assert [str(warning.message) for warning in caught] == ["Duplicate name: 'a.txt'"]
+	assert warnings.filters == filters
+	with zipfile.ZipFile(zip_path) as result_zip:
+		assert result_zip.read('Windows/Scripts/a.py') == b'new'
+		assert result_zip.namelist().count('Windows/Scripts/a.py') == 1
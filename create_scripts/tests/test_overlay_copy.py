@@ -0,0 +1,22 @@
+import os
+from conftest import SCRIPTS_ROOT, read_file
+
+LOCAL_DEPOT_PATH = f'{SCRIPTS_ROOT}/local/local_file.py'
+
+def test_copy_build_after_hardlink_build_keeps_workspace_file(overlay_env):
+	overlay_env.config['submitted']['1001'] = []
+	overlay_env.config['opened']['1001'] = [LOCAL_DEPOT_PATH]
+	overlay_env.write_local_file(LOCAL_DEPOT_PATH, b'# local v1\n')
+	local_path = overlay_env.local_path(LOCAL_DEPOT_PATH)
+	overlay_path = overlay_env.overlay_path(LOCAL_DEPOT_PATH)
+
+	assert overlay_env.build(['1001'], '--hardlink')['exit_code'] == 0
+	assert os.path.samefile(local_path, overlay_path)
+
+	# 修改工作区文件后普通构建，OverlayFolder 中的硬链接要先删除再复制，不能截断工作区文件
+	with open(local_path, 'wb') as f:
+		f.write(b'# local v2 edited\n')
+	assert overlay_env.build(['1001'])['exit_code'] == 0
+	assert read_file(local_path) == b'# local v2 edited\n'
+	assert read_file(overlay_path) == b'# local v2 edited\n'
+	assert not os.path.samefile(local_path, overlay_path)
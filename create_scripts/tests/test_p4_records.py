@@ -0,0 +1,88 @@
+import os
+import pytest
+from conftest import FakeP4Env, WORKSPACE_NAME, DEPOT_ROOT, SCRIPTS_ROOT, read_file
+import CreateOverlayScriptsFolder as overlay
+from client_view import ClientViewCache
+from overlay_archive import OverlayOutput
+from overlay_downloader import DownloadTask
+from p4_marshal import iter_p4_marshal, P4MarshalError
+
+# p4 -G 原始输出，格式与 record_p4_stream.py 录制的文件一致，fake p4 按参数原样回放
+RECORDINGS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'p4_recordings')
+PANEL_FOLDER = f'{SCRIPTS_ROOT}/subclassing/ui/panel'
+
+@pytest.fixture
+def fake_p4():
+	with FakeP4Env({}) as fake_p4_env:
+		yield fake_p4_env
+
+def replay(fake_p4_env, recordings : dict):
+	""" recordings: {p4参数: p4_recordings 中的文件名} """
+	fake_p4_env.config = {
+		'workspace': WORKSPACE_NAME,
+		'client_root': os.path.join(fake_p4_env.root, WORKSPACE_NAME),
+		'depot_root': DEPOT_ROOT,
+		'recordings': {key: os.path.join(RECORDINGS_FOLDER, name) for key, name in recordings.items()},
+	}
+	fake_p4_env.write_config()
+
+def test_describe_submitted_skips_deleted_and_non_py_files(fake_p4):
+	replay(fake_p4, {'-G describe -s -S 2706009': 'describe_2706009.marshal'})
+	files, status = overlay.describe_changelist_files('2706009')
+	assert status == 'submitted'
+	assert [action for _, action in files] == ['edit', 'add', 'delete', 'move/delete', 'move/add', 'purge', 'edit', 'integrate']
+	assert overlay.get_server_changelist_file_dict(['2706009']) == {
+		f'{PANEL_FOLDER}/PyWidget_Panel.py': '2706009',
+		f'{PANEL_FOLDER}/PyWidget_New.py': '2706009',
+		f'{PANEL_FOLDER}/sub dir/PyWidget_Moved.py': '2706009',
+		f'{PANEL_FOLDER}/PyWidget_%40Integ.py': '2706009',
+	}
+
+def test_describe_shelved(fake_p4):
+	replay(fake_p4, {'-G describe -s -S 2706010': 'describe_2706010_shelved.marshal'})
+	assert overlay.describe_changelist_files('2706010') == ([(f'{PANEL_FOLDER}/PyWidget_Panel.py', 'edit'), (f'{PANEL_FOLDER}/PyWidget_Removed.py', 'delete')], 'pending')
+
+def test_truncated_describe_is_an_error(fake_p4, capsys):
+	replay(fake_p4, {'-G describe -s -S 2706009': 'describe_2706009_truncated.marshal'})
+	with pytest.raises(P4MarshalError):
+		list(iter_p4_marshal(overlay.get_describe_command('2706009')))
+	# 截断的输出不能当成正常结束，iter_p4_records 打印错误后不返回任何文件
+	assert overlay.describe_changelist_files('2706009') == ([], '')
+	assert 'iter_p4_records error' in capsys.readouterr().out
+
+def test_opened_marshal_and_text_use_the_same_delete_actions(fake_p4, tmp_path):
+	replay(fake_p4, {f'-G -c {WORKSPACE_NAME} opened -c 2706011': 'opened_2706011.marshal'})
+	client_root = fake_p4.config['client_root']
+	records = list(overlay.iter_p4_records(['p4', '-c', WORKSPACE_NAME, 'opened', '-c', '2706011']))
+	wanted_paths = [f'{SCRIPTS_ROOT}/local/LocalEdit.py', f'{SCRIPTS_ROOT}/local/LocalAdd.py', f'{SCRIPTS_ROOT}/local/moved/LocalMoved.py']
+	for depot_path in wanted_paths:
+		local_path = client_root + depot_path[len(DEPOT_ROOT):]
+		os.makedirs(os.path.dirname(local_path), exist_ok=True)
+		open(local_path, 'wb').close()
+
+	files = overlay.get_single_changelist_local_changelist_files(WORKSPACE_NAME, '2706011', client_view_cache=ClientViewCache(str(tmp_path / 'ClientViewCache.json')))
+	assert sorted(files) == sorted((depot_path, client_root + depot_path[len(DEPOT_ROOT):]) for depot_path in wanted_paths)
+	# 同样的记录转成 p4 opened 文本输出后筛选结果一致
+	text_output = ''.join(f"{record['depotFile']}#{record['rev']} - {record['action']} change {record['change']} (text)\n" for record in records)
+	assert overlay.filter_depot_file_paths(text_output) == overlay.filter_opened_records(records) == wanted_paths
+
+def make_print_tasks(root) -> list:
+	return [DownloadTask(f'{PANEL_FOLDER}/{name}', os.path.join(root, name), '2706009') for name in ('PyWidget_Panel.py', 'PyWidget_New.py', 'PyWidget_%40Integ.py')]
+
+def test_print_writes_raw_content_and_reports_missing_files(fake_p4, tmp_path):
+	replay(fake_p4, {'-G -x - print': 'print_2706009.marshal'})
+	panel_task, new_task, integ_task = tasks = make_print_tasks(str(tmp_path))
+	errors = overlay.fetch_and_save_files_from_perforce(tasks, output=OverlayOutput(str(tmp_path)))
+	assert list(errors) == [integ_task]
+	# 多个 data 记录拼接，换行符和编码原样保留
+	assert read_file(panel_task.destination_path) == b''.join(b"print('panel line %d')\r\n" % index for index in range(300))
+	assert read_file(new_task.destination_path) == '# 新文件\nprint("new")\n'.encode('utf-8')
+	assert not os.path.exists(integ_task.destination_path)
+
+def test_truncated_print_discards_partial_file(fake_p4, tmp_path):
+	replay(fake_p4, {'-G -x - print': 'print_2706009_truncated.marshal'})
+	tasks = make_print_tasks(str(tmp_path))
+	errors = overlay.fetch_and_save_files_from_perforce(tasks, output=OverlayOutput(str(tmp_path)))
+	assert set(errors) == set(tasks)
+	assert all(isinstance(error, P4MarshalError) for error in errors.values())
+	assert not os.path.exists(tasks[0].destination_path)
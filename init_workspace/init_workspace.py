@@ -1,5 +1,7 @@
 import argparse, sys, re, json, os
-import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.command_runner import run_win_command
 
 def to_win_cmd_path(path):
 	"""将路径转换为Windows命令行格式"""
@@ -19,38 +21,6 @@ def open_win_folder(folder_path):
 	else:
 		print(f"打开文件夹失败，错误代码: {exit_code}")
 
-def get_func_name(stack_depth = 1):
-	"""
-	获得当前函数名
-	stack_depth: 堆栈深度
-	"""
-	try:
-		return sys._getframe(stack_depth).f_code.co_name
-	except Exception as e:
-		print('UIDebug: get_func_name: err msg: %s' % (str(e)))
-		return ''
-
-def run_win_command(command : list):
-	"""执行windows命令，返回输出"""
-	try:
-		# 不弹黑窗口
-		startupinfo = subprocess.STARTUPINFO()
-		startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-		result = subprocess.run(command, 
-						  	capture_output=True, 
-						  	text=True, 
-						  	check=True,
-							encoding='utf-8',
-							startupinfo=startupinfo,
-						  )
-		output = result.stdout
-		return output
-	except subprocess.CalledProcessError as e:
-		print(f"func:{get_func_name(2)} run_win_command CalledProcessError: {e}")
-	except Exception as e:
-		print(f"func:{get_func_name(2)} run_win_command error: {e}")
-	return []
-
 def create_p4_config(workspace_name : str, user_name : str, full_path : str):
 	try:
 		with open(f"{full_path}/.p4config", "w") as f:
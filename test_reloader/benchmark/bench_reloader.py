@@ -0,0 +1,308 @@
+"""
+    热更的 benchmark
+    apply:  替换 1/100/10000 个函数的耗时，分别测量直接 update_func、hotfix_batch 批量替换、update_func_by_name 按名字替换和回滚
+    call:   替换前后的调用耗时，普通函数、闭包、utils_reloaded.get_closure_value、class_reloaded 和实例的方法
+    memory: 反复执行同一个热更后的内存增长，以及旧的代码对象、旧的 __dict__(方法属性缓存)是否还存活
+    输出稳定的 json(key 排序，数值固定精度)，可以保存后对比
+    用法: python bench_reloader.py [--sizes 1 100 10000] [--cycles 200] [--output result.json]
+    比较: python bench_reloader.py --compare base.json new.json [--max-regression 0.2]
+"""
+import os, sys, gc, json, time, types, timeit, weakref, argparse, tempfile, tracemalloc
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+RELOADER_FOLDER = os.path.dirname(BENCHMARK_FOLDER)
+sys.path.insert(0, RELOADER_FOLDER)
+import reloader_utils
+import utils_reloaded
+from class_reloaded import class_reloaded
+from hotfix_bundle import build_bundle_data
+
+RESULT_VERSION = 1
+# 不参与对比的值: 调用开销的比例在两次结果之间波动大，以替换后的调用耗时为准
+NOT_GATED_METRICS = {'overhead', 'unpatched_ns', 'cycles'}
+# 对比时每种值允许的绝对变化，增加不超过这个值时不算退化(不在表中的为0，例如存活的旧对象数)
+# 内存增长在0附近波动，-11 -> +1 这样的变化按比例或按正负判断都会误报
+ABSOLUTE_TOLERANCES = {'bytes_per_cycle': 64, 'time_ms': 0.005, 'us_per_patch': 0.5, 'patched_ns': 2.0}
+
+def create_module(module_name : str, source : str) -> types.ModuleType:
+    """ 执行源码创建模块并加入 sys.modules，函数索引可以按模块名找到 """
+    module = types.ModuleType(module_name)
+    exec(compile(source, f'<{module_name}>', 'exec'), module.__dict__)
+    sys.modules[module_name] = module
+    return module
+
+def make_function_source(count : int, delta : int) -> str:
+    return ''.join(f'def func_{index}(a, b=1):\n    return a + b + {delta}\n' for index in range(count))
+
+def best_time(func, number : int, repeat : int) -> float:
+    """ 每次调用的最短耗时(秒) """
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start_time) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_apply(size : int, repeat : int) -> dict:
+    """ 替换 size 个函数，返回每种方式每次替换的耗时(毫秒)和每个函数的平均耗时(微秒) """
+    module_name = f'bench_targets_{size}'
+    module = create_module(module_name, make_function_source(size, 0))
+    patch_module = create_module(f'bench_patches_{size}', make_function_source(size, 1))
+    pairs = [(getattr(module, f'func_{index}'), getattr(patch_module, f'func_{index}')) for index in range(size)]
+    names = [(f'{module_name}:func_{index}', new_func) for index, (_, new_func) in enumerate(pairs)]
+    # 索引在测量前建立，与 HotfixLoader 在后台建立索引一致
+    reloader_utils.get_function_index().sync_modules()
+    number = max(1, 1000 // size)
+
+    def direct():
+        for old_func, new_func in pairs:
+            reloader_utils.update_func(old_func, new_func)
+
+    def batch():
+        with reloader_utils.hotfix_batch():
+            for old_func, new_func in pairs:
+                reloader_utils.update_func(old_func, new_func)
+
+    def by_name():
+        with reloader_utils.hotfix_batch():
+            for name, new_func in names:
+                reloader_utils.update_func_by_name(name, new_func)
+
+    def batch_rollback():
+        with reloader_utils.hotfix_batch() as hotfix_batch:
+            for old_func, new_func in pairs:
+                reloader_utils.update_func(old_func, new_func)
+        hotfix_batch.rollback()
+
+    result = {}
+    for mode, func in (('update_func', direct), ('batch', batch), ('by_name', by_name), ('batch_rollback', batch_rollback)):
+        elapsed = best_time(func, number, repeat)
+        result[mode] = {'time_ms': elapsed * 1e3, 'us_per_patch': elapsed / size * 1e6}
+    assert module.func_0(1) == 3
+    return result
+
+CALL_SOURCE = '''
+def plain(a, b=1):
+    return a + b
+
+def make_closure():
+    count = [0]
+    def closure(a):
+        count[0] += a
+        return count[0]
+    return closure
+
+class BenchClass:
+    def __init__(self):
+        self.value = 1
+
+    def method(self, a):
+        return self.value + a
+'''
+
+# 与原函数功能一致，只有代码对象不同
+CALL_PATCH_SOURCE = '''
+def plain(a, b=1):
+    return b + a
+
+def make_closure():
+    count = [0]
+    def closure(a):
+        count[0] = count[0] + a
+        return count[0]
+    return closure
+
+class BenchClass:
+    def method(self, a):
+        return a + self.value
+
+def get_closure_value():
+    name : str = closure_dict["name"]
+    return name + closure_fucn()
+
+def get_alpha_val():
+    return "a"
+'''
+
+def bench_call(number : int, repeat : int) -> dict:
+    """ 替换前后每次调用的耗时(纳秒) """
+    module = create_module('bench_call_targets', CALL_SOURCE)
+    patches = create_module('bench_call_patches', CALL_PATCH_SOURCE)
+    closure = module.make_closure()
+    instance = module.BenchClass()
+    cases = {
+        'plain': (lambda: module.plain(1), module.plain, patches.plain),
+        'closure': (lambda: closure(1), closure, patches.make_closure()),
+        'utils_reloaded.get_closure_value': (utils_reloaded.get_closure_value, utils_reloaded.get_closure_value, patches.get_closure_value),
+        'class_reloaded.get_alpha_val': (class_reloaded.get_alpha_val, class_reloaded.get_alpha_val, patches.get_alpha_val),
+        'method': (lambda: instance.method(1), module.BenchClass.method, patches.BenchClass.method),
+    }
+    result = {}
+    for kind, (call, old_func, new_func) in cases.items():
+        unpatched = min(timeit.repeat(call, number=number, repeat=repeat)) / number
+        with reloader_utils.hotfix_batch() as hotfix_batch:
+            reloader_utils.update_func(old_func, new_func)
+        patched = min(timeit.repeat(call, number=number, repeat=repeat)) / number
+        # 恢复原函数，不影响之后的测量
+        hotfix_batch.rollback()
+        result[kind] = {'unpatched_ns': unpatched * 1e9, 'patched_ns': patched * 1e9, 'overhead': patched / unpatched - 1}
+    return result
+
+MEMORY_TARGET_SOURCE = '''
+class CacheMarker:
+    """ 放在函数 __dict__ 中，弱引用判断旧的 __dict__ 是否已经释放 """
+    def __init__(self, cycle):
+        self.cycle = cycle
+        self.data = [cycle] * 100
+
+def target(a):
+    return a
+target.cache = CacheMarker(-1)
+'''
+
+# 每次的代码不同，与线上每次热更都是新的代码对象一致
+MEMORY_HOTFIX_SOURCE = '''import reloader_utils, bench_memory_target
+def target(a):
+    return a + {cycle}
+target.cache = bench_memory_target.CacheMarker({cycle})
+reloader_utils.update_func(bench_memory_target.target, target)
+'''
+
+def bench_memory(cycles : int, hotfix_dir : str) -> dict:
+    """
+    通过热更包执行 cycles 次热更，统计每次的内存增长和还存活的旧代码对象、旧 __dict__
+    前 10% 的热更作为预热，不计入内存增长
+    """
+    module = create_module('bench_memory_target', MEMORY_TARGET_SOURCE)
+    hotfix_path = os.path.join(hotfix_dir, 'hotfix_memory.py')
+    bundles = []
+    for cycle in range(cycles):
+        with open(hotfix_path, 'w', encoding='utf-8') as f:
+            f.write(MEMORY_HOTFIX_SOURCE.format(cycle=cycle))
+        bundles.append(build_bundle_data(hotfix_dir)[0])
+    old_codes = []
+    old_caches = []
+    warmup = max(1, cycles // 10)
+    # 只统计执行热更前后的差，弱引用等统计用的对象不计入
+    memory_growth = 0
+    tracemalloc.start()
+    for cycle, bundle_data in enumerate(bundles):
+        old_codes.append(weakref.ref(module.target.__code__))
+        old_caches.append(weakref.ref(module.target.cache))
+        gc.collect()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        reloader_utils.run_hotfix_bundle_data(bundle_data)
+        gc.collect()
+        if cycle >= warmup:
+            memory_growth += tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+    assert module.target(0) == cycles - 1
+    measured_cycles = cycles - warmup
+    result = {
+        'cycles': cycles,
+        'bytes_per_cycle': memory_growth / measured_cycles if measured_cycles else 0.0,
+        'old_code_alive': sum(1 for code_ref in old_codes if code_ref() is not None),
+        'old_dict_alive': sum(1 for cache_ref in old_caches if cache_ref() is not None),
+    }
+    return result
+
+def round_values(value):
+    if isinstance(value, float):
+        return round(value, 4)
+    if isinstance(value, dict):
+        return {key: round_values(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [round_values(item) for item in value]
+    return value
+
+def run_benchmark(args) -> dict:
+    apply_result = {str(size): bench_apply(size, args.repeat) for size in args.sizes}
+    call_result = bench_call(args.calls, args.repeat)
+    with tempfile.TemporaryDirectory() as hotfix_dir:
+        memory_result = bench_memory(args.cycles, hotfix_dir)
+    reloader_utils.clear_applied_hotfix()
+    return round_values({
+        'version': RESULT_VERSION,
+        'params': {
+            'sizes': args.sizes,
+            'repeat': args.repeat,
+            'calls': args.calls,
+            'cycles': args.cycles,
+        },
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'apply': apply_result,
+        'call': call_result,
+        'memory': memory_result,
+    })
+
+def flatten_metrics(value, prefix = '') -> dict:
+    """ {'apply': {'100': {'batch': {'time': 1}}}} -> {'apply.100.batch.time': 1} """
+    metrics = {}
+    for key, item in value.items():
+        if key in NOT_GATED_METRICS:
+            continue
+        name = f'{prefix}{key}'
+        if isinstance(item, dict):
+            metrics.update(flatten_metrics(item, f'{name}.'))
+        elif isinstance(item, (int, float)) and not isinstance(item, bool):
+            metrics[name] = item
+    return metrics
+
+def compare_results(base_path, new_path, max_regression) -> int:
+    """
+    对比两次结果的耗时、内存和存活对象数，有退化时返回1
+    增加的值同时超过 ABSOLUTE_TOLERANCES 和原来的值的 max_regression 比例(原来不大于0时只看绝对值)才算退化
+    """
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    if base.get('params') != new.get('params'):
+        print('两次结果的参数不同，无法对比')
+        return 2
+    base_metrics = flatten_metrics({key: base[key] for key in ('apply', 'call', 'memory') if key in base})
+    new_metrics = flatten_metrics({key: new[key] for key in ('apply', 'call', 'memory') if key in new})
+    exit_code = 0
+    for metric, base_value in sorted(base_metrics.items()):
+        new_value = new_metrics.get(metric)
+        if new_value is None:
+            continue
+        tolerance = ABSOLUTE_TOLERANCES.get(metric.rpartition('.')[2], 0)
+        if base_value > 0:
+            tolerance = max(tolerance, base_value * max_regression)
+            change_text = f'{(new_value - base_value) / base_value:+.1%}'
+        else:
+            change_text = f'{new_value - base_value:+}'
+        regressed = new_value - base_value > tolerance
+        exit_code = 1 if regressed else exit_code
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {metric:<50} {base_value} -> {new_value} ({change_text})")
+    return exit_code
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000], help='每次替换的函数个数')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测量的次数，取最短耗时')
+    parser.add_argument('--calls', type=int, default=200000, help='每次测量调用耗时的调用次数')
+    parser.add_argument('--cycles', type=int, default=200, help='测量内存时的热更次数')
+    parser.add_argument('--output', type=str, default='', help='结果 json 文件，默认输出到 stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='对比两次结果')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='对比时允许的退化比例')
+    return parser
+
+def main():
+    args = build_arg_parser().parse_args()
+    if args.compare:
+        return compare_results(args.compare[0], args.compare[1], args.max_regression)
+    result = run_benchmark(args)
+    text = json.dumps(result, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+    存活函数的索引: module:qualname -> 函数对象
+    热更脚本不需要手动 import 目标模块再按属性查找，嵌套函数(class_reloaded.nested_func.bar)和闭包也能找到
+    模块级函数和类中的方法遍历模块得到，新导入或被替换(重新导入)的模块在下次查询时加入索引；
+    嵌套函数的代码对象从外层函数的 co_consts 中得到(lambda、推导式等匿名代码不能作为热更目标，不索引)，
+    闭包实例在第一次查询某个嵌套函数时通过 gc.get_referrers(这个嵌套函数的代码对象) 收集，
+    只扫描本批次热更实际用到的嵌套函数，同一批次中再次查询是 dict 查找
+    索引只保存弱引用，不会让已经释放的闭包一直存活
+"""
+import gc, sys, types, weakref
+
+def normalize_qualname(qualname : str) -> str:
+    """ 去掉 .<locals>，class_reloaded.nested_func.<locals>.bar -> class_reloaded.nested_func.bar """
+    return qualname.replace('.<locals>', '')
+
+def make_key(module_name : str, qualname : str) -> str:
+    return f'{module_name}:{normalize_qualname(qualname)}'
+
+def get_code_qualname(code : types.CodeType) -> str:
+    # co_qualname 在 python 3.11 之后才有
+    return getattr(code, 'co_qualname', code.co_name)
+
+class FunctionIndex:
+    def __init__(self):
+        # {key: WeakSet(模块级函数和类中的方法)}
+        self._functions = {}
+        # {key: 代码对象}，只有嵌套函数
+        self._nested_codes = {}
+        # {嵌套函数的key: 外层函数的key}
+        self._parents = {}
+        # {qualname: set(key)}，只写 qualname 时查找所在的模块
+        self._qualname_keys = {}
+        # {key: WeakSet(闭包实例)}，查询时按 key 扫描，invalidate_closures 后全部重新扫描
+        self._closures = {}
+        # {key: {id(代码对象): 代码对象}}，闭包实例可能使用的代码: 外层函数中的和热更替换进去的
+        self._closure_codes = {}
+        # 上次索引时的 sys.modules，按模块对象比较，数量不变但模块被替换(重新导入)时也会重新索引
+        self._modules = {}
+
+    def sync_modules(self):
+        """ sys.modules 有变化时索引新导入或被替换的模块 """
+        # dict 比较在 C 中完成，值按对象比较
+        if self._modules == sys.modules:
+            return
+        modules = dict(sys.modules)
+        for module_name, module in modules.items():
+            if module is None or self._modules.get(module_name) is module:
+                continue
+            self.index_module(module)
+        self._modules = modules
+
+    def sync_module(self, module_name : str):
+        """ 只检查一个模块，查询时只需要检查目标所在的模块 """
+        module = sys.modules.get(module_name)
+        if module is None or self._modules.get(module_name) is module:
+            return
+        self._modules[module_name] = module
+        self.index_module(module)
+
+    def index_module(self, module : types.ModuleType):
+        """ 索引模块中定义的函数和类(从其他模块导入的不算) """
+        module_name = getattr(module, '__name__', None)
+        try:
+            values = list(vars(module).values())
+        except TypeError:
+            return
+        visited = set()
+        for value in values:
+            self._index_value(module_name, value, visited)
+
+    def _index_value(self, module_name, value, visited : set):
+        if isinstance(value, (staticmethod, classmethod)):
+            value = value.__func__
+        if isinstance(value, property):
+            for accessor in (value.fget, value.fset, value.fdel):
+                if accessor is not None:
+                    self._index_value(module_name, accessor, visited)
+            return
+        if isinstance(value, types.FunctionType):
+            if value.__module__ != module_name:
+                return
+            key = make_key(module_name, value.__qualname__)
+            functions = self._functions.get(key)
+            if functions is None:
+                functions = self._functions[key] = weakref.WeakSet()
+                self._add_qualname_key(key)
+            functions.add(value)
+            self._index_code(module_name, key, value.__code__)
+        elif isinstance(value, type):
+            if value.__module__ != module_name or id(value) in visited:
+                return
+            visited.add(id(value))
+            for attribute in list(vars(value).values()):
+                self._index_value(module_name, attribute, visited)
+
+    def _index_code(self, module_name, parent_key, code : types.CodeType):
+        for const in code.co_consts:
+            # <lambda>、<listcomp>、<genexpr> 等没有名字，热更脚本不会按名字替换
+            if isinstance(const, types.CodeType) and not const.co_name.startswith('<'):
+                key = make_key(module_name, get_code_qualname(const))
+                if key not in self._nested_codes:
+                    self._add_qualname_key(key)
+                self._nested_codes[key] = const
+                self._parents[key] = parent_key
+                self._closure_codes.setdefault(key, {})[id(const)] = const
+                self._index_code(module_name, key, const)
+
+    def _add_qualname_key(self, key):
+        self._qualname_keys.setdefault(key.partition(':')[2], set()).add(key)
+
+    def _is_known(self, key) -> bool:
+        return key in self._functions or key in self._nested_codes
+
+    def add_closure_code(self, name : str, code : types.CodeType):
+        """ 热更替换进嵌套函数(闭包实例和外层函数)的新代码，之后扫描闭包时也能找到使用新代码的实例 """
+        self._closure_codes.setdefault(self.normalize_name(name), {})[id(code)] = code
+
+    def scan_closures(self, key : str) -> weakref.WeakSet:
+        """
+        收集一个嵌套函数的实例，只处理 __code__ 是这个嵌套函数代码的函数
+        gc.get_referrers 的耗时与传入的代码对象个数成正比，只传入要查询的嵌套函数的代码
+        直接用 update_func 替换了代码的闭包实例不会被找到，嵌套函数需要用 update_func_by_name 替换
+        """
+        functions = weakref.WeakSet()
+        codes = self._closure_codes.get(key, {})
+        for obj in gc.get_referrers(*codes.values()) if codes else ():
+            # 外层函数代码的 co_consts 也引用了嵌套函数的代码
+            if type(obj) is types.FunctionType and codes.get(id(obj.__code__)) is obj.__code__:
+                functions.add(obj)
+        self._closures[key] = functions
+        return functions
+
+    def invalidate_closures(self):
+        """ 之后创建的闭包不在索引中，下次查询嵌套函数时重新扫描 """
+        self._closures.clear()
+
+    def normalize_name(self, name : str) -> str:
+        """
+        支持三种写法:
+            module:qualname     utils_reloaded:get_closure_value
+            module.qualname     utils_reloaded.get_closure_value，按已导入的模块名切分
+            qualname            class_reloaded.nested_func.bar，只有一个模块中有这个 qualname 时
+        """
+        if ':' in name:
+            module_name, _, qualname = name.partition(':')
+            return make_key(module_name, qualname)
+        parts = name.split('.')
+        for index in range(len(parts) - 1, 0, -1):
+            module_name = '.'.join(parts[:index])
+            if module_name in sys.modules:
+                key = make_key(module_name, '.'.join(parts[index:]))
+                if self._is_known(key):
+                    return key
+        keys = self._qualname_keys.get(normalize_qualname(name))
+        if keys and len(keys) == 1:
+            return next(iter(keys))
+        return name
+
+    def _sync_and_normalize(self, name : str) -> str:
+        """ 先检查 name 可能所在的模块，找不到时再检查所有模块 """
+        if ':' in name:
+            self.sync_module(name.partition(':')[0])
+        else:
+            parts = name.split('.')
+            for index in range(len(parts) - 1, 0, -1):
+                self.sync_module('.'.join(parts[:index]))
+        key = self.normalize_name(name)
+        if not self._is_known(key):
+            self.sync_modules()
+            key = self.normalize_name(name)
+        return key
+
+    def resolve(self, name : str) -> list:
+        """ 返回 name 对应的所有存活的函数对象，没有时返回空列表 """
+        key = self._sync_and_normalize(name)
+        functions = self._functions.get(key)
+        if functions:
+            return list(functions)
+        if key not in self._nested_codes:
+            return []
+        closures = self._closures.get(key)
+        if closures is None:
+            closures = self.scan_closures(key)
+        return list(closures)
+
+    def get_nested_code(self, name : str) -> types.CodeType:
+        """ 嵌套函数在外层函数中的代码对象，不是嵌套函数时返回None """
+        return self._nested_codes.get(self._sync_and_normalize(name))
+
+    def get_parent(self, name : str) -> str:
+        """ 嵌套函数的外层函数的key，不是嵌套函数时返回None """
+        return self._parents.get(self._sync_and_normalize(name))
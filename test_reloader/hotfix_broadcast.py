@@ -0,0 +1,265 @@
+"""
+    多进程热更: 协调进程把编译好的热更包(见 hotfix_bundle.py)通过管道发给所有工作进程，
+    工作进程在主循环的安全点(两次循环之间)执行并回复确认，协调进程统计每个进程和 p99 的执行延迟
+    工作进程中:
+        hotfix_receiver = HotfixReceiver(conn)
+        while not hotfix_receiver.stopped:
+            ...
+            hotfix_receiver.tick()
+    协调进程中:
+        coordinator = HotfixCoordinator()
+        coordinator.spawn_workers(8)            # 或 attach_worker(conn) 接入已有的工作进程
+        coordinator.broadcast_dir('hotfix_file').print_report()
+        coordinator.stop()
+    本地测试: python hotfix_broadcast.py hotfix_file --workers 8
+"""
+import os, sys, time, math, argparse, traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hotfix_bundle import build_bundle_data
+import reloader_utils
+
+# 工作进程的确认
+# wait_time: 协调进程开始发送到工作进程收到(等待安全点)，apply_time: 执行热更，latency: 协调进程开始发送到收到确认
+# time.monotonic 在 Linux 上是系统范围的时钟，不同进程之间可以比较
+WorkerAck = namedtuple('WorkerAck', ['worker_id', 'pid', 'applied', 'wait_time', 'apply_time', 'latency', 'error'])
+
+def percentile(values : list, percent : float) -> float:
+    """ 最近秩百分位数，values 为空时返回0 """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+class HotfixReceiver:
+    """ 工作进程中接收热更，tick 只在主循环的安全点调用 """
+    def __init__(self, conn):
+        self.conn = conn
+        self.stopped = False
+        # 通知协调进程已经可以接收热更
+        self.conn.send(('ready', os.getpid()))
+
+    def tick(self) -> list:
+        """ 执行收到的所有热更，返回执行的文件名；收到 stop 后 stopped 为True """
+        applied = []
+        while not self.stopped and self.conn.poll():
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                # 协调进程已经退出
+                self.stopped = True
+                break
+            if message[0] == 'stop':
+                self.stopped = True
+            elif message[0] == 'hotfix':
+                applied += self._apply(message[1], message[2], message[3])
+        return applied
+
+    def _apply(self, batch_id, send_time : float, bundle_data : bytes) -> list:
+        receive_time = time.monotonic()
+        applied = []
+        error = ''
+        try:
+            applied = reloader_utils.run_hotfix_bundle_data(bundle_data)
+        except Exception:
+            # 整批不生效，错误信息随确认发回协调进程
+            error = traceback.format_exc()
+        done_time = time.monotonic()
+        self.conn.send(('ack', batch_id, os.getpid(), applied, receive_time - send_time, done_time - receive_time, error))
+        return applied
+
+def worker_main_loop(conn, interval = 0.01):
+    """ 本地测试用的工作进程，与 main.py 的主循环一致 """
+    import utils_reloaded
+    # 函数索引在启动时建立，执行热更时只需要索引新导入的模块
+    reloader_utils.get_function_index().sync_modules()
+    hotfix_receiver = HotfixReceiver(conn)
+    while not hotfix_receiver.stopped:
+        utils_reloaded.get_closure_value()
+        time.sleep(interval)
+        hotfix_receiver.tick()
+    conn.close()
+
+class BroadcastReport:
+    """ 一次广播的结果，missing 为超时或已经退出没有确认的工作进程 """
+    def __init__(self, batch_id, acks : list, missing : list, bundle_size : int):
+        self.batch_id = batch_id
+        self.acks = acks
+        self.missing = missing
+        self.bundle_size = bundle_size
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing and not any(ack.error for ack in self.acks)
+
+    def summary(self) -> dict:
+        latencies = [ack.latency for ack in self.acks]
+        apply_times = [ack.apply_time for ack in self.acks]
+        return {
+            'batch_id': self.batch_id,
+            'bundle_size': self.bundle_size,
+            'workers': len(self.acks) + len(self.missing),
+            'acked': len(self.acks),
+            'failed': sum(1 for ack in self.acks if ack.error),
+            'missing': list(self.missing),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': max(latencies, default=0.0),
+            'apply_p99': percentile(apply_times, 99),
+        }
+
+    def print_report(self):
+        for ack in sorted(self.acks, key=lambda ack: ack.worker_id):
+            status = 'error' if ack.error else f'{len(ack.applied)} files'
+            print(f'worker {ack.worker_id:>3} pid {ack.pid:>7}: latency {ack.latency * 1000:8.2f}ms '
+                  f'(wait {ack.wait_time * 1000:.2f}ms, apply {ack.apply_time * 1000:.2f}ms) {status}')
+            if ack.error:
+                print(ack.error)
+        for worker_id in self.missing:
+            print(f'worker {worker_id:>3}: no ack')
+        summary = self.summary()
+        print(f"batch {self.batch_id}: {summary['acked']}/{summary['workers']} acked, {summary['failed']} failed, "
+              f"latency p50 {summary['latency_p50'] * 1000:.2f}ms p99 {summary['latency_p99'] * 1000:.2f}ms "
+              f"max {summary['latency_max'] * 1000:.2f}ms, apply p99 {summary['apply_p99'] * 1000:.2f}ms")
+
+class HotfixCoordinator:
+    """
+    管理工作进程的管道连接，向所有工作进程广播热更包并等待确认
+    工作进程可以由 spawn_workers 创建，也可以用 attach_worker 接入已有的连接(另一端交给 HotfixReceiver)
+    """
+    def __init__(self):
+        # {工作进程编号: [连接, 进程(接入的为None)]}
+        self._workers = {}
+        self._next_worker_id = 0
+        self._next_batch_id = 0
+
+    def __len__(self):
+        return len(self._workers)
+
+    def attach_worker(self, conn, process = None) -> int:
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        self._workers[worker_id] = [conn, process]
+        return worker_id
+
+    def spawn_workers(self, count : int, target = worker_main_loop, args = (), timeout = 30.0) -> list:
+        """
+        创建 count 个工作进程，target(conn, *args) 中需要使用 HotfixReceiver，返回工作进程编号
+        等待所有工作进程创建 HotfixReceiver 之后返回，广播的延迟不包含进程启动时间
+        """
+        worker_ids = []
+        for _ in range(count):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=target, args=(child_conn, *args), daemon=True)
+            process.start()
+            # 子进程持有另一端，父进程关闭后子进程退出时 recv 能收到 EOFError
+            child_conn.close()
+            worker_ids.append(self.attach_worker(parent_conn, process))
+        pending = [self._workers[worker_id][0] for worker_id in worker_ids]
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            for conn in wait(pending, deadline - time.monotonic()):
+                pending.remove(conn)
+                try:
+                    conn.recv()
+                except EOFError:
+                    # 启动失败的工作进程在广播时记为没有确认
+                    pass
+        return worker_ids
+
+    def _send_all(self, message) -> list:
+        """ 并发发送，热更包超过管道缓冲区时不会因为某个工作进程还没到安全点而推迟其他进程，返回发送失败的工作进程编号 """
+        def send(worker_id):
+            try:
+                self._workers[worker_id][0].send(message)
+                return None
+            except (OSError, ValueError):
+                return worker_id
+        worker_ids = list(self._workers)
+        with ThreadPoolExecutor(max_workers=max(1, len(worker_ids))) as executor:
+            return [worker_id for worker_id in executor.map(send, worker_ids) if worker_id is not None]
+
+    def broadcast(self, bundle_data : bytes, timeout = 10.0) -> BroadcastReport:
+        """ 向所有工作进程发送热更包，等待确认直到全部收到或超时 """
+        batch_id = self._next_batch_id
+        self._next_batch_id += 1
+        send_time = time.monotonic()
+        missing = set(self._send_all(('hotfix', batch_id, send_time, bundle_data)))
+        pending = {self._workers[worker_id][0]: worker_id for worker_id in self._workers if worker_id not in missing}
+        acks = []
+        deadline = send_time + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in wait(list(pending), remaining):
+                worker_id = pending[conn]
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    # 工作进程已经退出
+                    del pending[conn]
+                    missing.add(worker_id)
+                    continue
+                ack_time = time.monotonic()
+                # 忽略 ready 和上一次超时的批次迟到的确认
+                if message[0] != 'ack' or message[1] != batch_id:
+                    continue
+                _, _, pid, applied, wait_time, apply_time, error = message
+                del pending[conn]
+                acks.append(WorkerAck(worker_id, pid, applied, wait_time, apply_time, ack_time - send_time, error))
+        missing.update(pending.values())
+        return BroadcastReport(batch_id, acks, sorted(missing), len(bundle_data))
+
+    def broadcast_dir(self, dir : str, timeout = 10.0) -> BroadcastReport:
+        """ 在协调进程中编译一次，工作进程不需要编译 """
+        bundle_data, _ = build_bundle_data(dir)
+        return self.broadcast(bundle_data, timeout)
+
+    def broadcast_file(self, bundle_path : str, timeout = 10.0) -> BroadcastReport:
+        with open(bundle_path, 'rb') as f:
+            return self.broadcast(f.read(), timeout)
+
+    def stop(self, timeout = 5.0):
+        """ 通知所有工作进程退出，等待 spawn_workers 创建的进程结束 """
+        self._send_all(('stop',))
+        deadline = time.monotonic() + timeout
+        for conn, process in self._workers.values():
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            conn.close()
+        self._workers.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='本地多进程热更测试')
+    parser.add_argument('dir', nargs='?', default='hotfix_file', help='热更目录')
+    parser.add_argument('--bundle', help='广播已经生成的热更包，不编译热更目录')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=1, help='广播次数，之后的广播中已经执行过的热更不会重复执行，只测量往返延迟')
+    parser.add_argument('--interval', type=float, default=0.01, help='工作进程每次循环的间隔(秒)')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+    if args.bundle:
+        with open(args.bundle, 'rb') as f:
+            bundle_data = f.read()
+    else:
+        bundle_data, _ = build_bundle_data(args.dir)
+    coordinator = HotfixCoordinator()
+    coordinator.spawn_workers(args.workers, args=(args.interval,))
+    ok = True
+    try:
+        for _ in range(args.rounds):
+            report = coordinator.broadcast(bundle_data, args.timeout)
+            report.print_report()
+            ok = ok and report.ok
+    finally:
+        coordinator.stop()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+    热更包: 一个文件保存多个编译好的热更，所有进程直接读取，不需要每个进程各自编译
+    格式:
+        头部     magic(4) + 格式版本(2) + 保留(2) + python MAGIC_NUMBER(4) + manifest长度(4) + manifest的sha256(32)
+        manifest json: {"entries": [{"name", "offset", "size", "hash"}]}，按文件名排序，offset 相对于数据区开头，hash 为代码数据的sha256
+        数据区   依次保存 marshal 后的代码对象
+    manifest 中包含每一项的 hash，头部的 manifest hash 就是整个包的内容 hash；读取时只校验需要执行的项
+    用法:
+        python hotfix_bundle.py build hotfix_file -o hotfix_file.bundle
+        python hotfix_bundle.py list hotfix_file.bundle
+    执行见 reloader_utils.run_hotfix_bundle
+"""
+import os, sys, json, struct, hashlib, argparse, marshal
+from collections import namedtuple
+from importlib.util import MAGIC_NUMBER
+
+BUNDLE_MAGIC = b'HFBN'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sHH4sI32s')
+
+BundleEntry = namedtuple('BundleEntry', ['name', 'offset', 'size', 'hash'])
+
+class HotfixBundleError(Exception):
+    """ 热更包格式不对、python 版本不一致或内容校验失败 """
+    pass
+
+def build_bundle_data(dir : str, optimize = -1) -> tuple:
+    """
+    编译目录下所有的.py(__init__ 除外)，返回 (热更包内容, 写入的文件名)
+    编译出错时直接抛出，不生成缺少热更的包
+    """
+    with os.scandir(dir) as entries:
+        source_paths = sorted(entry.path for entry in entries if entry.name.endswith('.py') and entry.is_file() and entry.name != '__init__.py')
+    manifest_entries = []
+    datas = []
+    offset = 0
+    for source_path in source_paths:
+        with open(source_path, 'rb') as f:
+            source = f.read()
+        code_data = marshal.dumps(compile(source, source_path, 'exec', dont_inherit=True, optimize=optimize))
+        name = os.path.basename(source_path)[:-len('.py')]
+        manifest_entries.append({'name': name, 'offset': offset, 'size': len(code_data), 'hash': hashlib.sha256(code_data).hexdigest()})
+        datas.append(code_data)
+        offset += len(code_data)
+    manifest = json.dumps({'entries': manifest_entries}, separators=(',', ':')).encode('utf-8')
+    header = BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, 0, MAGIC_NUMBER, len(manifest), hashlib.sha256(manifest).digest())
+    return b''.join([header, manifest, *datas]), [entry['name'] for entry in manifest_entries]
+
+def build_bundle(dir : str, bundle_path : str, optimize = -1) -> list:
+    """
+    编译目录下的热更写入热更包，返回写入的文件名
+    先写临时文件再替换，正在读取旧包的进程不受影响
+    """
+    bundle_data, names = build_bundle_data(dir, optimize)
+    temp_path = f'{bundle_path}.tmp{os.getpid()}'
+    with open(temp_path, 'wb') as f:
+        f.write(bundle_data)
+    os.replace(temp_path, bundle_path)
+    return names
+
+def read_bundle_manifest(buffer) -> tuple:
+    """
+    buffer: 热更包内容(bytes 或 mmap)，只读取头部和 manifest
+    返回 (包的内容hash, 数据区偏移, [BundleEntry])
+    """
+    if len(buffer) < BUNDLE_HEADER.size:
+        raise HotfixBundleError('hotfix bundle too small')
+    magic, version, _, python_magic, manifest_size, manifest_hash = BUNDLE_HEADER.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+        raise HotfixBundleError(f'not a hotfix bundle (magic {magic!r}, version {version})')
+    if python_magic != MAGIC_NUMBER:
+        raise HotfixBundleError(f'hotfix bundle built for python magic {python_magic!r}, current {MAGIC_NUMBER!r}')
+    data_offset = BUNDLE_HEADER.size + manifest_size
+    manifest = buffer[BUNDLE_HEADER.size:data_offset]
+    if len(manifest) != manifest_size or hashlib.sha256(manifest).digest() != manifest_hash:
+        raise HotfixBundleError('hotfix bundle manifest hash mismatch')
+    entries = [BundleEntry(entry['name'], entry['offset'], entry['size'], entry['hash']) for entry in json.loads(manifest)['entries']]
+    return manifest_hash.hex(), data_offset, entries
+
+def read_bundle_entry(buffer, data_offset : int, entry : BundleEntry) -> bytes:
+    """ 读取一项 marshal 后的代码数据并校验 hash """
+    start = data_offset + entry.offset
+    code_data = buffer[start:start + entry.size]
+    if len(code_data) != entry.size or hashlib.sha256(code_data).hexdigest() != entry.hash:
+        raise HotfixBundleError(f'hotfix bundle entry {entry.name} hash mismatch')
+    return code_data
+
+def main():
+    parser = argparse.ArgumentParser(description='热更包')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='编译目录下的热更生成热更包')
+    build_parser.add_argument('dir', help='热更目录')
+    build_parser.add_argument('-o', '--output', help='热更包路径，默认为 <目录>.bundle')
+    build_parser.add_argument('-O', '--optimize', type=int, default=-1, help='与 compile 的 optimize 参数一致')
+    list_parser = subparsers.add_parser('list', help='列出热更包中的文件')
+    list_parser.add_argument('bundle', help='热更包路径')
+    args = parser.parse_args()
+    if args.command == 'build':
+        bundle_path = args.output or f'{os.path.normpath(args.dir)}.bundle'
+        names = build_bundle(args.dir, bundle_path, args.optimize)
+        print(f'build {bundle_path}: {len(names)} hotfix files')
+        return
+    with open(args.bundle, 'rb') as f:
+        try:
+            content_hash, _, entries = read_bundle_manifest(f.read())
+        except HotfixBundleError as e:
+            print(e)
+            sys.exit(1)
+    print(f'{args.bundle}: {len(entries)} hotfix files, hash {content_hash}')
+    for entry in entries:
+        print(f'    {entry.name:<40} {entry.size:>8} {entry.hash[:16]}')
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,8 @@ def reload_func():
         return name + closure_fucn()
     print('hotfix new_get_alpha_val start')
     import reloader_utils
-    import utils_reloaded
-    reloader_utils.update_func(utils_reloaded.get_closure_value, new_get_closure_value)
+    # 按名字查找目标函数，不需要 import 目标模块
+    reloader_utils.update_func_by_name('utils_reloaded.get_closure_value', new_get_closure_value)
     print('hotfix new_get_alpha_val end')
 
 reload_func()
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+    热更目录监控，嵌入主循环，每次循环调用一次 tick()
+    Linux 上使用 inotify(非阻塞读取，没有变化时只有一次系统调用)，其他平台按 interval 轮询 os.scandir 的 stat 结果
+    发现新增或修改的.py后用 HotfixLoader 在后台编译，准备好之后在主线程执行，只执行有变化的文件
+    用法:
+        hotfix_watcher = HotfixWatcher('hotfix_file')
+        while True:
+            ...
+            hotfix_watcher.tick()
+"""
+import os, sys, time, errno, struct
+from reloader_utils import HotfixLoader
+
+# 轮询间隔(秒)
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify 事件，只关心写完、移入(编辑器保存时先写临时文件再改名)和属性变化(touch)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+
+class InotifyWatch:
+    """ 通过 ctypes 调用 libc 的 inotify，不可用时 create 返回None """
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def create(cls, dir : str):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(dir), IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+        return cls(fd)
+
+    def has_py_changes(self) -> bool:
+        """ 读出所有事件，有.py文件的事件时返回True(编译写入的.pyc不算) """
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return changed
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                name = data[offset:offset + name_length].rstrip(b'\0')
+                offset += name_length
+                if name.endswith(b'.py'):
+                    changed = True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class HotfixWatcher:
+    """
+    dir: 热更目录
+    interval: 轮询间隔(秒)，使用 inotify 时每次 tick 都检查
+    use_inotify: 为False时总是轮询
+    loader: 默认新建 HotfixLoader(dir)
+    第一次 tick 时目录中已有的热更也会执行(执行过的见 reloader_utils.applied_hotfix_dict)
+    """
+    def __init__(self, dir : str = '.', interval = DEFAULT_POLL_INTERVAL, use_inotify = True, loader : HotfixLoader = None):
+        self.dir = dir
+        self.interval = interval
+        self.loader = loader or HotfixLoader(dir)
+        self._inotify = InotifyWatch.create(dir) if use_inotify else None
+        # {文件名: (mtime_ns, size)}，轮询时与上一次比较
+        self._snapshot = {}
+        self._next_check = 0.0
+        # 第一次 tick 时执行目录中已有的热更
+        self._pending = True
+        # 没有变化时的 tick 耗时统计
+        self.idle_tick_count = 0
+        self.idle_tick_time = 0.0
+        self.max_idle_tick_time = 0.0
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify is not None else 'poll'
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        with os.scandir(self.dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.py') and entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _has_changes(self) -> bool:
+        if self._inotify is not None:
+            return self._inotify.has_py_changes()
+        now = time.perf_counter()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        snapshot = self._scan()
+        # 只有新增和修改需要执行，删除的文件只更新快照
+        changed = any(self._snapshot.get(name) != version for name, version in snapshot.items())
+        self._snapshot = snapshot
+        return changed
+
+    def tick(self) -> list:
+        """ 主循环中每次调用，返回本次执行的热更文件，没有时返回空列表 """
+        start_time = time.perf_counter()
+        if self.loader.is_ready():
+            return self.loader.apply()
+        if self._has_changes():
+            self._pending = True
+        if self._pending:
+            # 上一次编译还没有完成时下次 tick 再开始，完成后只会编译有变化的文件
+            if self.loader.start():
+                self._pending = False
+            return []
+        tick_time = time.perf_counter() - start_time
+        self.idle_tick_count += 1
+        self.idle_tick_time += tick_time
+        if tick_time > self.max_idle_tick_time:
+            self.max_idle_tick_time = tick_time
+        return []
+
+    def print_stats(self):
+        average = self.idle_tick_time / self.idle_tick_count if self.idle_tick_count else 0.0
+        print(f'hotfix watcher({self.mode}): {self.idle_tick_count} idle ticks, '
+              f'average {average * 1e6:.2f}us, max {self.max_idle_tick_time * 1e6:.2f}us')
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
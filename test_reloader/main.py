@@ -1,17 +1,24 @@
 import time
 from class_reloaded import class_reloaded
 import utils_reloaded
+from hotfix_watcher import HotfixWatcher
 def main_loop():
     print("start main loop")
-    index = 0
-    while True:
-        value = utils_reloaded.get_closure_value()
-        print(value)
-        time.sleep(1)
-        index += 1
-        if index == 2:
-            print('try to hotfix')
-            from reloader_utils import run_all_hotfix_in_dir
-            run_all_hotfix_in_dir('hotfix_file')
-            print("hotfix end")
-main_loop()
\ No newline at end of file
+    # 热更目录有新增或修改的文件时在后台编译，主循环只在准备好之后执行，停顿时间见 apply 的输出
+    hotfix_watcher = HotfixWatcher('hotfix_file')
+    try:
+        while True:
+            value = utils_reloaded.get_closure_value()
+            print(value)
+            time.sleep(1)
+            if hotfix_watcher.tick():
+                print("hotfix end")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 退出时打印没有热更时 tick 的耗时
+        hotfix_watcher.print_stats()
+        hotfix_watcher.close()
+
+if __name__ == '__main__':
+    main_loop()
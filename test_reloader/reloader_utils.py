@@ -1,42 +1,485 @@
-import py_compile, marshal, os, typing
+import py_compile, marshal, mmap, os, struct, time, types, threading, traceback, contextlib, typing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib.util import MAGIC_NUMBER, source_hash
+from function_index import FunctionIndex, get_code_qualname
+from hotfix_bundle import read_bundle_manifest, read_bundle_entry
 
 if typing.TYPE_CHECKING:
     from io import BufferedReader
 
+# pyc 头部: magic(4) + flags(4) + (源文件mtime(4) + 源文件大小(4)) 或 源文件hash(8)
+PYC_HEADER_SIZE = 16
+PYC_FLAG_HASH_BASED = 0b1
+
 def try_to_run_hotfix_file(file : 'BufferedReader'):
     """
     尝试执行目标 pyc
     """
-    # 跳过前16个字节的头部信息
-    file.seek(16)
-    bytecode = file.read()
-    # 使用 marshal 序列化再反序列化得到可执行的代码对象
-    serialized_bytecode = marshal.dumps(bytecode)
-    deserialized_bytecode = marshal.loads(serialized_bytecode)
-    code_obj = marshal.loads(deserialized_bytecode)
+    # 跳过前16个字节的头部信息，剩下的就是 marshal 后的代码对象
+    file.seek(PYC_HEADER_SIZE)
+    code_obj = marshal.loads(file.read())
     eval(code_obj)
 
+def is_pyc_up_to_date(local_path : str, pyc_path : str) -> bool:
+    """
+    pyc 头部记录的源文件 hash 与当前源文件一致时不需要重新编译
+    时间戳模式的 pyc 只记录到秒的 mtime 和大小，同一秒内大小不变的修改检查不出来，总是重新编译
+    """
+    try:
+        with open(pyc_path, 'rb') as f:
+            header = f.read(PYC_HEADER_SIZE)
+    except OSError:
+        return False
+    if len(header) != PYC_HEADER_SIZE or header[:4] != MAGIC_NUMBER:
+        return False
+    flags = struct.unpack('<I', header[4:8])[0]
+    if not flags & PYC_FLAG_HASH_BASED:
+        return False
+    try:
+        with open(local_path, 'rb') as f:
+            return header[8:16] == source_hash(f.read())
+    except OSError:
+        return False
+
 skip_file_name_list = ['__init__', __name__]
 
-def run_all_hotfix_in_dir(dir : str = '.'):
-    """ 
-    找到目标目录下所有的.py文件，编译并在主进程执行 
+# 已经执行过的热更 {源文件绝对路径: (mtime_ns, size)}，源文件没有变化时不会重复执行
+applied_hotfix_dict = {}
+# 热更包中已经执行过的项 {文件名: 代码数据的hash}，同一个热更出现在新的包中时不会重复执行
+applied_bundle_entry_dict = {}
+
+def clear_applied_hotfix():
+    """ 清空执行记录，之后的 run_all_hotfix_in_dir 和 run_hotfix_bundle 会重新执行所有热更 """
+    applied_hotfix_dict.clear()
+    applied_bundle_entry_dict.clear()
+
+HotfixFile = namedtuple('HotfixFile', ['local_path', 'pyc_path', 'applied_key', 'applied_version'])
+
+def scan_hotfix_dir(dir : str = '.') -> list:
+    """
+    目标目录下需要执行的热更(新增或修改过的.py)，按文件名排序
+    已经执行过且没有修改的文件只需要一次 stat
+    """
+    with os.scandir(dir) as entries:
+        entries = sorted((entry for entry in entries if entry.name.endswith('.py') and entry.is_file()), key=lambda entry: entry.name)
+    hotfix_files = []
+    for entry in entries:
+        file_name = entry.name[:-len('.py')]
+        if file_name in skip_file_name_list:
+            continue
+        source_stat = entry.stat()
+        applied_key = os.path.abspath(entry.path)
+        applied_version = (source_stat.st_mtime_ns, source_stat.st_size)
+        if applied_hotfix_dict.get(applied_key) == applied_version:
+            continue
+        hotfix_files.append(HotfixFile(entry.path, os.path.join(dir, f'{file_name}.pyc'), applied_key, applied_version))
+    return hotfix_files
+
+def compile_hotfix_file(local_path : str, pyc_path : str) -> tuple:
+    """
+    pyc 不是最新时重新编译(写入 hash 模式的 pyc)，返回 (是否编译, marshal 后的代码对象)
+    编译失败抛出 py_compile.PyCompileError；可以在子进程中执行
+    """
+    compiled = False
+    if not is_pyc_up_to_date(local_path, pyc_path):
+        py_compile.compile(f'{local_path}', cfile=f'{pyc_path}', doraise=True, invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+        compiled = True
+    with open(f"{pyc_path}", 'rb') as f:
+        f.seek(PYC_HEADER_SIZE)
+        return compiled, f.read()
+
+def try_compile_hotfix_file(local_path : str, pyc_path : str) -> tuple:
+    """
+    与 compile_hotfix_file 一致，编译失败时不抛出，返回 (False, None, 错误信息)，成功时错误信息为空字符串
+    在进程池中使用: PyCompileError 不能在主进程中反序列化，抛出会导致进程池损坏
+    """
+    try:
+        compiled, code_data = compile_hotfix_file(local_path, pyc_path)
+    except py_compile.PyCompileError as e:
+        return False, None, e.msg
+    except OSError as e:
+        # 扫描之后文件被删除或无法读取
+        return False, None, f'{local_path}: {e}'
+    return compiled, code_data, ''
+
+def run_all_hotfix_in_dir(dir : str = '.') -> list:
+    """
+    找到目标目录下所有的.py文件，编译并在主进程执行
     默认寻找本目录下所有.py文件
+    按文件名顺序执行，已经执行过且没有修改的文件只需要一次 stat；pyc 是最新的时候不重新编译
+    返回本次执行的文件路径
+    编译会阻塞调用线程，主循环中使用 HotfixLoader 在后台编译
+    所有文件在同一个 hotfix_batch 中执行，有文件执行出错时 update_func 的替换都不会生效
+    撤销见 rollback_last_hotfix
     """
-    for file in os.listdir(dir):
-        if file.endswith('.py'):
-            file_name = file.replace('.py', '')
-            if file_name in skip_file_name_list:
+    applied_files = []
+    with hotfix_batch():
+        for hotfix_file in scan_hotfix_dir(dir):
+            _, code_data, error = try_compile_hotfix_file(hotfix_file.local_path, hotfix_file.pyc_path)
+            if error:
+                print(f'hotfix compile error: {error}')
                 continue
-            local_path = os.path.join(dir, file)
-            pyc_path = os.path.join(dir, f'{file_name}.pyc')
+            eval(marshal.loads(code_data))
+            applied_files.append(hotfix_file)
+    for hotfix_file in applied_files:
+        applied_hotfix_dict[hotfix_file.applied_key] = hotfix_file.applied_version
+    return [hotfix_file.local_path for hotfix_file in applied_files]
+
+def run_hotfix_bundle(bundle_path : str) -> list:
+    """
+    执行热更包(见 hotfix_bundle.py)中还没有执行过的项，返回本次执行的文件名
+    通过 mmap 读取，只读取头部、manifest 和需要执行的项，不需要编译
+    包的格式、python 版本或内容校验不通过时抛出 HotfixBundleError，不执行任何热更
+    所有项在同一个 hotfix_batch 中执行
+    """
+    with open(bundle_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return run_hotfix_bundle_data(buffer)
+
+def run_hotfix_bundle_data(buffer) -> list:
+    """ 与 run_hotfix_bundle 一致，buffer 为热更包的内容(bytes 或 mmap)，例如从其他进程收到的热更包 """
+    _, data_offset, entries = read_bundle_manifest(buffer)
+    # 先读取并校验所有需要执行的项，包损坏时不会只执行一部分
+    pending = [(entry, read_bundle_entry(buffer, data_offset, entry)) for entry in entries
+               if applied_bundle_entry_dict.get(entry.name) != entry.hash]
+    with hotfix_batch():
+        for entry, code_data in pending:
+            eval(marshal.loads(code_data))
+    for entry, _ in pending:
+        applied_bundle_entry_dict[entry.name] = entry.hash
+    return [entry.name for entry, _ in pending]
+
+class HotfixLoader:
+    """
+    在后台编译热更，主线程只执行编译好的代码对象，主循环的停顿与需要编译的文件数无关
+    dir: 热更目录
+    max_workers: 编译进程数，默认为 cpu 数
+    use_process: 为True时在进程池中编译(编译占用 GIL，线程中编译仍会拖慢主线程)，为False时使用线程池
+    用法(主循环中):
+        hotfix_loader = HotfixLoader('hotfix_file')
+        hotfix_loader.start()
+        ...
+        if hotfix_loader.is_ready():
+            hotfix_loader.apply()
+    进程池在 Windows 上需要主脚本有 if __name__ == '__main__' 保护
+    rollback() 撤销最近一次 apply 中 update_func/update_func_by_name 的替换(范围见 HotfixBatch.rollback)
+    """
+    def __init__(self, dir : str = '.', max_workers = None, use_process = True):
+        self.dir = dir
+        self.max_workers = max_workers
+        self.use_process = use_process
+        self.compile_count = 0
+        self.prepare_time = 0.0
+        self.pause_time = 0.0
+        self._thread = None
+        # [(HotfixFile, 代码对象)]，准备完成前为None
+        self._prepared = None
+        # 最近一次 apply 的批次，rollback 后为None
+        self.last_batch = None
+
+    def start(self) -> bool:
+        """ 开始在后台扫描和编译，上一次还没有完成时返回False """
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._prepared = None
+        self._thread = threading.Thread(target=self._prepare, name='hotfix_loader', daemon=True)
+        self._thread.start()
+        return True
+
+    def _compile_all(self, hotfix_files : list, executor_type) -> list:
+        """ 按文件名顺序返回 [(是否编译, marshal 后的代码对象, 错误信息)] """
+        with executor_type(max_workers=self.max_workers) as executor:
+            return list(executor.map(try_compile_hotfix_file,
+                                     [hotfix_file.local_path for hotfix_file in hotfix_files],
+                                     [hotfix_file.pyc_path for hotfix_file in hotfix_files]))
+
+    def _prepare(self):
+        start_time = time.perf_counter()
+        hotfix_files = scan_hotfix_dir(self.dir)
+        prepared = []
+        compile_count = 0
+        if hotfix_files:
+            try:
+                results = self._compile_all(hotfix_files, ProcessPoolExecutor if self.use_process else ThreadPoolExecutor)
+            except (BrokenProcessPool, OSError):
+                if not self.use_process:
+                    raise
+                # 子进程异常退出或无法创建进程，本次改为在线程中编译，下次 start 重新创建进程池
+                traceback.print_exc()
+                print('hotfix compile process pool failed, fall back to threads')
+                results = self._compile_all(hotfix_files, ThreadPoolExecutor)
+            # 按文件名顺序收集，执行顺序与 run_all_hotfix_in_dir 一致
+            for hotfix_file, (compiled, code_data, error) in zip(hotfix_files, results):
+                if error:
+                    print(f'hotfix compile error: {error}')
+                    continue
+                compile_count += compiled
+                prepared.append((hotfix_file, marshal.loads(code_data)))
+        # 函数索引第一次建立需要遍历所有模块，在后台完成，主线程 apply 时只有新导入的模块需要索引
+        get_function_index().sync_modules()
+        self.compile_count = compile_count
+        self.prepare_time = time.perf_counter() - start_time
+        self._prepared = prepared
+
+    def is_ready(self) -> bool:
+        return self._prepared is not None
+
+    def apply(self) -> list:
+        """
+        在主线程中按文件名顺序执行准备好的热更，返回执行的文件路径
+        还没有准备好时返回空列表
+        """
+        prepared = self._prepared
+        if prepared is None:
+            return []
+        self._prepared = None
+        start_time = time.perf_counter()
+        applied_files = []
+        try:
+            with hotfix_batch() as batch:
+                for hotfix_file, code_obj in prepared:
+                    # 准备期间已经用 run_all_hotfix_in_dir 执行过的不再执行
+                    if applied_hotfix_dict.get(hotfix_file.applied_key) == hotfix_file.applied_version:
+                        continue
+                    eval(code_obj)
+                    applied_files.append(hotfix_file)
+        except Exception:
+            # 整批不生效，主循环继续运行，修复热更文件后重新 start
+            traceback.print_exc()
+            print(f'hotfix apply failed, {len(prepared)} files not applied')
+            return []
+        for hotfix_file in applied_files:
+            applied_hotfix_dict[hotfix_file.applied_key] = hotfix_file.applied_version
+        self.last_batch = batch
+        self.pause_time = time.perf_counter() - start_time
+        print(f'hotfix apply {len(applied_files)} files, main loop pause {self.pause_time * 1000:.2f}ms '
+              f'(patch {len(batch)} functions in {batch.pause_time * 1000:.3f}ms, '
+              f'background prepare {self.prepare_time * 1000:.2f}ms, compiled {self.compile_count} files)')
+        return [hotfix_file.local_path for hotfix_file in applied_files]
 
-            py_compile.compile(f'{local_path}', cfile=f'{pyc_path}')
-            with open(f"{pyc_path}", 'rb') as f:
-                try_to_run_hotfix_file(f)
+    def rollback(self) -> int:
+        """
+        撤销最近一次 apply 替换的函数，返回恢复的函数个数，没有可以撤销的批次时返回0
+        热更文件仍记为已执行，文件再次修改后才会重新执行
+        """
+        batch = self.last_batch
+        if batch is None or not batch.applied:
+            return 0
+        batch.rollback()
+        self.last_batch = None
+        print(f'hotfix rollback {len(batch)} functions in {batch.pause_time * 1000:.3f}ms')
+        return len(batch)
+
+class HotfixPatchError(Exception):
+    """ 批量替换的检查没有通过，或替换过程中出错(已经回滚) """
+    def __init__(self, errors : list):
+        self.errors = errors
+        super().__init__('\n'.join(errors))
+
+def get_func_state(func) -> tuple:
+    return func.__code__, func.__dict__, func.__defaults__, func.__kwdefaults__
+
+def set_func_state(func, state : tuple):
+    func.__code__, func.__dict__, func.__defaults__, func.__kwdefaults__ = state
+
+def check_func_patch(old_func, new_func) -> str:
+    """ 检查能否用 new_func 替换 old_func，返回错误信息，可以替换时返回空字符串 """
+    if not isinstance(old_func, types.FunctionType) or not isinstance(new_func, types.FunctionType):
+        return f'{old_func!r} -> {new_func!r}: 只能替换 python 函数'
+    # 闭包的 __closure__ 不会随 __code__ 替换，自由变量必须一一对应，数量不同时 setattr 会抛出 ValueError
+    old_freevars = old_func.__code__.co_freevars
+    new_freevars = new_func.__code__.co_freevars
+    if old_freevars != new_freevars:
+        return f'{old_func.__qualname__}: 自由变量不一致 {old_freevars} -> {new_freevars}'
+    return ''
+
+class HotfixBatch:
+    """
+    批量替换函数，先记录所有替换并检查，再一次性替换，出错时全部回滚
+    用法:
+        batch = HotfixBatch()
+        batch.add(utils_reloaded.get_closure_value, new_get_closure_value)
+        batch.apply()
+        ...
+        batch.rollback()
+    """
+    def __init__(self):
+        # {id(old_func): [old_func, new_func, 替换前的状态]}，同一个函数多次替换时使用最后一次
+        self._patches = {}
+        self.applied = False
+        # 最近一次 apply/rollback 中替换所用的时间(秒)
+        self.pause_time = 0.0
+
+    def __len__(self):
+        return len(self._patches)
+
+    def add(self, old_func, new_func):
+        if self.applied:
+            raise HotfixPatchError(['batch already applied'])
+        patch = self._patches.get(id(old_func))
+        if patch is None:
+            self._patches[id(old_func)] = [old_func, new_func, None]
+        else:
+            patch[1] = new_func
+
+    def get_new_func(self, old_func):
+        """ old_func 在批次中等待替换的新函数，没有时返回None """
+        patch = self._patches.get(id(old_func))
+        return None if patch is None else patch[1]
+
+    def validate(self) -> list:
+        """ 返回所有检查不通过的错误信息 """
+        errors = []
+        for old_func, new_func, _ in self._patches.values():
+            error = check_func_patch(old_func, new_func)
+            if error:
+                errors.append(error)
+        return errors
+
+    def apply(self):
+        """ 检查全部通过后一次性替换，检查不通过或替换出错时抛出 HotfixPatchError，不会留下部分替换的函数 """
+        if self.applied:
+            return
+        errors = self.validate()
+        if errors:
+            raise HotfixPatchError(errors)
+        # 替换前准备好所有新旧状态，替换时只做赋值
+        patches = list(self._patches.values())
+        for patch in patches:
+            patch[2] = get_func_state(patch[0])
+        new_states = [get_func_state(new_func) for _, new_func, _ in patches]
+        done_count = 0
+        start_time = time.perf_counter()
+        try:
+            for patch, new_state in zip(patches, new_states):
+                set_func_state(patch[0], new_state)
+                done_count += 1
+        except Exception as e:
+            for old_func, _, old_state in patches[:done_count + 1]:
+                set_func_state(old_func, old_state)
+            raise HotfixPatchError([f'{patches[done_count][0].__qualname__}: {e!r}']) from e
+        finally:
+            self.pause_time = time.perf_counter() - start_time
+        self.applied = True
+
+    def rollback(self):
+        """
+        恢复 apply 前的所有函数(__code__、__dict__、默认参数)
+        只撤销函数替换，热更脚本中的其他修改(模块变量、直接 setattr 的属性等)不会撤销
+        """
+        if not self.applied:
+            return
+        start_time = time.perf_counter()
+        for old_func, _, old_state in reversed(list(self._patches.values())):
+            set_func_state(old_func, old_state)
+        self.pause_time = time.perf_counter() - start_time
+        self.applied = False
+
+# 当前正在执行的 hotfix_batch，update_func 在批次中只记录不替换
+_active_batch = None
+# 最近一次替换了函数的 hotfix_batch，见 rollback_last_hotfix
+_last_applied_batch = None
+
+@contextlib.contextmanager
+def hotfix_batch():
+    """
+    在批次中执行热更脚本，脚本中的 update_func 先记录下来，全部执行成功后一次性替换
+    脚本出错时不替换任何函数；替换检查不通过时抛出 HotfixPatchError
+    """
+    global _active_batch, _last_applied_batch
+    batch = HotfixBatch()
+    previous_batch = _active_batch
+    _active_batch = batch
+    if _function_index is not None:
+        # 上次热更之后创建的闭包需要重新收集，每个批次中每个嵌套函数最多扫描一次
+        _function_index.invalidate_closures()
+    try:
+        yield batch
+    finally:
+        _active_batch = previous_batch
+    batch.apply()
+    if len(batch):
+        _last_applied_batch = batch
+
+def rollback_last_hotfix() -> int:
+    """
+    撤销最近一次 hotfix_batch(run_all_hotfix_in_dir、run_hotfix_bundle、HotfixLoader.apply)替换的函数
+    返回恢复的函数个数，只能撤销一次，再次调用返回0；范围见 HotfixBatch.rollback
+    """
+    global _last_applied_batch
+    batch = _last_applied_batch
+    if batch is None or not batch.applied:
+        return 0
+    batch.rollback()
+    _last_applied_batch = None
+    return len(batch)
 
 def update_func(old_func, new_func):
+    """ 用 new_func 替换 old_func 的代码，在 hotfix_batch 中调用时批次结束才替换 """
+    if _active_batch is not None:
+        _active_batch.add(old_func, new_func)
+        return
     setattr(old_func, '__code__', new_func.__code__)
     setattr(old_func, '__dict__', new_func.__dict__) # 防止有使用方法属性cache数据
     setattr(old_func, '__defaults__', new_func.__defaults__)
-    setattr(old_func, '__kwdefaults__', new_func.__kwdefaults__)
\ No newline at end of file
+    setattr(old_func, '__kwdefaults__', new_func.__kwdefaults__)
+
+_function_index = None
+
+def get_function_index() -> FunctionIndex:
+    """ 第一次使用时创建，之后新导入的模块在查询时加入 """
+    global _function_index
+    if _function_index is None:
+        _function_index = FunctionIndex()
+    return _function_index
+
+def _copy_func(func, code : types.CodeType):
+    """ 与 func 相同(闭包、默认参数、属性)，只有代码不同的函数 """
+    new_func = types.FunctionType(code, func.__globals__, func.__name__, func.__defaults__, func.__closure__)
+    new_func.__kwdefaults__ = func.__kwdefaults__
+    new_func.__dict__ = func.__dict__
+    return new_func
+
+def _replace_nested_code(index : FunctionIndex, name : str, new_code : types.CodeType):
+    """
+    替换外层函数 co_consts 中的嵌套函数代码，之后新创建的闭包也使用新代码
+    同一批次中替换同一个外层函数的多个嵌套函数时，在批次中等待替换的外层函数代码上修改，前面的替换不会丢失
+    """
+    parent_name = index.get_parent(name)
+    if parent_name is None:
+        return
+    qualname = get_code_qualname(new_code)
+    new_parent_code = None
+    for parent in index.resolve(parent_name):
+        pending_func = _active_batch.get_new_func(parent) if _active_batch is not None else None
+        parent_code = pending_func.__code__ if pending_func is not None else parent.__code__
+        consts = tuple(new_code if isinstance(const, types.CodeType) and get_code_qualname(const) == qualname else const for const in parent_code.co_consts)
+        new_parent_code = parent_code.replace(co_consts=consts)
+        update_func(parent, _copy_func(parent, new_parent_code))
+    if new_parent_code is not None and index.get_nested_code(parent_name) is not None:
+        index.add_closure_code(parent_name, new_parent_code)
+        _replace_nested_code(index, parent_name, new_parent_code)
+
+def update_func_by_name(name : str, new_func) -> int:
+    """
+    按名字替换所有存活的函数，返回替换的函数个数
+    name: module:qualname 或 module.qualname，例如 utils_reloaded.get_closure_value、class_reloaded:class_reloaded.nested_func.bar
+    嵌套函数会替换所有已经创建的闭包实例，同时替换外层函数中的代码，之后创建的闭包也是新代码
+    """
+    index = get_function_index()
+    targets = index.resolve(name)
+    nested_code = index.get_nested_code(name)
+    if nested_code is not None:
+        # 保留原来的名字，外层函数之后创建的闭包和索引都不受热更脚本中函数名的影响
+        code = new_func.__code__.replace(co_name=nested_code.co_name)
+        if hasattr(nested_code, 'co_qualname'):
+            code = code.replace(co_qualname=nested_code.co_qualname)
+        new_func = _copy_func(new_func, code)
+        index.add_closure_code(name, code)
+        _replace_nested_code(index, name, code)
+    if not targets and nested_code is None:
+        print(f'update_func_by_name: {name} not found')
+    for target in targets:
+        update_func(target, new_func)
+    return len(targets)
@@ -0,0 +1,4 @@
+import os, sys
+
+# 与 main.py 一样直接导入 test_reloader 下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
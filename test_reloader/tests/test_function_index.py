@@ -0,0 +1,85 @@
+import gc, sys, types
+import pytest
+import reloader_utils
+from function_index import FunctionIndex
+
+NESTED_SOURCE = """
+def outer():
+    def first():
+        return 'first-old'
+    def second():
+        return 'second-old'
+    return first(), second()
+"""
+
+def make_module(name, source):
+    module = types.ModuleType(name)
+    exec(source, module.__dict__)
+    return module
+
+@pytest.fixture
+def nested_module():
+    module = make_module('function_index_nested', NESTED_SOURCE)
+    sys.modules[module.__name__] = module
+    yield module
+    del sys.modules[module.__name__]
+
+def test_patch_two_nested_functions_in_one_batch(nested_module):
+    def first():
+        return 'first-new'
+    def second():
+        return 'second-new'
+    with reloader_utils.hotfix_batch():
+        reloader_utils.update_func_by_name('function_index_nested:outer.first', first)
+        reloader_utils.update_func_by_name('function_index_nested:outer.second', second)
+    # 两次替换都修改同一个外层函数，前面的替换不能丢失
+    assert nested_module.outer() == ('first-new', 'second-new')
+
+def test_closure_instances_are_patched(nested_module):
+    exec("def make_counter():\n    count = 1\n    def get():\n        return count\n    return get\n", nested_module.__dict__)
+    counters = [nested_module.make_counter() for _ in range(3)]
+    def get():
+        return count + 100
+    count = 0
+    with reloader_utils.hotfix_batch():
+        assert reloader_utils.update_func_by_name('function_index_nested:make_counter.get', get) == 3
+    assert [counter() for counter in counters] == [101, 101, 101]
+    # 外层函数之后创建的闭包也是新代码
+    counters.append(nested_module.make_counter())
+    assert counters[-1]() == 101
+    # 已经替换过代码的闭包实例和之后创建的闭包，再次替换时也能找到
+    def get():
+        return count + 200
+    with reloader_utils.hotfix_batch():
+        reloader_utils.update_func_by_name('function_index_nested:make_counter.get', get)
+    assert [counter() for counter in counters] == [201, 201, 201, 201]
+
+def test_replaced_module_is_reindexed():
+    name = 'function_index_replaced'
+    sys.modules[name] = make_module(name, 'def old_func():\n    pass\n')
+    try:
+        index = FunctionIndex()
+        assert index.resolve(f'{name}:old_func')
+        # 模块数量不变，只替换模块对象
+        sys.modules[name] = make_module(name, 'def new_func():\n    pass\n')
+        assert index.resolve(f'{name}:new_func')
+    finally:
+        del sys.modules[name]
+
+def test_closure_scan_only_passes_the_requested_code(nested_module, monkeypatch):
+    exec("def make_adder(step):\n    scale = lambda value: value * 2\n    def add(value):\n        return [scale(item) + step for item in value]\n    return add\n", nested_module.__dict__)
+    adders = [nested_module.make_adder(step) for step in range(3)]
+    index = FunctionIndex()
+    # lambda 和推导式的代码不能按名字热更，不加入索引
+    assert index.get_nested_code('function_index_nested:make_adder.<lambda>') is None
+    assert index.get_nested_code('function_index_nested:make_adder.add') is not None
+    scanned_codes = []
+    get_referrers = gc.get_referrers
+    def counting_get_referrers(*objs):
+        scanned_codes.append(objs)
+        return get_referrers(*objs)
+    monkeypatch.setattr(gc, 'get_referrers', counting_get_referrers)
+    assert sorted(id(adder) for adder in index.resolve('function_index_nested:make_adder.add')) == sorted(id(adder) for adder in adders)
+    # 同一批次中再次查询不重新扫描
+    index.resolve('function_index_nested:make_adder.add')
+    assert scanned_codes == [(adders[0].__code__,)]
@@ -0,0 +1,94 @@
+import os, sys, types
+import pytest
+import reloader_utils
+from reloader_utils import HotfixLoader
+
+TARGET_MODULE_NAME = 'hotfix_loader_target'
+
+# 替换 get_value 并修改模块变量，用函数包起来，不在 reloader_utils 的全局变量中留下名字
+PATCH_HOTFIX = f"""
+def reload_func():
+    import reloader_utils, {TARGET_MODULE_NAME}
+    def get_value():
+        return 'new'
+    reloader_utils.update_func({TARGET_MODULE_NAME}.get_value, get_value)
+    {TARGET_MODULE_NAME}.value = 'new'
+reload_func()
+"""
+
+@pytest.fixture
+def target_module():
+    module = types.ModuleType(TARGET_MODULE_NAME)
+    module.value = 'old'
+    exec("def get_value():\n    return 'old'\n", module.__dict__)
+    sys.modules[TARGET_MODULE_NAME] = module
+    reloader_utils.clear_applied_hotfix()
+    yield module
+    del sys.modules[TARGET_MODULE_NAME]
+    reloader_utils.clear_applied_hotfix()
+
+def wait_prepared(hotfix_loader : HotfixLoader):
+    hotfix_loader._thread.join(30)
+    assert hotfix_loader.is_ready()
+
+@pytest.mark.parametrize('use_process', [True, False])
+def test_bad_hotfix_does_not_block_good_hotfix(tmp_path, target_module, use_process):
+    # 按文件名顺序，编译出错的文件在前
+    (tmp_path / 'a_bad.py').write_text('def broken(:\n')
+    (tmp_path / 'b_good.py').write_text(f'import {TARGET_MODULE_NAME}\n{TARGET_MODULE_NAME}.value = "new"\n')
+    hotfix_loader = HotfixLoader(str(tmp_path), max_workers=2, use_process=use_process)
+    assert hotfix_loader.start()
+    wait_prepared(hotfix_loader)
+    applied = hotfix_loader.apply()
+    assert applied == [str(tmp_path / 'b_good.py')]
+    assert target_module.value == 'new'
+
+    # 修复后下一次 start 能执行之前出错的文件
+    (tmp_path / 'a_bad.py').write_text(f'import {TARGET_MODULE_NAME}\n{TARGET_MODULE_NAME}.fixed = True\n')
+    assert hotfix_loader.start()
+    wait_prepared(hotfix_loader)
+    assert hotfix_loader.apply() == [str(tmp_path / 'a_bad.py')]
+    assert target_module.fixed
+
+def test_rollback_last_hotfix(tmp_path, target_module):
+    (tmp_path / 'patch.py').write_text(PATCH_HOTFIX)
+    get_value = target_module.get_value
+    assert reloader_utils.run_all_hotfix_in_dir(str(tmp_path)) == [str(tmp_path / 'patch.py')]
+    assert get_value() == 'new'
+    assert reloader_utils.rollback_last_hotfix() == 1
+    assert get_value() == 'old'
+    # 只撤销函数替换，模块变量保持热更后的值
+    assert target_module.value == 'new'
+    assert reloader_utils.rollback_last_hotfix() == 0
+
+def test_hotfix_loader_rollback(tmp_path, target_module):
+    (tmp_path / 'patch.py').write_text(PATCH_HOTFIX)
+    get_value = target_module.get_value
+    hotfix_loader = HotfixLoader(str(tmp_path), use_process=False)
+    assert hotfix_loader.rollback() == 0
+    hotfix_loader.start()
+    wait_prepared(hotfix_loader)
+    hotfix_loader.apply()
+    assert get_value() == 'new'
+    assert hotfix_loader.rollback() == 1
+    assert get_value() == 'old'
+    assert hotfix_loader.rollback() == 0
+    # 文件没有修改时不会重新执行
+    hotfix_loader.start()
+    wait_prepared(hotfix_loader)
+    assert hotfix_loader.apply() == []
+    assert get_value() == 'old'
+
+def test_same_size_edit_in_same_second_is_recompiled(tmp_path, target_module):
+    hotfix_path = tmp_path / 'patch.py'
+    hotfix_path.write_text(f'import {TARGET_MODULE_NAME}\n{TARGET_MODULE_NAME}.value = "aaa"\n')
+    second_ns = hotfix_path.stat().st_mtime_ns // 1_000_000_000 * 1_000_000_000
+    os.utime(hotfix_path, ns=(second_ns, second_ns + 1000))
+    assert reloader_utils.run_all_hotfix_in_dir(str(tmp_path)) == [str(hotfix_path)]
+    assert target_module.value == 'aaa'
+
+    # 大小不变、mtime 在同一秒内，只看 pyc 头部的秒级 mtime 和大小时会执行旧代码
+    hotfix_path.write_text(f'import {TARGET_MODULE_NAME}\n{TARGET_MODULE_NAME}.value = "bbb"\n')
+    os.utime(hotfix_path, ns=(second_ns, second_ns + 2000))
+    assert reloader_utils.run_all_hotfix_in_dir(str(tmp_path)) == [str(hotfix_path)]
+    assert target_module.value == 'bbb'